@@ -0,0 +1 @@
+# Bộ benchmark offline cho detection, recognition và pipeline (chạy: python -m benchmarks.run)
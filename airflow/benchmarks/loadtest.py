@@ -0,0 +1,253 @@
+"""
+Load test tầng API/DAG với model giả (stand-in) hoặc services thật
+
+Mỗi mức tải chạy trong duration giây, báo cáo throughput, p50/p95/p99, thời gian chờ trong hàng đợi
+(open-loop) và tỉ lệ lỗi -> dùng để chọn số worker / kích thước pool trước khi lên production.
+
+Ví dụ (chạy trong thư mục gốc của repo):
+    # Closed-loop: N client gửi liên tục, tăng dần N
+    python -m benchmarks.loadtest --target pipeline --concurrency 1,2,4,8,16
+    # Open-loop: request đến theo Poisson với tốc độ cho trước (req/s)
+    python -m benchmarks.loadtest --target pipeline --rate 5,10,20,40 --max-workers 64
+    # Model giả chiếm CPU thay vì sleep, 200MB RAM thường trú
+    python -m benchmarks.loadtest --mode cpu --resident-mb 200 --recog-latency-ms 120
+    # Services thật (compose stack) thay vì stand-in
+    python -m benchmarks.loadtest --preproc-url http://localhost:5000 --recog-url http://localhost:5001 \\
+        --post-url http://localhost:5002 --preprocess-model ssd_mobilenet_v2 --recognition-model easyocr_vi_en
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Thêm đường dẫn gốc để import được src.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+logger = logging.getLogger("loadtest")
+
+
+def make_target(name, urls, args, image_path):
+    """Hàm gửi 1 đơn vị tải: 1 request API hoặc 1 lượt chạy 3 task của DAG ocr_pipeline"""
+    from src.pipeline.api_client import call_api_step
+    from src.pipeline.model_readiness import call_model_step
+
+    if name == "preprocess":
+        def run():
+            call_api_step(urls["preproc"], "process",
+                          {"image_path": image_path, "model_name": args.preprocess_model, "auto_load": True},
+                          "Load-Preproc")
+        return run
+
+    if name == "recognize":
+        def run():
+            call_api_step(urls["recog"], "predict",
+                          {"image_path": image_path, "model_name": args.recognition_model, "auto_load": True},
+                          "Load-Recog")
+        return run
+
+    if name == "pipeline":
+        # Cùng payload như 3 task của ocr_pipeline (preprocess -> recognition -> postprocess)
+        def run():
+            pre = call_model_step(urls["preproc"], "process", {
+                "image_path": image_path, "model_name": args.preprocess_model, "output_artifact": True
+            }, "Load-Preproc")
+            recog = call_model_step(urls["recog"], "predict", {
+                "image_path": image_path, "model_name": args.recognition_model,
+                "detection_data": pre.get("data"), "output_artifact": True
+            }, "Load-Recog")
+            call_model_step(urls["post"], "process", {
+                "input_path": recog.get("data"), "model_name": args.postprocess_model
+            }, "Load-Post")
+        return run
+
+    raise ValueError(f"Unknown target: {name}")
+
+
+def _summarize(records, wall_seconds):
+    """records: [(queue_wait_ms, latency_ms, ok)]"""
+    ok = [r for r in records if r[2]]
+    latencies = np.array([r[1] for r in ok]) if ok else np.array([np.nan])
+    waits = np.array([r[0] for r in records]) if records else np.array([0.0])
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "error_rate": round((len(records) - len(ok)) / len(records), 4) if records else 0.0,
+        "throughput_per_s": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        "p50_ms": round(float(np.nanpercentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.nanpercentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.nanpercentile(latencies, 99)), 2),
+        "queue_wait_mean_ms": round(float(waits.mean()), 2),
+        "queue_wait_p95_ms": round(float(np.percentile(waits, 95)), 2),
+    }
+
+
+def _timed_call(target, scheduled_at, records, lock):
+    start = time.perf_counter()
+    try:
+        target()
+        ok = True
+    except Exception as e:
+        logger.debug(f"Request failed: {e}")
+        ok = False
+    end = time.perf_counter()
+    with lock:
+        records.append(((start - scheduled_at) * 1000, (end - start) * 1000, ok))
+
+
+def run_closed_loop(target, concurrency, duration):
+    """concurrency client, mỗi client gửi request mới ngay khi request trước xong"""
+    records, lock = [], threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            _timed_call(target, time.perf_counter(), records, lock)
+
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _summarize(records, time.perf_counter() - wall_start)
+
+
+def run_open_loop(target, rate, duration, max_workers, seed=0):
+    """
+    Request đến theo Poisson (rate req/s) bất kể hệ thống xử lý kịp hay không
+    Khi quá tải, queue_wait (thời gian chờ worker trống) tăng dần -> thấy rõ điểm bão hòa
+    """
+    records, lock = [], threading.Lock()
+    rng = np.random.default_rng(seed)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        next_at = wall_start
+        while next_at < wall_start + duration:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(_timed_call, target, next_at, records, lock)
+            next_at += rng.exponential(1.0 / rate)
+    return _summarize(records, time.perf_counter() - wall_start)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test cho OCR API/DAG tier")
+    parser.add_argument("--target", choices=["preprocess", "recognize", "pipeline"], default="pipeline")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Các mức closed-loop (bỏ qua nếu có --rate)")
+    parser.add_argument("--rate", default=None, help="Các mức open-loop (req/s), vd: 5,10,20")
+    parser.add_argument("--max-workers", type=int, default=64, help="Số worker tối đa của open-loop client")
+    parser.add_argument("--duration", type=float, default=10.0, help="Thời gian mỗi mức tải (giây)")
+    # Services thật; bỏ trống thì chạy 3 Flask app local với model giả
+    parser.add_argument("--preproc-url", default=None)
+    parser.add_argument("--recog-url", default=None)
+    parser.add_argument("--post-url", default=None)
+    parser.add_argument("--preprocess-model", default=None)
+    parser.add_argument("--recognition-model", default=None)
+    parser.add_argument("--postprocess-model", default="regex_invoice_vn")
+    # Profile của model giả
+    parser.add_argument("--detect-latency-ms", type=float, default=40.0)
+    parser.add_argument("--recog-latency-ms", type=float, default=80.0, help="Latency mỗi vùng text")
+    parser.add_argument("--num-boxes", type=int, default=3, help="Số vùng detector giả trả về")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--mode", choices=["sleep", "cpu"], default="sleep")
+    parser.add_argument("--resident-mb", type=float, default=0, help="RAM thường trú mỗi model giả")
+    parser.add_argument("--per-call-mb", type=float, default=0, help="RAM tạm mỗi lần gọi")
+    parser.add_argument("--base-port", type=int, default=15000)
+    parser.add_argument("--output", default="benchmarks/results/loadtest.json")
+    return parser.parse_args(argv)
+
+
+def print_report(report):
+    """Bảng throughput / tail latency / queueing theo mức tải"""
+    header = f"{'load':>8} {'req':>6} {'err%':>6} {'thr/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'wait_p95':>9}"
+    print(header)
+    print("-" * len(header))
+    for level in report["levels"]:
+        print(f"{level['load']:>8} {level['requests']:>6} {level['error_rate'] * 100:>6.1f} "
+              f"{level['throughput_per_s']:>8.2f} {level['p50_ms']:>9.1f} {level['p95_ms']:>9.1f} "
+              f"{level['p99_ms']:>9.1f} {level['queue_wait_p95_ms']:>9.1f}")
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    logger.setLevel(logging.INFO)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # Bỏ access log của từng request
+    args = parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="ocr_load_")
+    # Artifacts trung gian của lượt chạy pipeline ghi vào thư mục tạm (phải set trước khi import src.*)
+    os.environ.setdefault("ARTIFACT_DIR", os.path.join(workdir, "artifacts"))
+
+    from benchmarks.synthetic import generate_invoice
+    import cv2
+    image_path = os.path.join(workdir, "invoice.jpg")
+    cv2.imwrite(image_path, generate_invoice("small_clean")[0])
+
+    standin = not (args.preproc_url and args.recog_url and args.post_url)
+    services = None
+    if standin:
+        from benchmarks.standins import (
+            LatencyProfile, StandInDetector, StandInRecognizer, LocalServices, install_standins,
+            DETECTOR_MODEL, RECOGNIZER_MODEL
+        )
+        memory = {"resident_mb": args.resident_mb, "per_call_mb": args.per_call_mb}
+        install_standins(
+            StandInDetector(LatencyProfile(args.detect_latency_ms, args.jitter, args.mode, seed=1),
+                            num_boxes=args.num_boxes, **memory),
+            StandInRecognizer(LatencyProfile(args.recog_latency_ms, args.jitter, args.mode, seed=2), **memory)
+        )
+        args.preprocess_model = args.preprocess_model or DETECTOR_MODEL
+        args.recognition_model = args.recognition_model or RECOGNIZER_MODEL
+        services = LocalServices(base_port=args.base_port).__enter__()
+        urls = services.urls
+    else:
+        args.preprocess_model = args.preprocess_model or "ssd_mobilenet_v2"
+        args.recognition_model = args.recognition_model or "easyocr_vi_en"
+        urls = {"preproc": args.preproc_url, "recog": args.recog_url, "post": args.post_url}
+
+    target = make_target(args.target, urls, args, image_path)
+    target()  # Warm-up: load model / mở kết nối trước khi đo
+
+    report = {
+        "target": args.target,
+        "mode": "open_loop" if args.rate else "closed_loop",
+        "standin": standin,
+        "config": vars(args),
+        "levels": []
+    }
+    try:
+        if args.rate:
+            for rate in (float(r) for r in args.rate.split(",")):
+                level = run_open_loop(target, rate, args.duration, args.max_workers)
+                report["levels"].append({"load": f"{rate:g}/s", "rate": rate, **level})
+                logger.info(f"rate={rate}/s: {level}")
+        else:
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                level = run_closed_loop(target, concurrency, args.duration)
+                report["levels"].append({"load": f"c={concurrency}", "concurrency": concurrency, **level})
+                logger.info(f"concurrency={concurrency}: {level}")
+    finally:
+        if services:
+            services.__exit__(None, None, None)
+
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
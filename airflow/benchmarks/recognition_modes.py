@@ -0,0 +1,189 @@
+"""
+So sánh các chế độ chạy EasyOCR trên CPU: tốc độ và độ chính xác trên cùng bộ dòng chữ của hóa đơn giả
+
+Mỗi mode là 1 bộ tham số của EasyOCRRecognizer (giống load_config của /load_model). Với mỗi mode:
+throughput/p50/p95 trên từng dòng crop, CER so với ground truth và CER so với mode đầu tiên (mốc, mặc định fp32)
+-> thấy int8 / inference_mode đổi bao nhiêu độ chính xác lấy bao nhiêu tốc độ.
+
+Ví dụ (chạy trong image của recognition service, có easyocr + torch):
+    python -m benchmarks.recognition_modes --modes fp32,int8,int8_cpu_optimized --threads 4
+    python -m benchmarks.recognition_modes --modes fp32,int8_cpu_optimized --profiles small_clean --per-profile 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import logging
+
+# Thêm đường dẫn gốc để import được src.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cv2
+
+from src.utils.memory import get_rss_mb, release_memory
+from benchmarks.synthetic import PROFILES, write_invoice_set
+from benchmarks.stats import run_benchmark, character_error_rate
+
+logger = logging.getLogger("recognition_modes")
+
+# mode -> tham số EasyOCRRecognizer
+MODES = {
+    "fp32": {"quantize": False, "cpu_optimized": False},
+    "int8": {"quantize": True, "cpu_optimized": False},
+    "int8_cpu_optimized": {"quantize": True, "cpu_optimized": True},
+}
+
+# Box của dòng là box trước khi xoay: chỉ profile không nghiêng mới crop đúng từng dòng
+DEFAULT_PROFILES = [name for name, params in PROFILES.items() if not params["skew"]]
+
+
+def load_line_crops(samples, max_lines_per_image):
+    """[(crop BGR, text đúng)] cho từng dòng của các ảnh (đọc lại từ JPEG như ảnh upload thật)"""
+    crops = []
+    for sample in samples:
+        image = cv2.imread(sample["path"])
+        for (x1, y1, x2, y2), text in list(zip(sample["line_boxes"], sample["lines"]))[:max_lines_per_image]:
+            crops.append((image[y1:y2, x1:x2], text))
+    return crops
+
+
+def evaluate_mode(name, config, crops, iterations, num_threads=None, interop_threads=None):
+    """
+    Load Reader theo config, đo tốc độ + độ chính xác rồi unload
+
+    Returns:
+        (result dict, predictions)
+    """
+    from src.core.recognition import EasyOCRRecognizer
+
+    recognizer = EasyOCRRecognizer(
+        languages=['vi', 'en'], gpu=False,
+        num_threads=num_threads, interop_threads=interop_threads, **config
+    )
+    rss_before = get_rss_mb()
+    start = time.perf_counter()
+    recognizer.load_model()
+    load_ms = round((time.perf_counter() - start) * 1000, 1)
+    load_rss_mb = round(get_rss_mb() - rss_before, 1)
+    recognizer.warmup()
+
+    images = [crop for crop, _ in crops]
+    predictions = [recognizer.recognize(image, detail=0)["text"] for image in images]
+
+    result = run_benchmark(lambda image: recognizer.recognize(image, detail=0), images, iterations=iterations)
+    result.update(
+        config=config,
+        inference=recognizer.inference_settings(),
+        load_ms=load_ms,
+        load_rss_mb=load_rss_mb,
+        cer=character_error_rate(predictions, [text for _, text in crops]),
+        exact_line_rate=round(sum(p.split() == t.split() for p, (_, t) in zip(predictions, crops)) / len(crops), 4)
+    )
+
+    recognizer.unload_model()
+    del recognizer
+    release_memory()
+    logger.info(f"{name}: {result['throughput_per_s']} lines/s p50={result['p50_ms']}ms CER={result['cer']}")
+    return result, predictions
+
+
+def compare_modes(results, reference_predictions, predictions_by_mode):
+    """Tốc độ và CER của từng mode so với mode đầu tiên"""
+    reference_name = next(iter(results))
+    reference = results[reference_name]
+    comparison = {}
+    for name, result in results.items():
+        comparison[name] = {
+            "reference": reference_name,
+            "speedup": round(reference["p50_ms"] / result["p50_ms"], 2) if result["p50_ms"] else None,
+            "cer_delta": round(result["cer"] - reference["cer"], 4)
+            if result["cer"] is not None and reference["cer"] is not None else None,
+            # Mode khác mốc bao nhiêu ký tự (độc lập với lỗi chung của cả 2)
+            "cer_vs_reference": character_error_rate(predictions_by_mode[name], reference_predictions),
+            "load_rss_delta_mb": round(result["load_rss_mb"] - reference["load_rss_mb"], 1),
+        }
+    return comparison
+
+
+def print_report(results, comparison):
+    print(f"{'mode':<22}{'lines/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'CER':>8}{'ΔCER':>9}{'vs ref':>9}"
+          f"{'speedup':>9}{'load MB':>9}")
+    for name, result in results.items():
+        row = comparison[name]
+        print(f"{name:<22}{result['throughput_per_s']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['cer']:>8}{row['cer_delta']:>+9.4f}{row['cer_vs_reference']:>9}"
+              f"{row['speedup']:>8}x{result['load_rss_mb']:>9}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tốc độ vs độ chính xác của các chế độ chạy EasyOCR trên CPU")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Mode đầu tiên làm mốc; có: {','.join(MODES)}")
+    parser.add_argument("--profiles", default=",".join(DEFAULT_PROFILES), help="Profile ảnh hóa đơn giả (không nghiêng)")
+    parser.add_argument("--per-profile", type=int, default=3)
+    parser.add_argument("--max-lines-per-image", type=int, default=15)
+    parser.add_argument("--iterations", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (mặc định: OCR_TORCH_THREADS)")
+    parser.add_argument("--interop-threads", type=int, default=None, help="torch inter-op threads")
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--output", default="benchmarks/results/recognition_modes.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    logger.setLevel(logging.INFO)
+    args = parse_args(argv)
+
+    try:
+        import easyocr  # noqa: F401
+    except ImportError:
+        logger.error("easyocr is not installed: run inside the recognition service image")
+        return 2
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        logger.error(f"Unknown modes: {', '.join(unknown)}")
+        return 2
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ocr_modes_")
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    samples = write_invoice_set(os.path.join(workdir, "images"), profiles=profiles, per_profile=args.per_profile)
+    crops = load_line_crops(samples, args.max_lines_per_image)
+    logger.info(f"{len(crops)} line crops from {len(samples)} synthetic invoices")
+
+    results, predictions_by_mode = {}, {}
+    for name in modes:
+        results[name], predictions_by_mode[name] = evaluate_mode(
+            name, MODES[name], crops, args.iterations,
+            num_threads=args.threads, interop_threads=args.interop_threads
+        )
+    comparison = compare_modes(results, predictions_by_mode[modes[0]], predictions_by_mode)
+    print_report(results, comparison)
+
+    if args.output:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "profiles": profiles,
+                "num_lines": len(crops),
+                "iterations": args.iterations,
+            },
+            "modes": results,
+            "comparison": comparison
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Chạy benchmark offline và ghi kết quả JSON (throughput, p50/p95/p99, peak RSS)
+
+Ví dụ (chạy trong thư mục gốc của repo):
+    python -m benchmarks.run --suites preprocess,apps --output benchmarks/results/latest.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json        # exit code 1 nếu có regression
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json   # cập nhật baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import logging
+
+# Thêm đường dẫn gốc để import được src.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cv2
+import numpy as np
+
+from src.core.detection import read_image_header
+from benchmarks.synthetic import PROFILES, write_invoice_set
+from benchmarks.stats import run_benchmark, compare_to_baseline
+
+logger = logging.getLogger("benchmarks")
+
+SUITES = ("preprocess", "detection", "recognition", "pipeline", "apps")
+
+
+class SkipBenchmark(Exception):
+    """Benchmark không chạy được trong môi trường hiện tại (thiếu weights, thiếu thư viện...)"""
+
+
+def _strip_boxes(image_path, num_strips=8):
+    """Boxes giả (các dải ngang) để benchmark crop không phụ thuộc detector"""
+    w, h, _ = read_image_header(image_path)
+    step = h // num_strips
+    return [{"bbox": [0, i * step, w, (i + 1) * step], "confidence": 1.0} for i in range(num_strips)]
+
+
+class BenchmarkContext:
+    """Load model 1 lần, dùng chung cho các benchmark cần nó"""
+
+    def __init__(self, args, samples):
+        self.args = args
+        self.samples = samples
+        self.paths = [sample["path"] for sample in samples]
+        self._detector = None
+        self._recognizer = None
+
+    def detector(self):
+        if self._detector is None:
+            if not (os.path.exists(self.args.ssd_model) and os.path.exists(self.args.ssd_config)):
+                raise SkipBenchmark(f"SSD weights not found: {self.args.ssd_model}")
+            from src.core.detection import SSDMobileNetDetector
+            self._detector = SSDMobileNetDetector(
+                model_path=self.args.ssd_model, config_path=self.args.ssd_config,
+                backend=self.args.dnn_backend, target=self.args.dnn_target, num_threads=self.args.dnn_threads
+            )
+            self._detector.load_model()
+            logger.info(f"SSD inference settings: {self._detector.inference_settings()}")
+        return self._detector
+
+    def recognizer(self):
+        if self._recognizer is None:
+            try:
+                import easyocr  # noqa: F401
+            except ImportError:
+                raise SkipBenchmark("easyocr is not installed")
+            from src.core.recognition import EasyOCRRecognizer
+            self._recognizer = EasyOCRRecognizer(languages=['vi', 'en'], gpu=False)
+            self._recognizer.load_model()
+        return self._recognizer
+
+
+def bench_preprocess(ctx):
+    from src.core.preprocessing import DocumentPreprocessor
+    preprocessor = DocumentPreprocessor(output_dir=os.path.join(ctx.args.workdir, "preprocessed"))
+    preprocessor.load_model()
+
+    yield "preprocess.document_pipeline", lambda: run_benchmark(
+        preprocessor.process, ctx.paths, iterations=ctx.args.iterations
+    )
+
+
+def bench_detection(ctx):
+    yield "detection.detect", lambda: run_benchmark(
+        ctx.detector().detect, ctx.paths, iterations=ctx.args.iterations
+    )
+
+    # Crop dùng boxes giả nên đo được cả khi không có weights SSD
+    boxes = {path: _strip_boxes(path) for path in ctx.paths}
+    from src.core.detection import crop_detections
+    yield "detection.crop_detections", lambda: run_benchmark(
+        lambda path: crop_detections(path, boxes[path]), ctx.paths, iterations=ctx.args.iterations
+    )
+
+
+def bench_recognition(ctx):
+    # OCR cả trang rất chậm trên CPU: đo trên vùng crop (dải ngang) như trong pipeline thật
+    crops = []
+    for path in ctx.paths[:ctx.args.max_ocr_images]:
+        image = cv2.imread(path)
+        crops.extend(image[b["bbox"][1]:b["bbox"][3], b["bbox"][0]:b["bbox"][2]] for b in _strip_boxes(path)[:2])
+
+    yield "recognition.recognize", lambda: run_benchmark(
+        ctx.recognizer().recognize, crops, iterations=ctx.args.iterations
+    )
+
+    batch_size = 4
+    batches = [crops[i:i + batch_size] for i in range(0, len(crops), batch_size)]
+    yield "recognition.recognize_batch", lambda: run_benchmark(
+        ctx.recognizer().recognize_batch, batches, iterations=ctx.args.iterations, items_per_call=batch_size
+    )
+
+    # Nhiều dòng chữ ngắn của cùng 1 hóa đơn: từng dòng 1 lần readtext vs xếp vào canvas mosaic
+    from src.core.crops import prepare_crops
+    line_sets = []
+    for sample in ctx.samples[:ctx.args.max_ocr_images]:
+        prepared, _ = prepare_crops(cv2.imread(sample["path"]), sample["line_boxes"], target_height=64)
+        line_sets.append([item["crop"] for item in prepared])
+    num_lines = max(round(np.mean([len(lines) for lines in line_sets])), 1)
+    yield "recognition.lines[single]", lambda: run_benchmark(
+        lambda lines: [ctx.recognizer().recognize(line) for line in lines],
+        line_sets, iterations=ctx.args.iterations, items_per_call=num_lines
+    )
+    yield "recognition.lines[packed]", lambda: run_benchmark(
+        lambda lines: ctx.recognizer().recognize_packed(lines),
+        line_sets, iterations=ctx.args.iterations, items_per_call=num_lines
+    )
+
+    # Cả trang theo từng profile: canvas/magnification/downscale chỉ khác biệt rõ trên ảnh lớn
+    from src.core.recognition import RECOGNITION_PROFILES
+    pages = ctx.paths[:ctx.args.max_ocr_images]
+    for profile in RECOGNITION_PROFILES:
+        yield f"recognition.recognize_page[{profile}]", lambda profile=profile: run_benchmark(
+            lambda path: ctx.recognizer().recognize(path, profile=profile), pages, iterations=ctx.args.iterations
+        )
+
+
+def bench_pipeline(ctx):
+    from src.core.recognition import detect_and_recognize
+    paths = ctx.paths[:ctx.args.max_ocr_images]
+    yield "pipeline.detect_and_recognize", lambda: run_benchmark(
+        lambda path: detect_and_recognize(path, ctx.detector(), ctx.recognizer()),
+        paths, iterations=ctx.args.iterations
+    )
+
+
+def bench_apps(ctx):
+    """3 Flask apps qua test client (gồm cả chi phí JSON + routing + lazy load lần đầu)"""
+    from src.api import preprocessing_app, recognition_app, postprocessing_app
+
+    def post(client, endpoint, payload):
+        response = client.post(endpoint, json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f"{endpoint} -> {response.status_code}: {response.get_json()}")
+        return response.get_json()
+
+    pre_client = preprocessing_app.app.test_client()
+    pre_config = {"output_dir": os.path.join(ctx.args.workdir, "preprocessed")}
+    yield "apps.preprocessing.process[default_binarize]", lambda: run_benchmark(
+        lambda path: post(pre_client, "/process", {
+            "image_path": path, "model_name": "default_binarize", "auto_load": True, "load_config": pre_config
+        }),
+        ctx.paths, iterations=ctx.args.iterations
+    )
+
+    # Có easyocr thì đo model thật, không thì đo overhead của app với skeleton model
+    recog_client = recognition_app.app.test_client()
+    try:
+        import easyocr  # noqa: F401
+        recog_model, recog_paths = "easyocr_vi_en", ctx.paths[:ctx.args.max_ocr_images]
+    except ImportError:
+        recog_model, recog_paths = "trocr_base", ctx.paths
+    yield f"apps.recognition.predict[{recog_model}]", lambda: run_benchmark(
+        lambda path: post(recog_client, "/predict", {
+            "image_path": path, "model_name": recog_model, "auto_load": True
+        }),
+        recog_paths, iterations=ctx.args.iterations
+    )
+
+    post_client = postprocessing_app.app.test_client()
+    yield "apps.postprocessing.process[regex_invoice_vn]", lambda: run_benchmark(
+        lambda path: post(post_client, "/process", {
+            "input_path": path, "model_name": "regex_invoice_vn", "auto_load": True
+        }),
+        ctx.paths, iterations=ctx.args.iterations
+    )
+
+
+BENCHMARKS = {
+    "preprocess": bench_preprocess,
+    "detection": bench_detection,
+    "recognition": bench_recognition,
+    "pipeline": bench_pipeline,
+    "apps": bench_apps,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline OCR benchmarks")
+    parser.add_argument("--suites", default="all", help=f"all hoặc danh sách: {','.join(SUITES)}")
+    parser.add_argument("--profiles", default="all", help=f"all hoặc danh sách: {','.join(PROFILES)}")
+    parser.add_argument("--per-profile", type=int, default=3, help="Số ảnh sinh ra cho mỗi profile")
+    parser.add_argument("--iterations", type=int, default=3, help="Số lần lặp qua bộ ảnh")
+    parser.add_argument("--max-ocr-images", type=int, default=4, help="Giới hạn số ảnh cho benchmark OCR (chậm)")
+    parser.add_argument("--ssd-model", default="/weights/ssd_mobilenet_v2_coco.pb")
+    parser.add_argument("--ssd-config", default="/weights/ssd_mobilenet_v2_coco.pbtxt")
+    parser.add_argument("--dnn-backend", default=None, help="Backend OpenCV DNN của SSD (mặc định: OCR_DNN_BACKEND)")
+    parser.add_argument("--dnn-target", default=None, help="Target OpenCV DNN, vd cpu, cpu_fp16, opencl")
+    parser.add_argument("--dnn-threads", type=int, default=None, help="cv2.setNumThreads (mặc định: OCR_DNN_THREADS)")
+    parser.add_argument("--workdir", default=None, help="Thư mục ảnh sinh ra (mặc định: thư mục tạm)")
+    parser.add_argument("--output", default="benchmarks/results/latest.json")
+    parser.add_argument("--baseline", default=None, help="File baseline JSON để so sánh")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Ngưỡng regression (0.10 = 10%%)")
+    parser.add_argument("--save-baseline", default=None, help="Ghi kết quả lần chạy này làm baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    logger.setLevel(logging.INFO)
+    args = parse_args(argv)
+
+    suites = SUITES if args.suites == "all" else [s.strip() for s in args.suites.split(",")]
+    profiles = list(PROFILES) if args.profiles == "all" else [p.strip() for p in args.profiles.split(",")]
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="ocr_bench_")
+
+    samples = write_invoice_set(os.path.join(args.workdir, "images"), profiles=profiles, per_profile=args.per_profile)
+    logger.info(f"Generated {len(samples)} synthetic invoices in {args.workdir}")
+    ctx = BenchmarkContext(args, samples)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "profiles": profiles,
+            "per_profile": args.per_profile,
+            "iterations": args.iterations,
+        },
+        "benchmarks": {}
+    }
+
+    for suite in suites:
+        try:
+            for name, bench in BENCHMARKS[suite](ctx):
+                try:
+                    results["benchmarks"][name] = bench()
+                    stats = results["benchmarks"][name]
+                    logger.info(f"{name}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms "
+                                f"{stats['throughput_per_s']}/s peak_rss={stats['peak_rss_mb']}MB")
+                except SkipBenchmark as e:
+                    results["benchmarks"][name] = {"skipped": str(e)}
+                    logger.warning(f"{name}: skipped ({e})")
+        except SkipBenchmark as e:
+            results["benchmarks"][suite] = {"skipped": str(e)}
+            logger.warning(f"{suite}: skipped ({e})")
+
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["regressions"] = compare_to_baseline(results, baseline, tolerance=args.tolerance)
+        for regression in results["regressions"]:
+            logger.warning(f"REGRESSION {regression}")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logger.info(f"Wrote {path}")
+
+    return 1 if results.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
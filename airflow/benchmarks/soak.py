@@ -0,0 +1,194 @@
+"""
+Soak test bộ nhớ: lặp load -> predict -> unload trên 1 service và đo RAM còn lại sau mỗi chu kỳ
+
+RSS sau unload phải đi ngang; tăng đều theo số chu kỳ nghĩa là unload không trả hết RAM (leak).
+Mặc định unload với purge=true (bỏ cả artifact cache của process) để đo đúng phần RAM của model.
+
+Ví dụ (chạy trong thư mục gốc của repo):
+    # In-process qua Flask test client (không cần chạy service)
+    python -m benchmarks.soak --service preprocessing --model default_binarize --cycles 30
+    # Service thật, kèm tracemalloc diff giữa chu kỳ đầu (sau warm-up) và chu kỳ cuối
+    python -m benchmarks.soak --url http://localhost:5001 --service recognition --model easyocr_vi_en \\
+        --cycles 20 --tracemalloc
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import logging
+
+# Thêm đường dẫn gốc để import được src.*
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("soak")
+
+# service -> (endpoint xử lý, model mặc định)
+SERVICES = {
+    "preprocessing": ("process", "default_binarize"),
+    "recognition": ("predict", "easyocr_vi_en"),
+}
+
+
+class HttpClient:
+    """Gọi service thật qua HTTP"""
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, endpoint, payload=None, params=None):
+        response = self.session.request(method, f"{self.url}/{endpoint}", json=payload, params=params, timeout=600)
+        return response.status_code, response.json()
+
+
+class InProcessClient:
+    """Gọi Flask app trong cùng process (RSS đo được là của chính process này)"""
+
+    def __init__(self, service):
+        from src.api import preprocessing_app, recognition_app
+        app = {"preprocessing": preprocessing_app, "recognition": recognition_app}[service].app
+        self.client = app.test_client()
+
+    def request(self, method, endpoint, payload=None, params=None):
+        response = self.client.open(f"/{endpoint}", method=method, json=payload, query_string=params)
+        return response.status_code, response.get_json()
+
+
+def _call(client, method, endpoint, payload=None, params=None):
+    status_code, body = client.request(method, endpoint, payload, params)
+    if status_code != 200:
+        raise RuntimeError(f"{method} /{endpoint} -> {status_code}: {body}")
+    return body
+
+
+def run_soak(client, service, model_name, image_path, cycles, predicts_per_cycle, warmup_cycles,
+             purge=True, load_config=None, tracemalloc=False):
+    """
+    Returns:
+        dict: {"cycles": [...], "growth": {...}, "allocations": diff tracemalloc hoặc None}
+    """
+    endpoint, _ = SERVICES[service]
+    rows = []
+
+    if tracemalloc:
+        _call(client, "POST", "memory/tracemalloc", {"enabled": True, "nframes": 5})
+
+    for cycle in range(cycles):
+        loaded = _call(client, "POST", "load_model", {"model_name": model_name, **(load_config or {})})
+        for _ in range(predicts_per_cycle):
+            _call(client, "POST", endpoint, {"image_path": image_path, "model_name": model_name})
+        unloaded = _call(client, "POST", "unload_model", {"model_name": model_name, "purge": purge})
+        rss_mb = _call(client, "GET", "memory")["rss_mb"]
+
+        memory = unloaded.get("memory") or {}
+        rows.append({
+            "cycle": cycle,
+            "load_rss_mb": loaded.get("load_rss_mb"),
+            "load_kind": loaded.get("load_kind"),
+            "unload_rss_mb": memory.get("unload_rss_mb"),
+            "residual_mb": memory.get("residual_mb"),
+            "rss_after_unload_mb": rss_mb
+        })
+        logger.info(f"cycle {cycle}: {rows[-1]}")
+
+        # Mốc so sánh: sau các chu kỳ warm-up (cache của thư viện, lazy import... đã ổn định)
+        if tracemalloc and cycle == warmup_cycles - 1:
+            _call(client, "POST", "memory/snapshot", {"label": "soak-baseline"})
+
+    allocations = None
+    if tracemalloc and cycles > warmup_cycles:
+        _call(client, "POST", "memory/snapshot", {"label": "soak-end"})
+        allocations = _call(client, "GET", "memory/diff", params={"from": "soak-baseline", "to": "soak-end", "top": 15})
+
+    return {"cycles": rows, "growth": summarize_growth(rows, warmup_cycles), "allocations": allocations}
+
+
+def summarize_growth(rows, warmup_cycles):
+    """Tăng trưởng RSS sau unload (bỏ các chu kỳ warm-up): tổng và độ dốc (MB/chu kỳ, hồi quy tuyến tính)"""
+    steady = rows[warmup_cycles:] if len(rows) > warmup_cycles + 1 else rows
+    rss = np.array([row["rss_after_unload_mb"] for row in steady], dtype=np.float64)
+    growth = {
+        "cycles_measured": int(rss.size),
+        "rss_start_mb": round(float(rss[0]), 1),
+        "rss_end_mb": round(float(rss[-1]), 1),
+        "total_growth_mb": round(float(rss[-1] - rss[0]), 1),
+        "growth_per_cycle_mb": 0.0,
+    }
+    if rss.size >= 2:
+        growth["growth_per_cycle_mb"] = round(float(np.polyfit(np.arange(rss.size), rss, 1)[0]), 3)
+
+    residuals = [row["residual_mb"] for row in steady if row["residual_mb"] is not None]
+    if residuals:
+        growth["mean_residual_mb"] = round(float(np.mean(residuals)), 2)
+    return growth
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test load/predict/unload cho OCR services")
+    parser.add_argument("--service", choices=sorted(SERVICES), default="preprocessing")
+    parser.add_argument("--model", default=None, help="Mặc định: default_binarize / easyocr_vi_en")
+    parser.add_argument("--url", default=None, help="URL service thật; bỏ trống thì chạy in-process")
+    parser.add_argument("--image", default=None, help="Ảnh dùng để predict (mặc định: hóa đơn giả)")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--predicts-per-cycle", type=int, default=3)
+    parser.add_argument("--warmup-cycles", type=int, default=2, help="Số chu kỳ đầu không tính tăng trưởng")
+    parser.add_argument("--keep-cache", action="store_true", help="Unload không purge artifact cache")
+    parser.add_argument("--load-config", default=None, help="JSON thêm vào body /load_model")
+    parser.add_argument("--tracemalloc", action="store_true", help="Diff tracemalloc giữa sau warm-up và cuối")
+    parser.add_argument("--max-growth-mb", type=float, default=1.0, help="Ngưỡng MB/chu kỳ -> exit code 1")
+    parser.add_argument("--output", default="benchmarks/results/soak.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    logger.setLevel(logging.INFO)
+    args = parse_args(argv)
+    model_name = args.model or SERVICES[args.service][1]
+
+    image_path = args.image
+    if not image_path:
+        from benchmarks.synthetic import generate_invoice
+        image_path = os.path.join(tempfile.mkdtemp(prefix="ocr_soak_"), "invoice.jpg")
+        cv2.imwrite(image_path, generate_invoice("a4_dense")[0])
+
+    client = HttpClient(args.url) if args.url else InProcessClient(args.service)
+    report = run_soak(
+        client, args.service, model_name, image_path,
+        cycles=args.cycles,
+        predicts_per_cycle=args.predicts_per_cycle,
+        warmup_cycles=args.warmup_cycles,
+        purge=not args.keep_cache,
+        load_config=json.loads(args.load_config) if args.load_config else None,
+        tracemalloc=args.tracemalloc
+    )
+    report["config"] = {**vars(args), "model": model_name}
+
+    growth = report["growth"]
+    report["leak_suspected"] = growth["growth_per_cycle_mb"] > args.max_growth_mb
+    print(f"{args.service}/{model_name}: RSS sau unload {growth['rss_start_mb']} -> {growth['rss_end_mb']}MB "
+          f"qua {growth['cycles_measured']} chu kỳ ({growth['growth_per_cycle_mb']:+.3f}MB/chu kỳ)")
+    if report["allocations"]:
+        for stat in report["allocations"]["top"][:10]:
+            print(f"  {stat['size_diff_kb']:>+10.1f}KB  {stat['location']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+    if report["leak_suspected"]:
+        logger.warning(f"RSS tăng {growth['growth_per_cycle_mb']}MB/chu kỳ > {args.max_growth_mb}MB: nghi leak")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
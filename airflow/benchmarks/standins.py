@@ -0,0 +1,140 @@
+"""
+Stand-in Models - Model giả có latency/memory cấu hình được, gắn vào các Flask app thật
+Dùng để load test tầng API/DAG (locks, thread pool, connection pool) mà không cần weights
+"""
+
+import time
+import threading
+
+import numpy as np
+from werkzeug.serving import make_server
+
+
+class LatencyProfile:
+    """
+    Latency mỗi lần gọi: lognormal quanh mean_ms (jitter = độ lệch tương đối)
+    mode="sleep": chờ (như gọi I/O, nhả GIL); mode="cpu": tính toán numpy chiếm CPU
+    """
+
+    def __init__(self, mean_ms, jitter=0.3, mode="sleep", seed=None):
+        self.mean_ms = mean_ms
+        self.jitter = jitter
+        self.mode = mode
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self):
+        if self.jitter <= 0:
+            return self.mean_ms
+        sigma = np.sqrt(np.log(1 + self.jitter ** 2))
+        with self._lock:
+            value = self._rng.lognormal(np.log(self.mean_ms) - sigma ** 2 / 2, sigma)
+        return float(value)
+
+    def spend(self):
+        duration = self.sample_ms() / 1000
+        if self.mode == "cpu":
+            deadline = time.perf_counter() + duration
+            block = np.random.default_rng().random((128, 128))
+            while time.perf_counter() < deadline:
+                block = block @ block
+                block /= np.abs(block).max() or 1.0
+        else:
+            time.sleep(duration)
+
+
+class _StandInModel:
+    """Chiếm resident_mb RAM khi load, thêm per_call_mb RAM tạm mỗi lần gọi"""
+
+    def __init__(self, latency, resident_mb=0, per_call_mb=0):
+        self.latency = latency
+        self.per_call_mb = per_call_mb
+        self.load_kind = "cold"
+        # np.ones để các trang nhớ thật sự được cấp phát (tính vào RSS)
+        self._resident = np.ones(int(resident_mb * 1024 * 1024), dtype=np.uint8) if resident_mb else None
+
+    def _call(self):
+        scratch = np.ones(int(self.per_call_mb * 1024 * 1024), dtype=np.uint8) if self.per_call_mb else None
+        self.latency.spend()
+        del scratch
+
+    def warmup(self, runs=1):
+        return 0.0
+
+    def unload_model(self, *args, **kwargs):
+        self._resident = None
+
+
+class StandInDetector(_StandInModel):
+    """Thay cho SSDMobileNetDetector: trả num_boxes boxes cố định"""
+
+    def __init__(self, latency, num_boxes=3, **kwargs):
+        super().__init__(latency, **kwargs)
+        self.num_boxes = num_boxes
+
+    def detect(self, image_path):
+        self._call()
+        boxes = [
+            # Bắt đầu dưới lề trên của hóa đơn giả: vùng trắng trơn bị recognition bỏ qua trước khi OCR
+            {"class_id": 1, "class": "text", "confidence": 0.9, "bbox": [0, 80 + i * 40, 200, 80 + (i + 1) * 40]}
+            for i in range(self.num_boxes)
+        ]
+        return {"boxes": boxes, "image_shape": [40 * self.num_boxes, 200, 3], "num_detections": len(boxes)}
+
+
+class StandInRecognizer(_StandInModel):
+    """Thay cho EasyOCRRecognizer: latency tính cho mỗi vùng được nhận diện"""
+
+    def recognize(self, image_input, detail=1, profile=None):
+        self._call()
+        return {"text": "stand-in text", "regions": [], "num_regions": 1}
+
+    def recognize_batch(self, image_list, detail=1, profile=None):
+        return [self.recognize(image, detail=detail, profile=profile) for image in image_list]
+
+
+DETECTOR_MODEL = "standin_detector"
+RECOGNIZER_MODEL = "standin_recognizer"
+POSTPROCESS_MODEL = "regex_invoice_vn"
+
+
+def install_standins(detector, recognizer):
+    """Gắn model giả vào active_models của các Flask app thật (như đã /load_model)"""
+    from src.api import preprocessing_app, recognition_app
+
+    for module, name, instance, model_type in (
+        (preprocessing_app, DETECTOR_MODEL, detector, "detection"),
+        (recognition_app, RECOGNIZER_MODEL, recognizer, "recognition"),
+    ):
+        with module.models_lock:
+            module.active_models[name] = {"instance": instance, "type": model_type, "loaded": True}
+        module.state_version.bump()
+
+
+class LocalServices:
+    """Chạy 3 Flask app trên localhost (werkzeug threaded server, mỗi app 1 thread)"""
+
+    def __init__(self, host="127.0.0.1", base_port=15000):
+        from src.api import preprocessing_app, recognition_app, postprocessing_app
+
+        self.host = host
+        self._apps = {
+            "preproc": (preprocessing_app.app, base_port),
+            "recog": (recognition_app.app, base_port + 1),
+            "post": (postprocessing_app.app, base_port + 2),
+        }
+        self._servers = []
+        self.urls = {}
+
+    def __enter__(self):
+        for name, (app, port) in self._apps.items():
+            server = make_server(self.host, port, app, threaded=True)
+            threading.Thread(target=server.serve_forever, name=f"standin-{name}", daemon=True).start()
+            self._servers.append(server)
+            self.urls[name] = f"http://{self.host}:{port}"
+        return self
+
+    def __exit__(self, *exc):
+        for server in self._servers:
+            server.shutdown()
+        return False
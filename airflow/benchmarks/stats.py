@@ -0,0 +1,133 @@
+"""
+Benchmark Stats - Đo latency/throughput/peak RSS và so sánh với baseline
+"""
+
+import time
+import threading
+
+import numpy as np
+
+from src.utils.memory import get_rss_mb
+
+
+class PeakRSSSampler:
+    """Lấy mẫu RSS trên thread nền trong lúc benchmark chạy, giữ giá trị lớn nhất"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_mb = get_rss_mb()
+        self.peak_mb = self.start_mb
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, get_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, get_rss_mb())
+        return False
+
+
+def summarize(latencies_ms, wall_seconds, items_per_call=1):
+    """Thống kê latency (ms) + throughput (items/s)"""
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "calls": int(latencies.size),
+        "items": int(latencies.size * items_per_call),
+        "throughput_per_s": round(latencies.size * items_per_call / wall_seconds, 3) if wall_seconds else None,
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "max_ms": round(float(latencies.max()), 3),
+    }
+
+
+def run_benchmark(fn, inputs, iterations=1, warmup=1, items_per_call=1):
+    """
+    Gọi fn(input) cho mỗi input, lặp iterations lần (sau warmup lần chạy bỏ qua)
+
+    Returns:
+        dict: summarize(...) + peak_rss_mb, rss_delta_mb
+    """
+    for item in inputs[:warmup]:
+        fn(item)
+
+    latencies = []
+    with PeakRSSSampler() as rss:
+        wall_start = time.perf_counter()
+        for _ in range(iterations):
+            for item in inputs:
+                start = time.perf_counter()
+                fn(item)
+                latencies.append((time.perf_counter() - start) * 1000)
+        wall_seconds = time.perf_counter() - wall_start
+
+    result = summarize(latencies, wall_seconds, items_per_call=items_per_call)
+    result["peak_rss_mb"] = round(rss.peak_mb, 1)
+    result["rss_delta_mb"] = round(rss.peak_mb - rss.start_mb, 1)
+    return result
+
+
+def edit_distance(a, b):
+    """Khoảng cách Levenshtein giữa 2 chuỗi (DP theo hàng, O(len(a) * len(b)))"""
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def character_error_rate(predictions, references):
+    """CER = tổng edit distance / tổng số ký tự của references (so sánh sau khi bỏ khoảng trắng thừa)"""
+    errors = chars = 0
+    for predicted, reference in zip(predictions, references):
+        predicted, reference = " ".join(predicted.split()), " ".join(reference.split())
+        errors += edit_distance(predicted, reference)
+        chars += len(reference)
+    return round(errors / chars, 4) if chars else None
+
+
+def compare_to_baseline(results, baseline, tolerance=0.10):
+    """
+    So sánh p50/p95 và throughput với baseline
+
+    Returns:
+        list: Các regression [{"benchmark", "metric", "baseline", "current", "change"}]
+    """
+    regressions = []
+    base_benchmarks = baseline.get("benchmarks", {})
+
+    for name, current in results.get("benchmarks", {}).items():
+        base = base_benchmarks.get(name)
+        if not base or current.get("skipped") or base.get("skipped"):
+            continue
+
+        # Latency tăng quá tolerance hoặc throughput giảm quá tolerance
+        checks = [("p50_ms", 1), ("p95_ms", 1), ("throughput_per_s", -1)]
+        for metric, direction in checks:
+            if not base.get(metric) or current.get(metric) is None:
+                continue
+            change = (current[metric] - base[metric]) / base[metric]
+            if change * direction > tolerance:
+                regressions.append({
+                    "benchmark": name,
+                    "metric": metric,
+                    "baseline": base[metric],
+                    "current": current[metric],
+                    "change": round(change, 3)
+                })
+
+    return regressions
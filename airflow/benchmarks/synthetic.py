@@ -0,0 +1,101 @@
+"""
+Synthetic Invoices - Sinh ảnh hóa đơn giả bằng OpenCV (không cần mạng hay dữ liệu ngoài)
+Mỗi profile thay đổi kích thước ảnh, cỡ chữ, mật độ dòng và mức nhiễu
+"""
+
+import os
+import json
+
+import cv2
+import numpy as np
+
+# name -> tham số sinh ảnh
+PROFILES = {
+    "small_clean": {"size": (1000, 800), "font_scale": 0.9, "num_lines": 12, "noise": 0.0, "skew": 0.0},
+    "a4_dense": {"size": (2339, 1654), "font_scale": 1.1, "num_lines": 45, "noise": 4.0, "skew": 0.0},
+    "a4_noisy_skewed": {"size": (2339, 1654), "font_scale": 1.0, "num_lines": 30, "noise": 18.0, "skew": 2.5},
+    "large_scan": {"size": (4000, 3000), "font_scale": 2.0, "num_lines": 40, "noise": 8.0, "skew": 1.0},
+}
+
+_ITEMS = ["Ca phe sua", "Banh mi", "Tra dao", "Nuoc suoi", "Com tam", "Pho bo", "Goi cuon", "Bun cha"]
+
+
+def _invoice_lines(rng, num_lines):
+    """Nội dung hóa đơn: header, các dòng hàng, tổng tiền"""
+    lines = [
+        f"HOA DON GTGT  So: {rng.integers(1000000, 9999999)}",
+        f"Ngay: {rng.integers(1, 29):02d}/{rng.integers(1, 13):02d}/2024   MST: 0{rng.integers(100000000, 999999999)}",
+    ]
+    total = 0
+    for i in range(max(num_lines - 3, 1)):
+        qty = int(rng.integers(1, 10))
+        price = int(rng.integers(5, 200)) * 1000
+        total += qty * price
+        lines.append(f"{i + 1:>2}. {_ITEMS[i % len(_ITEMS)]:<12} x{qty}  {qty * price:>10,} VND")
+    lines.append(f"TONG CONG: {total:,} VND")
+    return lines
+
+
+def generate_invoice(profile="small_clean", seed=0):
+    """
+    Sinh 1 ảnh hóa đơn giả
+
+    Returns:
+        tuple: (image BGR, ground_truth dict: {"lines": [...], "line_boxes": [...], "profile": ...})
+        line_boxes: [x1, y1, x2, y2] của từng dòng đã vẽ (trước khi xoay theo skew)
+    """
+    params = PROFILES[profile]
+    rng = np.random.default_rng(seed)
+    height, width = params["size"]
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    lines = _invoice_lines(rng, params["num_lines"])
+    font_scale = params["font_scale"]
+    thickness = max(1, int(round(font_scale * 2)))
+    line_height = int(40 * font_scale)
+    margin = int(width * 0.06)
+
+    y = margin + line_height
+    line_boxes = []
+    for line in lines:
+        if y > height - margin:
+            break
+        cv2.putText(image, line, (margin, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
+        (text_w, text_h), baseline = cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        pad = thickness + 2
+        line_boxes.append([
+            max(margin - pad, 0), max(y - text_h - pad, 0),
+            min(margin + text_w + pad, width), min(y + baseline + pad, height)
+        ])
+        y += line_height
+
+    if params["skew"]:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), params["skew"], 1.0)
+        image = cv2.warpAffine(image, matrix, (width, height), borderValue=(255, 255, 255))
+
+    if params["noise"]:
+        noise = rng.normal(0, params["noise"], image.shape)
+        image = np.clip(image.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+    return image, {"lines": lines[:len(line_boxes)], "line_boxes": line_boxes, "profile": profile}
+
+
+def write_invoice_set(output_dir, profiles=None, per_profile=3, seed=0):
+    """
+    Ghi bộ ảnh benchmark ra thư mục (JPEG như ảnh upload thật) + ground_truth.json
+
+    Returns:
+        list: [{"path", "profile", "lines"}]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    samples = []
+    for profile in profiles or PROFILES:
+        for i in range(per_profile):
+            image, truth = generate_invoice(profile, seed=seed + i)
+            path = os.path.join(output_dir, f"{profile}_{i:02d}.jpg")
+            cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            samples.append({"path": path, **truth})
+
+    with open(os.path.join(output_dir, "ground_truth.json"), "w", encoding="utf-8") as f:
+        json.dump(samples, f, ensure_ascii=False, indent=2)
+    return samples
@@ -12,9 +12,34 @@ class Settings:
     # Thư mục chứa dữ liệu
     DATA_DIR = "/data"
     WEIGHTS_DIR = "/weights"
+    # Ảnh upload từ frontend (upload_<sha16>.<ext>, dùng chung giữa các run): ocr_maintenance xóa
+    # khi không được stage lại trong 72h
+    UPLOAD_RETENTION_HOURS = 72
     
     # Timeout cho API calls (giây)
     API_TIMEOUT = 300
+    
+    # Cấu hình batch DAG (ocr_batch_pipeline)
+    BATCH_CHUNK_SIZE = 50  # Số ảnh mỗi chunk (mỗi chunk = 1 mapped task / bước)
+    BATCH_OUTPUT_DIR = "/data/batch_results"
+    BATCH_API_TIMEOUT = 1800  # Timeout cho batch endpoints (giây)
+    
+    # Artifact store cho kết quả trung gian (XCom chỉ giữ reference)
+    ARTIFACT_DIR = "/data/artifacts"
+    ARTIFACT_RETENTION_HOURS = 72  # Artifact không được ghi lại sau 72h sẽ bị GC xóa
+    PREPROCESSED_DIR = "/data/preprocessed"  # Ảnh đã làm sạch bởi default_binarize (GC cùng retention)
+    
+    # Dedup theo nội dung ảnh: chỉ mục kết quả đã xử lý
+    RESULT_INDEX_DIR = "/data/result_index"
+    RESULT_INDEX_TTL_HOURS = 72  # Kết quả cũ hơn coi như chưa có (<= ARTIFACT_RETENTION_HOURS)
+    DEDUP_WAIT_TIMEOUT = 600  # Thời gian tối đa chờ run trùng đang chạy (giây)
+    DEDUP_LOCK_TTL = 1800  # Lock cũ hơn mức này coi như run giữ lock đã chết (giây)
+    
+    # Thông báo kết quả run cho frontend (file trên volume /data dùng chung)
+    RUN_RESULTS_DIR = "/data/run_results"
+    
+    # Spans theo trace ID của từng DAG run (JSONL, services ghi qua OCR_TRACE_DIR cùng thư mục)
+    TRACE_DIR = "/data/traces"
 
 # Instance để sử dụng
 settings = Settings()
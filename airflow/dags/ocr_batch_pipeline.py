@@ -0,0 +1,280 @@
+import sys
+import os
+import json
+import logging
+from datetime import timedelta
+from airflow.decorators import dag, task
+import pendulum
+
+# --- CẤU HÌNH ĐƯỜNG DẪN IMPORT ---
+# Thêm thư mục cha vào sys.path để import được file config.py nằm ngoài folder dags
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.pipeline.model_readiness import call_model_step, ensure_model_loaded
+from src.pipeline.batching import (
+    list_image_paths,
+    split_into_chunks,
+    write_chunk_manifests,
+    list_chunk_manifests,
+    chunk_output_path,
+    write_jsonl,
+    read_jsonl,
+)
+from src.utils.tracing import traced, trace_id_for_run, summarize_trace
+from src.frontend.staging import is_staged_upload
+
+try:
+    from config import settings
+except ImportError:
+    # Fallback nếu không tìm thấy file config (để tránh lỗi import khi IDE check)
+    logging.warning("Không tìm thấy config.py, sử dụng cấu hình mặc định.")
+    class MockSettings:
+        PREPROC_URL = "http://api-preprocessing:5000"
+        RECOG_URL = "http://api-recognition:5001"
+        POST_URL = "http://api-postprocessing:5002"
+        BATCH_CHUNK_SIZE = 50
+        BATCH_OUTPUT_DIR = "/data/batch_results"
+        BATCH_API_TIMEOUT = 1800
+        TRACE_DIR = "/data/traces"
+    settings = MockSettings()
+
+# --- ĐỊNH NGHĨA CÁC THAM SỐ MẶC ĐỊNH ---
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=1),
+}
+
+@dag(
+    dag_id='ocr_batch_pipeline',
+    default_args=default_args,
+    description='Pipeline OCR batch: chia thư mục/manifest thành chunk, map task theo chunk và gọi batch endpoints',
+    schedule=None,
+    start_date=pendulum.today('UTC').add(days=-1),
+    tags=['ocr', 'mlops', 'batch'],
+    catchup=False,
+    max_active_tasks=8  # Giới hạn số chunk chạy song song để không quá tải các services
+)
+def ocr_batch_pipeline():
+    """
+    Trigger với config:
+    {
+        "input_dir": "/data/inbox/2024-06",       # hoặc "manifest_path": "/data/inbox/list.txt"
+        "chunk_size": 50,                         # optional
+        "output_dir": "/data/batch_results/abc",  # optional, mặc định theo run_id
+        "cleanup_inputs": false,                  # optional, xóa ảnh đầu vào sau khi xong (trừ ảnh stage từ UI)
+        "preprocess_model": "ssd_mobilenet_v2",
+        "recognition_model": "easyocr_vi_en",
+        "recognition_profile": "fast",            # optional: fast | balanced | accurate
+        "postprocess_model": "regex_invoice_vn"
+    }
+    Kết quả cuối cùng: {output_dir}/final/chunk_XXXXX.jsonl (mỗi dòng 1 ảnh)
+    """
+
+    def get_output_dir(context):
+        """Thư mục kết quả của run (conf output_dir hoặc theo run_id)"""
+        return context['dag_run'].conf.get('output_dir') or os.path.join(
+            settings.BATCH_OUTPUT_DIR, context['dag_run'].run_id.replace(':', '_')
+        )
+
+    # --- TASK 1: LIỆT KÊ ẢNH VÀ CHIA CHUNK ---
+    @task(task_id="list_inputs")
+    def list_inputs(**context):
+        conf = context['dag_run'].conf
+        chunk_size = int(conf.get('chunk_size', settings.BATCH_CHUNK_SIZE))
+        output_dir = get_output_dir(context)
+
+        image_paths = list_image_paths(
+            input_dir=conf.get('input_dir'),
+            manifest_path=conf.get('manifest_path')
+        )
+        if not image_paths:
+            raise ValueError("Không tìm thấy ảnh nào để xử lý!")
+
+        # Mỗi chunk ghi ra 1 file manifest, XCom chỉ giữ metadata nhỏ của chunk
+        chunks = split_into_chunks(image_paths, chunk_size)
+        chunk_infos = write_chunk_manifests(chunks, output_dir, context['dag_run'].run_id)
+
+        logging.info(f"Tìm thấy {len(image_paths)} ảnh, chia thành {len(chunk_infos)} chunk (chunk_size={chunk_size})")
+        return chunk_infos
+
+    # --- TASK 2: LOAD MODEL 1 LẦN CHO CẢ RUN ---
+    @task(task_id="load_models")
+    def load_models(**context):
+        conf = context['dag_run'].conf
+        ensure_model_loaded(settings.PREPROC_URL, conf.get('preprocess_model', 'ssd_mobilenet_v2'), "Preproc")
+        ensure_model_loaded(settings.RECOG_URL, conf.get('recognition_model', 'easyocr_vi_en'), "Recog")
+        ensure_model_loaded(settings.POST_URL, conf.get('postprocess_model', 'regex_invoice_vn'), "Post")
+
+    # --- TASK 3: TIỀN XỬ LÝ THEO CHUNK ---
+    @task(task_id="preprocess_chunk")
+    def preprocess_chunk(chunk, **context):
+        conf = context['dag_run'].conf
+        model_name = conf.get('preprocess_model', 'ssd_mobilenet_v2')
+
+        with open(chunk['manifest_path'], "r", encoding="utf-8") as f:
+            image_paths = [line.strip() for line in f if line.strip()]
+
+        # Mọi chunk của run dùng chung 1 trace ID (spans của từng ảnh nằm chung 1 file)
+        with traced(trace_id_for_run(context['dag_run'].run_id), "preprocess_chunk", chunk_id=chunk['chunk_id']):
+            result = call_model_step(
+                settings.PREPROC_URL,
+                "process_batch",
+                {"image_paths": image_paths, "model_name": model_name},
+                f"Preproc-Chunk-{chunk['chunk_id']}",
+                timeout=settings.BATCH_API_TIMEOUT
+            )
+
+        output_path = chunk_output_path(chunk, "preprocess")
+        write_jsonl(output_path, result.get('data') or [])
+        logging.info(f"Chunk {chunk['chunk_id']}: {result.get('message')}")
+
+        return {**chunk, "preprocess_path": output_path}
+
+    # --- TASK 4: NHẬN DIỆN THEO CHUNK ---
+    @task(task_id="recognize_chunk")
+    def recognize_chunk(chunk, **context):
+        conf = context['dag_run'].conf
+        model_name = conf.get('recognition_model', 'easyocr_vi_en')
+
+        preprocessed = read_jsonl(chunk['preprocess_path'])
+        # Ảnh lỗi ở bước trước không gửi sang recognition
+        items = [
+            {"image_path": rec['image_path'], "detection_data": rec.get('data')}
+            for rec in preprocessed if rec.get('status') == "success"
+        ]
+
+        recognized = []
+        if items:
+            with traced(trace_id_for_run(context['dag_run'].run_id), "recognize_chunk", chunk_id=chunk['chunk_id']):
+                result = call_model_step(
+                    settings.RECOG_URL,
+                    "predict_batch",
+                    {"items": items, "model_name": model_name, "profile": conf.get('recognition_profile')},
+                    f"Recog-Chunk-{chunk['chunk_id']}",
+                    timeout=settings.BATCH_API_TIMEOUT
+                )
+            recognized = result.get('data') or []
+            logging.info(f"Chunk {chunk['chunk_id']}: {result.get('message')}")
+
+        output_path = chunk_output_path(chunk, "recognition")
+        write_jsonl(output_path, recognized)
+
+        return {**chunk, "recognition_path": output_path}
+
+    # --- TASK 5: HẬU XỬ LÝ THEO CHUNK + GHI KẾT QUẢ CUỐI ---
+    @task(task_id="postprocess_chunk")
+    def postprocess_chunk(chunk, **context):
+        conf = context['dag_run'].conf
+        model_name = conf.get('postprocess_model', 'regex_invoice_vn')
+
+        preprocessed = {rec['image_path']: rec for rec in read_jsonl(chunk['preprocess_path'])}
+        recognized = {rec['image_path']: rec for rec in read_jsonl(chunk['recognition_path'])}
+
+        ok_paths = [path for path, rec in recognized.items() if rec.get('status') == "success"]
+        postprocessed = {}
+        if ok_paths:
+            with traced(trace_id_for_run(context['dag_run'].run_id), "postprocess_chunk", chunk_id=chunk['chunk_id']):
+                result = call_model_step(
+                    settings.POST_URL,
+                    "process_batch",
+                    {"inputs": [recognized[path].get('data') for path in ok_paths], "model_name": model_name},
+                    f"Post-Chunk-{chunk['chunk_id']}",
+                    timeout=settings.BATCH_API_TIMEOUT
+                )
+            postprocessed = dict(zip(ok_paths, result.get('data') or []))
+
+        # Ghép kết quả 3 bước thành 1 bản ghi / ảnh
+        records = []
+        num_failed = 0
+        for image_path, pre in preprocessed.items():
+            recog = recognized.get(image_path, {})
+            post = postprocessed.get(image_path, {})
+            error = pre.get('error') or recog.get('error') or post.get('error')
+            failed = bool(error) or image_path not in postprocessed
+            num_failed += failed
+            records.append({
+                "image_path": image_path,
+                "status": "error" if failed else "success",
+                "error": error,
+                "detection": pre.get('data'),
+                "recognition": recog.get('data'),
+                "postprocess": post.get('data')
+            })
+
+        output_path = chunk_output_path(chunk, "final")
+        write_jsonl(output_path, records)
+
+        return {
+            "chunk_id": chunk['chunk_id'],
+            "result_path": output_path,
+            "num_images": len(records),
+            "num_failed": num_failed
+        }
+
+    # --- TASK 6: TỔNG HỢP ---
+    @task(task_id="summarize")
+    def summarize(chunk_results, **context):
+        chunk_results = sorted(chunk_results, key=lambda c: c['chunk_id'])
+        summary = {
+            "dag_run_id": context['dag_run'].run_id,
+            "num_chunks": len(chunk_results),
+            "num_images": sum(c['num_images'] for c in chunk_results),
+            "num_failed": sum(c['num_failed'] for c in chunk_results),
+            "result_paths": [c['result_path'] for c in chunk_results]
+        }
+
+        # Stage chiếm nhiều thời gian nhất của cả batch (từ spans các services ghi lại)
+        trace = summarize_trace(trace_id_for_run(context['dag_run'].run_id), trace_dir=settings.TRACE_DIR)
+        summary["trace"] = {k: trace.get(k) for k in ("trace_id", "wall_ms", "dominant_stage", "stages")}
+
+        if chunk_results:
+            output_dir = os.path.dirname(os.path.dirname(chunk_results[0]['result_path']))
+            with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        logging.info(f"BATCH SUMMARY: {summary['num_images']} ảnh, {summary['num_failed']} lỗi, {summary['num_chunks']} chunk")
+        return summary
+
+    # --- TASK 7: DỌN DẸP ẢNH ĐẦU VÀO (NẾU ĐƯỢC YÊU CẦU) ---
+    @task(task_id="cleanup_inputs", trigger_rule="all_done")
+    def cleanup_inputs(**context):
+        """
+        Xóa ảnh đầu vào để tránh đầy ổ đĩa (chỉ khi conf cleanup_inputs=true)
+        Ảnh stage từ frontend dùng chung giữa các run nên không xóa ở đây (ocr_maintenance xóa theo tuổi)
+        Đọc manifest từ thư mục kết quả thay vì XCom của list_inputs: list_inputs lỗi thì không có gì để xóa
+        """
+        if not context['dag_run'].conf.get('cleanup_inputs'):
+            return 0
+
+        removed = 0
+        for manifest_path in list_chunk_manifests(get_output_dir(context), context['dag_run'].run_id):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                for image_path in (line.strip() for line in f):
+                    if image_path and not is_staged_upload(image_path) and os.path.exists(image_path):
+                        try:
+                            os.remove(image_path)
+                            removed += 1
+                        except Exception as e:
+                            logging.warning(f"Không thể xóa file {image_path}: {str(e)}")
+
+        logging.info(f"✓ Đã xóa {removed} ảnh đầu vào")
+        return removed
+
+    # --- ĐỊNH NGHĨA LUỒNG DỮ LIỆU ---
+    # Số task instance = số chunk x 3 bước, không phụ thuộc số ảnh
+    chunks = list_inputs()
+    models_ready = load_models()
+
+    preprocessed = preprocess_chunk.expand(chunk=chunks)
+    models_ready >> preprocessed
+
+    recognized = recognize_chunk.expand(chunk=preprocessed)
+    finished = postprocess_chunk.expand(chunk=recognized)
+    summarize(finished) >> cleanup_inputs()
+
+# Khởi tạo DAG
+ocr_batch_dag = ocr_batch_pipeline()
@@ -0,0 +1,127 @@
+import sys
+import os
+import logging
+from datetime import timedelta
+from airflow.decorators import dag, task
+import pendulum
+
+# --- CẤU HÌNH ĐƯỜNG DẪN IMPORT ---
+# Thêm thư mục cha vào sys.path để import được file config.py nằm ngoài folder dags
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.artifacts import gc_artifacts
+from src.pipeline.notifications import gc_run_notifications
+from src.frontend.staging import STAGED_UPLOAD_PATTERN
+
+try:
+    from config import settings
+except ImportError:
+    # Fallback nếu không tìm thấy file config (để tránh lỗi import khi IDE check)
+    logging.warning("Không tìm thấy config.py, sử dụng cấu hình mặc định.")
+    class MockSettings:
+        ARTIFACT_DIR = "/data/artifacts"
+        ARTIFACT_RETENTION_HOURS = 72
+        PREPROCESSED_DIR = "/data/preprocessed"
+        RUN_RESULTS_DIR = "/data/run_results"
+        TRACE_DIR = "/data/traces"
+        DATA_DIR = "/data"
+        UPLOAD_RETENTION_HOURS = 72
+        RESULT_INDEX_DIR = "/data/result_index"
+        RESULT_INDEX_TTL_HOURS = 72
+    settings = MockSettings()
+
+# --- ĐỊNH NGHĨA CÁC THAM SỐ MẶC ĐỊNH ---
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=5),
+}
+
+@dag(
+    dag_id='ocr_maintenance',
+    default_args=default_args,
+    description='Dọn dẹp định kỳ: xóa artifacts trung gian, ảnh tiền xử lý, ảnh upload, kết quả dedup, thông báo kết quả run và traces quá hạn retention',
+    schedule='@daily',
+    start_date=pendulum.today('UTC').add(days=-1),
+    tags=['ocr', 'maintenance'],
+    catchup=False
+)
+def ocr_maintenance():
+
+    @task(task_id="gc_artifacts")
+    def gc_old_artifacts(**context):
+        conf = context['dag_run'].conf or {}
+        retention_hours = float(conf.get('retention_hours', settings.ARTIFACT_RETENTION_HOURS))
+
+        stats = gc_artifacts(retention_hours, artifact_dir=settings.ARTIFACT_DIR)
+        logging.info(
+            f"Đã xóa {stats['deleted']} artifacts ({stats['freed_bytes'] / 1024 / 1024:.1f}MB), "
+            f"giữ lại {stats['kept']} (retention={retention_hours}h)"
+        )
+        return stats
+
+    @task(task_id="gc_run_notifications")
+    def gc_old_notifications(**context):
+        """Frontend chỉ đọc thông báo ngay sau khi run xong, giữ lại theo cùng retention với artifacts"""
+        conf = context['dag_run'].conf or {}
+        retention_hours = float(conf.get('retention_hours', settings.ARTIFACT_RETENTION_HOURS))
+
+        deleted = gc_run_notifications(retention_hours, notify_dir=settings.RUN_RESULTS_DIR)
+        logging.info(f"Đã xóa {deleted} thông báo kết quả run cũ")
+        return deleted
+
+    @task(task_id="gc_preprocessed_images")
+    def gc_preprocessed_images(**context):
+        """Ảnh đã làm sạch chỉ cần cho bước recognition của run tạo ra nó"""
+        conf = context['dag_run'].conf or {}
+        retention_hours = float(conf.get('retention_hours', settings.ARTIFACT_RETENTION_HOURS))
+
+        stats = gc_artifacts(retention_hours, artifact_dir=settings.PREPROCESSED_DIR, pattern="*.png")
+        logging.info(f"Đã xóa {stats['deleted']} ảnh tiền xử lý ({stats['freed_bytes'] / 1024 / 1024:.1f}MB)")
+        return stats
+
+    @task(task_id="gc_traces")
+    def gc_traces(**context):
+        """Spans + summary của các run cũ (mỗi run 1 file <trace_id>.jsonl)"""
+        conf = context['dag_run'].conf or {}
+        retention_hours = float(conf.get('retention_hours', settings.ARTIFACT_RETENTION_HOURS))
+
+        stats = gc_artifacts(retention_hours, artifact_dir=settings.TRACE_DIR, pattern="*.json*")
+        logging.info(f"Đã xóa {stats['deleted']} file trace ({stats['freed_bytes'] / 1024 / 1024:.1f}MB)")
+        return stats
+
+    @task(task_id="gc_staged_uploads")
+    def gc_staged_uploads(**context):
+        """
+        Ảnh upload từ frontend (upload_<sha16>.<ext>) dùng chung giữa các run nên DAG không xóa
+        Mỗi lần stage lại làm mới mtime -> chỉ xóa ảnh không được dùng trong upload_retention_hours
+        """
+        conf = context['dag_run'].conf or {}
+        retention_hours = float(conf.get('upload_retention_hours', settings.UPLOAD_RETENTION_HOURS))
+
+        stats = gc_artifacts(retention_hours, artifact_dir=settings.DATA_DIR, pattern=STAGED_UPLOAD_PATTERN)
+        logging.info(f"Đã xóa {stats['deleted']} ảnh upload ({stats['freed_bytes'] / 1024 / 1024:.1f}MB)")
+        return stats
+
+    @task(task_id="gc_result_index")
+    def gc_result_index(**context):
+        """Kết quả dedup quá TTL không còn được dùng (ResultIndex coi là MISS), xóa file cho gọn"""
+        conf = context['dag_run'].conf or {}
+        ttl_hours = float(conf.get('result_index_ttl_hours', settings.RESULT_INDEX_TTL_HOURS))
+
+        stats = gc_artifacts(ttl_hours, artifact_dir=settings.RESULT_INDEX_DIR, pattern="*/*.json")
+        logging.info(f"Đã xóa {stats['deleted']} kết quả dedup quá hạn")
+        return stats
+
+    gc_old_artifacts()
+    gc_old_notifications()
+    gc_preprocessed_images()
+    gc_traces()
+    gc_staged_uploads()
+    gc_result_index()
+
+# Khởi tạo DAG
+maintenance_dag = ocr_maintenance()
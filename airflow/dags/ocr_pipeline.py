@@ -1,17 +1,23 @@
 import sys
 import os
 import logging
+import time
 from datetime import timedelta
 from airflow.decorators import dag, task
 import pendulum
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 # --- CẤU HÌNH ĐƯỜNG DẪN IMPORT ---
 # Thêm thư mục cha vào sys.path để import được file config.py nằm ngoài folder dags
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Helper gọi API dùng chung giữa các DAG (thư mục src/ được mount cạnh config.py)
+from src.pipeline.model_readiness import call_model_step
+from src.pipeline.result_index import ResultIndex, hash_file, make_result_key
+from src.pipeline.notifications import notify_run_finished, has_run_notification
+from src.utils.tracing import traced, trace_id_for_run, write_trace_summary
+from src.utils.artifacts import resolve_artifact, missing_artifacts
+from src.frontend.staging import is_staged_upload
+
 try:
     from config import settings
 except ImportError:
@@ -21,8 +27,24 @@ except ImportError:
         PREPROC_URL = "http://api-preprocessing:5000"
         RECOG_URL = "http://api-recognition:5001"
         POST_URL = "http://api-postprocessing:5002"
+        RESULT_INDEX_DIR = "/data/result_index"
+        RESULT_INDEX_TTL_HOURS = 72
+        DEDUP_WAIT_TIMEOUT = 600
+        DEDUP_LOCK_TTL = 1800
+        RUN_RESULTS_DIR = "/data/run_results"
+        TRACE_DIR = "/data/traces"
     settings = MockSettings()
 
+# Chỉ mục kết quả theo hash ảnh + cấu hình model (dùng chung giữa các run)
+result_index = ResultIndex(
+    settings.RESULT_INDEX_DIR,
+    lock_ttl=settings.DEDUP_LOCK_TTL,
+    max_age=settings.RESULT_INDEX_TTL_HOURS * 3600
+)
+
+# Các key trong conf không ảnh hưởng kết quả OCR -> không đưa vào key dedup
+NON_RESULT_CONF_KEYS = ("image_path", "skip_dedup")
+
 # --- ĐỊNH NGHĨA CÁC THAM SỐ MẶC ĐỊNH ---
 default_args = {
     'owner': 'airflow',
@@ -44,34 +66,73 @@ default_args = {
 )
 def ocr_pipeline():
 
-    # --- HÀM HELPER ĐỂ GỌI API ---
-    def get_retry_session():
-        """Tạo requests session với retry logic"""
-        session = requests.Session()
-        retry = Retry(
-            total=3,  # Retry tối đa 3 lần
-            backoff_factor=1,  # Đợi 1s, 2s, 4s giữa các lần retry
-            status_forcelist=[500, 502, 503, 504],  # Retry khi gặp server errors
-            allowed_methods=["POST", "GET"]
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        return session
-    
-    def call_api_step(url_base, endpoint, payload, task_name):
-        """Hàm chung để gọi API và xử lý lỗi cơ bản với retry"""
-        full_url = f"{url_base}/{endpoint}"
-        logging.info(f"[{task_name}] Calling: {full_url} with payload: {payload}")
+    def usable_record(record):
+        """Record còn dùng được: có kết quả và mọi artifact nó tham chiếu chưa bị GC xóa"""
+        if record is None:
+            return False
+        missing = missing_artifacts(record.get('result'))
+        if missing:
+            logging.warning(f"Kết quả đã lưu tham chiếu {len(missing)} artifact đã bị xóa -> coi như MISS")
+            return False
+        return True
+
+    def get_model_config(conf):
+        """Cấu hình ảnh hưởng kết quả (model mỗi bước + tham số khác), có điền giá trị mặc định"""
+        model_config = {k: v for k, v in conf.items() if k not in NON_RESULT_CONF_KEYS}
+        model_config.setdefault('preprocess_model', 'ssd_mobilenet_v2')
+        model_config.setdefault('recognition_model', 'easyocr_vi_en')
+        model_config.setdefault('postprocess_model', 'regex_invoice_vn')
+        return model_config
+
+    # --- TASK 0: KIỂM TRA ẢNH ĐÃ XỬ LÝ CHƯA (DEDUP) ---
+    @task.branch(task_id="dedup_check")
+    def dedup_check(**context):
+        conf = context['dag_run'].conf
+        image_path = conf.get('image_path')
+        ti = context['ti']
         
-        try:
-            session = get_retry_session()
-            response = session.post(full_url, json=payload, timeout=300) # Timeout 5 phút cho model nặng
-            response.raise_for_status() # Báo lỗi nếu status != 200
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"[{task_name}] Failed after retries: {str(e)}")
-            raise e
+        if not image_path:
+            raise ValueError("Thiếu tham số 'image_path' trong cấu hình Trigger!")
+        
+        if conf.get('skip_dedup'):
+            logging.info("skip_dedup=true -> xử lý lại từ đầu")
+            return "preprocessing_step"
+        
+        key = make_result_key(hash_file(image_path), get_model_config(conf))
+        ti.xcom_push(key="result_key", value=key)
+        owner = context['dag_run'].run_id
+        deadline = time.monotonic() + settings.DEDUP_WAIT_TIMEOUT
+        
+        while True:
+            record = result_index.get(key)
+            if usable_record(record):
+                # Đẩy luôn record qua XCom: cached_result không đọc lại index (record có thể vừa hết hạn/bị xóa)
+                ti.xcom_push(key="cached_record", value=record)
+                logging.info(f"Dedup HIT {key[:12]}: dùng kết quả đã lưu, bỏ qua 3 bước xử lý")
+                return "cached_result_step"
+            
+            if result_index.try_acquire(key, owner):
+                logging.info(f"Dedup MISS {key[:12]}: xử lý mới")
+                return "preprocessing_step"
+            
+            # Run khác đang xử lý cùng ảnh -> chờ kết quả thay vì xử lý lần nữa
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning(f"Chờ run {result_index.lock_owner(key)} quá lâu, tự xử lý (không giữ lock)")
+                return "preprocessing_step"
+            
+            logging.info(f"Run {result_index.lock_owner(key)} đang xử lý ảnh trùng, chờ tối đa {remaining:.0f}s")
+            result_index.wait_for(key, timeout=remaining)
+
+    # --- TASK 0b: LẤY KẾT QUẢ ĐÃ LƯU ---
+    @task(task_id="cached_result_step")
+    def cached_result(**context):
+        record = context['ti'].xcom_pull(task_ids="dedup_check", key="cached_record")
+        if record is None:
+            raise ValueError("dedup_check chọn nhánh cached nhưng không đẩy record qua XCom")
+        
+        logging.info(f"Kết quả từ run {record.get('dag_run_id')}: {record['result']}")
+        return record['result']
 
     # --- TASK 1: TIỀN XỬ LÝ (PREPROCESSING) ---
     @task(task_id="preprocessing_step")
@@ -84,20 +145,21 @@ def ocr_pipeline():
         if not image_path:
             raise ValueError("Thiếu tham số 'image_path' trong cấu hình Trigger!")
 
-        # 2. Bước Load Model (Nếu chưa load)
-        call_api_step(settings.PREPROC_URL, "load_model", {"model_name": model_name}, "Preproc-Load")
-        
-        # 3. Bước Xử lý ảnh (detection)
-        result = call_api_step(
-            settings.PREPROC_URL, 
-            "process", 
-            {"image_path": image_path, "model_name": model_name}, 
-            "Preproc-Exec"
-        )
+        # 2. Bước Xử lý ảnh (detection)
+        # Model chỉ được load khi cache readiness hết hạn và service báo chưa load
+        # output_artifact: service ghi detection_data ra /data/artifacts, chỉ trả về reference
+        # Trace ID của run đi theo header X-Trace-Id tới service (spans: decode, blob, forward, serialize)
+        with traced(trace_id_for_run(context['dag_run'].run_id), "preprocessing_step", image_path=image_path):
+            result = call_model_step(
+                settings.PREPROC_URL, 
+                "process", 
+                {"image_path": image_path, "model_name": model_name, "output_artifact": True}, 
+                "Preproc-Exec"
+            )
         
         logging.info(f"Preprocessing Output: {result}")
         
-        # Trả về detection data để task sau dùng
+        # Trả về detection data (artifact reference) để task sau dùng
         return {
             "image_path": image_path,
             "detection_data": result.get('data')
@@ -112,23 +174,23 @@ def ocr_pipeline():
         image_path = preprocess_result['image_path']
         detection_data = preprocess_result['detection_data']
         
-        # 1. Load Model
-        call_api_step(settings.RECOG_URL, "load_model", {"model_name": model_name}, "Recog-Load")
-        
-        # 2. Dự đoán (Predict) - truyền cả detection_data
-        result = call_api_step(
-            settings.RECOG_URL, 
-            "predict", 
-            {
-                "image_path": image_path,
-                "model_name": model_name,
-                "detection_data": detection_data
-            }, 
-            "Recog-Exec"
-        )
+        # Dự đoán (Predict) - truyền cả detection_data (service tự đọc artifact reference)
+        with traced(trace_id_for_run(context['dag_run'].run_id), "recognition_step"):
+            result = call_model_step(
+                settings.RECOG_URL, 
+                "predict", 
+                {
+                    "image_path": image_path,
+                    "model_name": model_name,
+                    "detection_data": detection_data,
+                    "profile": conf.get('recognition_profile'),  # fast | balanced | accurate
+                    "output_artifact": True
+                }, 
+                "Recog-Exec"
+            )
         
         logging.info(f"Recognition Output: {result}")
-        # Trả về data để task sau có thể xử lý
+        # Trả về artifact reference để task sau có thể xử lý
         return result.get('data')
 
     # --- TASK 3: HẬU XỬ LÝ (POSTPROCESSING) ---
@@ -137,28 +199,59 @@ def ocr_pipeline():
         conf = context['dag_run'].conf
         model_name = conf.get('postprocess_model', 'regex_invoice_vn')
         
-        # 1. Load Logic/Rule
-        call_api_step(settings.POST_URL, "load_model", {"model_name": model_name}, "Post-Load")
-        
-        # 2. Chạy hậu xử lý
-        result = call_api_step(
-            settings.POST_URL, 
-            "process", 
-            {"input_path": recognition_data, "model_name": model_name}, 
-            "Post-Exec"
-        )
+        # Chạy hậu xử lý
+        with traced(trace_id_for_run(context['dag_run'].run_id), "postprocessing_step"):
+            result = call_model_step(
+                settings.POST_URL, 
+                "process", 
+                {"input_path": recognition_data, "model_name": model_name}, 
+                "Post-Exec"
+            )
         
         logging.info(f"FINAL RESULT: {result}")
         return result
     
+    # --- TASK 3b: TRẢ KẾT QUẢ CUỐI + LƯU VÀO CHỈ MỤC DEDUP ---
+    @task(task_id="publish_result", trigger_rule="none_failed_min_one_success")
+    def publish_result(postprocess_result, recognition_data, cached, **context):
+        """
+        Kết quả cuối của run, từ pipeline vừa chạy hoặc từ chỉ mục dedup:
+        {"recognition": kết quả OCR (đã đọc từ artifact), "postprocess": response của bước hậu xử lý}
+        """
+        dag_run_id = context['dag_run'].run_id
+        
+        if postprocess_result is None:
+            result = cached
+        else:
+            # Frontend hiển thị text OCR: đọc artifact ngay ở đây thay vì trả reference
+            result = {
+                "recognition": resolve_artifact(recognition_data),
+                "postprocess": postprocess_result
+            }
+            key = context['ti'].xcom_pull(task_ids="dedup_check", key="result_key")
+            if key:
+                result_index.put(
+                    key,
+                    result,
+                    dag_run_id=dag_run_id,
+                    image_path=context['dag_run'].conf.get('image_path')
+                )
+        
+        # Báo frontend ngay lập tức, không phải đợi poll Airflow API
+        notify_run_finished(dag_run_id, "success", result=result, notify_dir=settings.RUN_RESULTS_DIR)
+        return result
+    
     # --- TASK 4: DỌN DẸP ẢNH SAU KHI XỬ LÝ XONG ---
     @task(task_id="cleanup_step", trigger_rule="all_done")
     def cleanup_uploaded_image(**context):
-        """Xóa ảnh đã upload để tránh đầy ổ đĩa"""
+        """Xóa ảnh đầu vào để tránh đầy ổ đĩa (trừ ảnh stage từ frontend)"""
         conf = context['dag_run'].conf
         image_path = conf.get('image_path')
         
-        if image_path and os.path.exists(image_path):
+        if is_staged_upload(image_path):
+            # Cùng nội dung = cùng file: run khác có thể đang dùng, ocr_maintenance xóa theo tuổi
+            logging.info(f"Giữ lại ảnh stage dùng chung: {image_path}")
+        elif image_path and os.path.exists(image_path):
             try:
                 os.remove(image_path)
                 logging.info(f"✓ Đã xóa file: {image_path}")
@@ -166,19 +259,47 @@ def ocr_pipeline():
                 logging.warning(f"Không thể xóa file {image_path}: {str(e)}")
         else:
             logging.warning(f"File không tồn tại hoặc chưa được chỉ định: {image_path}")
+        
+        # Trả lock dedup (kể cả khi run lỗi) để run trùng đang chờ có thể tự xử lý
+        dag_run_id = context['dag_run'].run_id
+        key = context['ti'].xcom_pull(task_ids="dedup_check", key="result_key")
+        if key:
+            result_index.release(key, dag_run_id)
+        
+        # publish_result không chạy tới -> run lỗi, báo frontend luôn
+        if not has_run_notification(dag_run_id, notify_dir=settings.RUN_RESULTS_DIR):
+            notify_run_finished(dag_run_id, "failed", error="Pipeline failed before publish_result",
+                                notify_dir=settings.RUN_RESULTS_DIR)
+        
+        # Tổng hợp spans của run (cả khi lỗi): stage nào chiếm nhiều thời gian nhất
+        trace_id = trace_id_for_run(dag_run_id)
+        try:
+            summary = write_trace_summary(trace_id, trace_dir=settings.TRACE_DIR)
+            if summary['num_spans']:
+                logging.info(
+                    f"Trace {trace_id}: {summary['wall_ms']}ms, dominant stage={summary['dominant_stage']}, "
+                    f"stages={ {name: stat['total_ms'] for name, stat in summary['stages'].items()} }"
+                )
+        except Exception as e:
+            logging.warning(f"Không thể tổng hợp trace {trace_id}: {str(e)}")
 
     # --- ĐỊNH NGHĨA LUỒNG DỮ LIỆU (DATA FLOW) ---
     
+    # Task 0 chạy -> rẽ nhánh: ảnh đã xử lý thì lấy kết quả cũ, chưa thì chạy pipeline
+    branch = dedup_check()
+    cached_output = cached_result()
+    
     # Task 1 chạy -> kết quả truyền vào Task 2
     step1_output = preprocess_image()
+    branch >> [step1_output, cached_output]
     
     # Task 2 chạy -> kết quả truyền vào Task 3
     step2_output = recognize_text(step1_output)
     
-    # Task 3 chạy -> Ra kết quả cuối cùng
-    final_output = post_process(step2_output)
+    # Task 3 chạy -> Ra kết quả cuối cùng (lưu vào chỉ mục dedup)
+    final_output = publish_result(post_process(step2_output), step2_output, cached_output)
     
-    # Task 4 cleanup (chạy sau task 3, dù thành công hay thất bại)
+    # Task 4 cleanup (chạy sau khi có kết quả, dù thành công hay thất bại)
     cleanup_task = cleanup_uploaded_image()
     final_output >> cleanup_task
 
@@ -0,0 +1,124 @@
+import sys
+import os
+import logging
+from datetime import timedelta
+from airflow.decorators import dag, task
+import pendulum
+
+# --- CẤU HÌNH ĐƯỜNG DẪN IMPORT ---
+# Thêm thư mục cha vào sys.path để import được file config.py nằm ngoài folder dags
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.pipeline.operators import OCRServiceOperator
+from src.utils.tracing import trace_id_for_run, write_trace_summary
+from src.frontend.staging import is_staged_upload
+
+try:
+    from config import settings
+except ImportError:
+    # Fallback nếu không tìm thấy file config (để tránh lỗi import khi IDE check)
+    logging.warning("Không tìm thấy config.py, sử dụng cấu hình mặc định.")
+    class MockSettings:
+        PREPROC_URL = "http://api-preprocessing:5000"
+        RECOG_URL = "http://api-recognition:5001"
+        POST_URL = "http://api-postprocessing:5002"
+        TRACE_DIR = "/data/traces"
+    settings = MockSettings()
+
+# --- ĐỊNH NGHĨA CÁC THAM SỐ MẶC ĐỊNH ---
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(minutes=1),
+}
+
+@dag(
+    dag_id='ocr_system_pipeline_deferrable',
+    default_args=default_args,
+    description='Pipeline OCR 3 bước dùng operator deferrable (chờ kết quả trên triggerer, không giữ worker slot)',
+    schedule=None,
+    start_date=pendulum.today('UTC').add(days=-1),
+    tags=['ocr', 'mlops', 'deferrable'],
+    catchup=False,
+    render_template_as_native_obj=True  # Template XCom trả về object Python, không phải string
+)
+def ocr_pipeline_deferrable():
+    """Cùng config trigger với ocr_system_pipeline_v2 (image_path, preprocess_model, ...)"""
+
+    # --- TASK 1: TIỀN XỬ LÝ (PREPROCESSING) ---
+    preprocess = OCRServiceOperator(
+        task_id="preprocessing_step",
+        service_url=settings.PREPROC_URL,
+        endpoint="process",
+        load_model_name="{{ dag_run.conf.get('preprocess_model', 'ssd_mobilenet_v2') }}",
+        payload={
+            "image_path": "{{ dag_run.conf['image_path'] }}",
+            "model_name": "{{ dag_run.conf.get('preprocess_model', 'ssd_mobilenet_v2') }}",
+            "output_artifact": True
+        },
+        result_key="data"  # Artifact reference của detection_data
+    )
+
+    # --- TASK 2: NHẬN DIỆN (RECOGNITION) ---
+    recognize = OCRServiceOperator(
+        task_id="recognition_step",
+        service_url=settings.RECOG_URL,
+        endpoint="predict",
+        load_model_name="{{ dag_run.conf.get('recognition_model', 'easyocr_vi_en') }}",
+        payload={
+            "image_path": "{{ dag_run.conf['image_path'] }}",
+            "model_name": "{{ dag_run.conf.get('recognition_model', 'easyocr_vi_en') }}",
+            "detection_data": "{{ ti.xcom_pull(task_ids='preprocessing_step') }}",
+            "profile": "{{ dag_run.conf.get('recognition_profile', '') }}",  # rỗng = mặc định của service
+            "output_artifact": True
+        },
+        result_key="data"
+    )
+
+    # --- TASK 3: HẬU XỬ LÝ (POSTPROCESSING) ---
+    post_process = OCRServiceOperator(
+        task_id="postprocessing_step",
+        service_url=settings.POST_URL,
+        endpoint="process",
+        load_model_name="{{ dag_run.conf.get('postprocess_model', 'regex_invoice_vn') }}",
+        payload={
+            "input_path": "{{ ti.xcom_pull(task_ids='recognition_step') }}",
+            "model_name": "{{ dag_run.conf.get('postprocess_model', 'regex_invoice_vn') }}"
+        }
+    )
+
+    # --- TASK 4: DỌN DẸP ẢNH SAU KHI XỬ LÝ XONG ---
+    @task(task_id="cleanup_step", trigger_rule="all_done")
+    def cleanup_uploaded_image(**context):
+        """Xóa ảnh đầu vào để tránh đầy ổ đĩa (trừ ảnh stage từ frontend)"""
+        image_path = context['dag_run'].conf.get('image_path')
+
+        if is_staged_upload(image_path):
+            # Cùng nội dung = cùng file: run khác có thể đang dùng, ocr_maintenance xóa theo tuổi
+            logging.info(f"Giữ lại ảnh stage dùng chung: {image_path}")
+        elif image_path and os.path.exists(image_path):
+            try:
+                os.remove(image_path)
+                logging.info(f"✓ Đã xóa file: {image_path}")
+            except Exception as e:
+                logging.warning(f"Không thể xóa file {image_path}: {str(e)}")
+        else:
+            logging.warning(f"File không tồn tại hoặc chưa được chỉ định: {image_path}")
+
+        # Tổng hợp spans của run (các job nền trên services), lỗi ghi trace không làm hỏng task dọn dẹp
+        trace_id = trace_id_for_run(context['dag_run'].run_id)
+        try:
+            summary = write_trace_summary(trace_id, trace_dir=settings.TRACE_DIR)
+            if summary['num_spans']:
+                logging.info(f"Trace {trace_id}: dominant stage={summary['dominant_stage']}")
+        except Exception as e:
+            logging.warning(f"Không thể tổng hợp trace {trace_id}: {str(e)}")
+
+    # --- ĐỊNH NGHĨA LUỒNG DỮ LIỆU ---
+    preprocess >> recognize >> post_process >> cleanup_uploaded_image()
+
+# Khởi tạo DAG
+ocr_deferrable_dag = ocr_pipeline_deferrable()
@@ -2,60 +2,145 @@
 from flask import Flask, request, jsonify
 import sys
 import os
+import logging
 import threading
 
 # Thêm đường dẫn cha để import được src.core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
+from src.utils.artifacts import resolve_artifact
+from src.utils.jobs import register_job_routes
+from src.utils.http import enable_gzip_requests, enable_tracing
+from src.utils.model_state import ModelStateVersion, register_model_state_routes
+from src.utils.tracing import span, install_log_filter, LOG_FORMAT
+
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+install_log_filter()  # %(trace_id)s có giá trị ngay từ log khởi động đầu tiên
+
 app = Flask(__name__)
+enable_gzip_requests(app)  # Airflow client nén gzip các payload lớn
+enable_tracing(app, "postprocessing")  # X-Trace-Id từ DAG run -> spans ghi ra OCR_TRACE_DIR
 
 # KHO CHỨA LOGIC/RULES TRONG RAM (Global Variable) - Thread-safe
 active_models = {}
 models_lock = threading.Lock()  # Prevent race conditions
+state_version = ModelStateVersion()  # Tăng mỗi lần load/unload (ETag của /model_state)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Kiểm tra service hoạt động"""
     return jsonify({"status": "healthy", "service": "postprocessing"})
 
+# GET /model_state + header X-Model-State-Version
+register_model_state_routes(app, "postprocessing", active_models, models_lock, state_version)
+
+def _load_model(model_name):
+    """Nạp logic/rules vào RAM, trả về (body, status_code)"""
+    with models_lock:
+        if model_name in active_models:
+            return {"status": "already_loaded", "model": model_name}, 200
+        
+        # TODO: Nạp rules thật khi cần
+        # Hiện tại chỉ lưu tên model vào RAM
+        active_models[model_name] = {"loaded": True, "type": "postprocessing", "rules": []}
+    
+    state_version.bump()
+    return {"status": "loaded", "model": model_name}, 200
+
 @app.route('/load_model', methods=['POST'])
 def load_model():
     """Airflow gọi API này để nạp logic/rules trước khi chạy"""
     config = request.json
     model_name = config.get('model_name', 'regex_invoice_vn')
     
-    with models_lock:
-        if model_name in active_models:
-            return jsonify({"status": "already_loaded", "model": model_name})
+    body, status_code = _load_model(model_name)
+    return jsonify(body), status_code
+
+def _ensure_model(data, default_model):
+    """
+    Trả về (model_name, error_response)
+    Nếu model chưa load và request có auto_load=true thì load luôn (lazy load lần dùng đầu)
+    """
+    model_name = data.get('model_name', default_model)
+    
+    if model_name not in active_models:
+        if not data.get('auto_load'):
+            return model_name, ({"error": f"Model {model_name} not loaded. Please load it first"}, 400)
         
-        # TODO: Nạp rules thật khi cần
-        # Hiện tại chỉ lưu tên model vào RAM
-        active_models[model_name] = {"loaded": True, "type": "postprocessing", "rules": []}
+        body, status_code = _load_model(model_name)
+        if status_code != 200:
+            return model_name, (body, status_code)
     
-    return jsonify({"status": "loaded", "model": model_name})
+    return model_name, None
 
-@app.route('/process', methods=['POST'])
-def process():
-    """Airflow gọi API này để hậu xử lý kết quả OCR"""
-    data = request.json
-    model_name = data.get('model_name', 'regex_invoice_vn')
+def _handle_process(data):
+    """Logic của /process, tách riêng để dùng được cả trong background job"""
     input_path = data.get('input_path')
     
     if not input_path:
-        return jsonify({"error": "Missing input_path parameter"}), 400
+        return {"error": "Missing input_path parameter"}, 400
     
-    if model_name not in active_models:
-        return jsonify({"error": f"Model {model_name} not loaded. Please load it first"}), 400
+    model_name, error = _ensure_model(data, 'regex_invoice_vn')
+    if error:
+        return error
     
-    # TODO: Xử lý hậu kỳ thật khi cần (extract fields từ JSON)
-    # Trả về cấu trúc generic có thể dùng cho mọi loại model
+    with span("postprocess", model=model_name):
+        # input_path có thể là artifact reference do recognition ghi ra: reference hỏng/hết hạn -> 400
+        # TODO: Xử lý hậu kỳ thật khi cần (extract fields từ nội dung đã đọc)
+        # Trả về cấu trúc generic có thể dùng cho mọi loại model
+        try:
+            resolve_artifact(input_path)
+        except (ValueError, FileNotFoundError) as e:
+            return {"error": str(e)}, 400
     
-    return jsonify({
+    return {
         "status": "success",
         "model_used": model_name,
         "data": None,
         "message": "Postprocessing completed (no actual processing implemented yet)"
-    })
+    }, 200
+
+@app.route('/process', methods=['POST'])
+def process():
+    """Airflow gọi API này để hậu xử lý kết quả OCR"""
+    body, status_code = _handle_process(request.json)
+    return jsonify(body), status_code
+
+def _handle_process_batch(data):
+    """Logic của /process_batch: mỗi input xử lý như /process, lỗi của 1 input không làm hỏng cả batch"""
+    inputs = data.get('inputs')  # List các input giống input_path của /process
+    
+    if not inputs:
+        return {"error": "Missing inputs parameter"}, 400
+    
+    model_name, error = _ensure_model(data, 'regex_invoice_vn')
+    if error:
+        return error
+    
+    items = []
+    for input_path in inputs:
+        body, status_code = _handle_process({"model_name": model_name, "input_path": input_path})
+        if status_code == 200:
+            items.append({"status": "success", "data": body["data"]})
+        else:
+            items.append({"status": "error", "error": body.get("error")})
+    
+    num_failed = sum(1 for item in items if item["status"] == "error")
+    return {
+        "status": "success",
+        "model_used": model_name,
+        "data": items,
+        "message": f"Postprocessed {len(items)} inputs ({num_failed} failed)"
+    }, 200
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """Batch DAG gọi API này để hậu xử lý nhiều kết quả OCR trong 1 request"""
+    body, status_code = _handle_process_batch(request.json)
+    return jsonify(body), status_code
+
+# Background jobs cho operator deferrable: POST /jobs, GET /jobs/<job_id>
+job_manager = register_job_routes(app, {"process": _handle_process, "process_batch": _handle_process_batch})
 
 @app.route('/unload_model', methods=['POST'])
 def unload_model():
@@ -68,6 +153,7 @@ def unload_model():
     with models_lock:
         if model_name in active_models:
             del active_models[model_name]
+    state_version.bump()
     
     import gc
     gc.collect()
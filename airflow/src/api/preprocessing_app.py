@@ -1,39 +1,110 @@
 # src/api/preprocessing_app.py
+import time
+_startup_t0 = time.perf_counter()  # Mốc đo thời gian import + khởi động
+
 from flask import Flask, request, jsonify
 import sys
 import os
 import logging
 import threading
+import hashlib
 
 # Thêm đường dẫn cha để import được src.core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
 from src.core.detection import SSDMobileNetDetector
+from src.core.preprocessing import DocumentPreprocessor, DEFAULT_STEPS
+from src.utils.artifacts import put_artifact
+from src.utils.jobs import register_job_routes
+from src.utils.http import enable_gzip_requests, enable_tracing, ndjson_response
+from src.utils.documents import is_multipage_document, iter_pages_prefetch, DEFAULT_MAX_PAGES_IN_FLIGHT
+from src.utils.model_state import ModelStateVersion, register_model_state_routes
+from src.utils.memory import get_rss_mb, release_memory, MemoryLedger, register_memory_routes
+from src.utils.model_cache import model_cache
+from src.utils.startup import StartupState, register_ready_route, preload_in_background, WARMUP_RUNS
+from src.utils.tracing import span, install_log_filter, LOG_FORMAT
+from src.utils.instance_pool import PoolExhausted, register_pool_routes
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+install_log_filter()  # %(trace_id)s có giá trị ngay từ log khởi động đầu tiên
 logger = logging.getLogger(__name__)
 
+startup = StartupState("preprocessing", started_at=_startup_t0)
+startup.record("imports", _startup_t0)
+_app_init_t0 = time.perf_counter()
+
 app = Flask(__name__)
+enable_gzip_requests(app)  # Airflow client nén gzip các payload lớn
+enable_tracing(app, "preprocessing")  # X-Trace-Id từ DAG run -> spans ghi ra OCR_TRACE_DIR
 
 # KHO CHỨA MODEL TRONG RAM (Global Variable) - Thread-safe
 active_models = {}
 models_lock = threading.Lock()  # Prevent race conditions
+load_lock = threading.Lock()  # Chỉ 1 model được load tại 1 thời điểm
+state_version = ModelStateVersion()  # Tăng mỗi lần load/unload (ETag của /model_state)
+memory_ledger = MemoryLedger()  # RSS theo model qua các chu kỳ load/unload
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Kiểm tra service hoạt động"""
     return jsonify({"status": "healthy", "service": "preprocessing"})
 
-@app.route('/load_model', methods=['POST'])
-def load_model():
-    """Airflow gọi API này để nạp model trước khi chạy"""
-    config = request.json
-    model_name = config.get('model_name', 'ssd_mobilenet_v2')
-    
-    with models_lock:
-        if model_name in active_models:
-            return jsonify({"status": "already_loaded", "model": model_name})
-    
+# GET /model_state + header X-Model-State-Version
+register_model_state_routes(app, "preprocessing", active_models, models_lock, state_version)
+# GET /ready: 503 cho tới khi models preload (OCR_PRELOAD_MODELS) đã load + warm-up xong
+register_ready_route(app, startup)
+# GET /memory, snapshot/diff tracemalloc: kiểm chứng unload trả lại RAM
+allocation_tracker = register_memory_routes(app, "preprocessing", memory_ledger)
+# GET /pools: số bản network, thời gian chờ, % bận của pool từng detector
+register_pool_routes(app, active_models, models_lock)
+
+def _load_model(model_name, config):
+    """
+    Nạp model vào RAM, trả về (body, status_code)
+    Dùng cho /load_model và cho lazy load khi request có auto_load
+    """
+    # Serialize các lần load để 2 request cùng lúc không load trùng 1 model
+    with load_lock:
+        with models_lock:
+            if model_name in active_models:
+                return {"status": "already_loaded", "model": model_name}, 200
+        
+        # Đo RAM tăng thêm khi load (chỉ 1 model load tại 1 thời điểm nên chênh lệch RSS là của model này)
+        rss_before = get_rss_mb()
+        start = time.perf_counter()
+        body, status_code = _load_model_locked(model_name, config)
+        if status_code == 200:
+            rss_after = get_rss_mb()
+            memory_ledger.record_load(model_name, rss_before, rss_after)
+            load_stats = {
+                "load_rss_mb": round(rss_after - rss_before, 1),
+                "load_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            with models_lock:
+                instance = active_models.get(model_name, {}).get("instance")
+            # cold: đọc weights từ disk, cached: build lại từ artifact cache của process
+            load_stats["load_kind"] = getattr(instance, "load_kind", None)
+            # Backend/target/số thread thực tế + forward_ms để tune throughput theo loại node
+            if hasattr(instance, "inference_settings"):
+                load_stats["inference"] = instance.inference_settings()
+            
+            # Warm-up trên ảnh giả để request thật đầu tiên không chịu chi phí khởi tạo
+            warmup_runs = int(config.get('warmup_runs', WARMUP_RUNS))
+            if warmup_runs > 0 and hasattr(instance, "warmup"):
+                try:
+                    load_stats["warmup_ms"] = instance.warmup(warmup_runs)
+                except Exception as e:
+                    logger.warning(f"Warm-up {model_name} failed: {str(e)}")
+            
+            with models_lock:
+                if model_name in active_models:
+                    active_models[model_name].update(load_stats)
+            body.update(load_stats)
+            logger.info(f"Load {model_name}: {load_stats}")
+        return body, status_code
+
+def _load_model_locked(model_name, config):
+    """Phần load thật, chỉ gọi khi đang giữ load_lock"""
     try:
         if model_name == 'ssd_mobilenet_v2' or model_name == 'ssd':
             # Khởi tạo SSD MobileNet V2
@@ -41,14 +112,25 @@ def load_model():
             config_path = config.get('config_path', '/weights/ssd_mobilenet_v2_coco.pbtxt')
             confidence_threshold = config.get('confidence_threshold', 0.5)
             nms_threshold = config.get('nms_threshold', 0.4)
+            reduced_decode = config.get('reduced_decode', True)
             
+            # OpenCV DNN: dnn_backend, dnn_target, num_threads, precision (+ calibration_images cho int8)
+            # pool_size bản network để các request forward song song, chờ tối đa pool_timeout giây
             detector = SSDMobileNetDetector(
                 model_path=model_path,
                 config_path=config_path,
                 confidence_threshold=confidence_threshold,
-                nms_threshold=nms_threshold
+                nms_threshold=nms_threshold,
+                reduced_decode=reduced_decode,
+                backend=config.get('dnn_backend'),
+                target=config.get('dnn_target'),
+                num_threads=config.get('num_threads'),
+                precision=config.get('precision', 'fp32'),
+                calibration_images=config.get('calibration_images'),
+                pool_size=config.get('pool_size'),
+                pool_timeout=config.get('pool_timeout')
             )
-            detector.load_model()
+            detector.load_model(artifact_cache=model_cache)
             
             with models_lock:
                 active_models[model_name] = {
@@ -57,86 +139,276 @@ def load_model():
                     "loaded": True
                 }
             
+            state_version.bump()
             logger.info(f"Loaded model: {model_name}")
-            return jsonify({"status": "loaded", "model": model_name})
+            return {"status": "loaded", "model": model_name}, 200
+        elif model_name == 'default_binarize':
+            # Pipeline làm sạch ảnh scan (không cần weights)
+            preprocessor = DocumentPreprocessor(
+                steps=config.get('steps', DEFAULT_STEPS),
+                output_dir=config.get('output_dir', '/data/preprocessed'),
+                denoise_ksize=config.get('denoise_ksize', 3),
+                block_size=config.get('block_size', 31),
+                threshold_c=config.get('threshold_c', 15),
+                max_skew_angle=config.get('max_skew_angle', 5.0)
+            )
+            preprocessor.load_model()
+            
+            with models_lock:
+                active_models[model_name] = {
+                    "instance": preprocessor,
+                    "type": "document",
+                    "loaded": True
+                }
+            
+            state_version.bump()
+            logger.info(f"Loaded model: {model_name}")
+            return {"status": "loaded", "model": model_name}, 200
         else:
             # Fallback cho các model khác (skeleton)
             with models_lock:
                 active_models[model_name] = {"loaded": True, "type": "preprocessing"}
-            return jsonify({"status": "loaded", "model": model_name, "message": "Skeleton model"})
+            state_version.bump()
+            return {"status": "loaded", "model": model_name, "message": "Skeleton model"}, 200
             
     except Exception as e:
         logger.error(f"Failed to load model {model_name}: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
 
-@app.route('/process', methods=['POST'])
-def process():
-    """Airflow gọi API này để tiền xử lý ảnh"""
-    data = request.json
-    model_name = data.get('model_name', 'ssd_mobilenet_v2')
+@app.route('/load_model', methods=['POST'])
+def load_model():
+    """Airflow gọi API này để nạp model trước khi chạy"""
+    config = request.json
+    model_name = config.get('model_name', 'ssd_mobilenet_v2')
+    
+    body, status_code = _load_model(model_name, config)
+    return jsonify(body), status_code
+
+def _ensure_model(data, default_model):
+    """
+    Trả về (model_name, model_info, error_response)
+    Nếu model chưa load và request có auto_load=true thì load luôn (lazy load lần dùng đầu)
+    model_info lấy trong models_lock: /unload_model chạy song song chỉ xóa entry khỏi active_models,
+    request đang chạy vẫn dùng object đã lấy thay vì tra lại active_models[model_name] (KeyError)
+    """
+    model_name = data.get('model_name', default_model)
+    
+    with models_lock:
+        model_info = active_models.get(model_name)
+    if model_info is not None:
+        return model_name, model_info, None
+    
+    if not data.get('auto_load'):
+        return model_name, None, ({"error": f"Model {model_name} not loaded. Please load it first"}, 400)
+    
+    body, status_code = _load_model(model_name, data.get('load_config') or {})
+    if status_code != 200:
+        return model_name, None, (body, status_code)
+    
+    with models_lock:
+        model_info = active_models.get(model_name)
+    if model_info is None:
+        # Bị unload ngay sau khi load xong: client retry
+        return model_name, None, ({"error": f"Model {model_name} was unloaded during the request"}, 503)
+    return model_name, model_info, None
+
+def _process_single(model_info, image_path, output_name=None):
+    """Xử lý 1 ảnh (đường dẫn hoặc trang đã decode) với model đã load, trả về (data, message)"""
+    if model_info.get("type") == "document":
+        # Pipeline làm sạch ảnh: ghi ảnh đã xử lý, recognition sẽ đọc output_path
+        with span("preprocess") as preprocess_span:
+            result = model_info["instance"].process(image_path, output_name=output_name)
+            preprocess_span.set(timings_ms=result["timings_ms"])
+        return result, f"Preprocessed in {result['timings_ms']['total']}ms"
+    
+    if "instance" in model_info:
+        # Model thật đã được load
+        detector = model_info["instance"]
+        result = detector.detect(image_path)
+        return result, f"Detected {result['num_detections']} objects"
+
+    # Skeleton model
+    return None, "Preprocessing completed (skeleton mode)"
+
+def _handle_process(data):
+    """Logic của /process, tách riêng để dùng được cả trong background job"""
     image_path = data.get('image_path')
     
     if not image_path:
-        return jsonify({"error": "Missing image_path parameter"}), 400
+        return {"error": "Missing image_path parameter"}, 400
     
-    if model_name not in active_models:
-        return jsonify({"error": f"Model {model_name} not loaded. Please load it first"}), 400
+    if is_multipage_document(image_path):
+        return {"error": "Multi-page document (PDF/TIFF): use /process_document"}, 400
+    
+    model_name, model_info, error = _ensure_model(data, 'ssd_mobilenet_v2')
+    if error:
+        return error
     
     try:
-        model_info = active_models[model_name]
+        result, message = _process_single(model_info, image_path)
         
-        if "instance" in model_info:
-            # Model thật đã được load
-            detector = model_info["instance"]
-            result = detector.detect(image_path)
-            
-            return jsonify({
-                "status": "success",
-                "model_used": model_name,
-                "data": result,
-                "message": f"Detected {result['num_detections']} objects"
-            })
-        else:
-            # Skeleton model
-            return jsonify({
-                "status": "success",
-                "model_used": model_name,
-                "data": None,
-                "message": "Preprocessing completed (skeleton mode)"
-            })
-            
+        # Ghi kết quả ra artifact store, chỉ trả về reference (tránh đẩy payload lớn vào XCom)
+        if data.get('output_artifact') and result is not None:
+            result = put_artifact(result)
+        
+        return {
+            "status": "success",
+            "model_used": model_name,
+            "data": result,
+            "message": message
+        }, 200
+    
+    except PoolExhausted as e:
+        # Mọi bản network đều bận quá pool_timeout: quá tải tạm thời, client retry được
+        logger.warning(f"Processing rejected: {str(e)}")
+        return {"error": str(e)}, 503
     except Exception as e:
         logger.error(f"Processing failed: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+def _handle_process_batch(data):
+    """Logic của /process_batch, tách riêng để dùng được cả trong background job"""
+    image_paths = data.get('image_paths')
+    
+    if not image_paths:
+        return {"error": "Missing image_paths parameter"}, 400
+    
+    model_name, model_info, error = _ensure_model(data, 'ssd_mobilenet_v2')
+    if error:
+        return error
+    
+    items = []
+    
+    # Lỗi của 1 ảnh không làm hỏng cả batch
+    for image_path in image_paths:
+        try:
+            result, _ = _process_single(model_info, image_path)
+            items.append({"image_path": image_path, "status": "success", "data": result})
+        except Exception as e:
+            logger.error(f"Processing failed for {image_path}: {str(e)}")
+            items.append({"image_path": image_path, "status": "error", "error": str(e)})
+    
+    num_failed = sum(1 for item in items if item["status"] == "error")
+    
+    return {
+        "status": "success",
+        "model_used": model_name,
+        "data": items,
+        "message": f"Processed {len(items)} images ({num_failed} failed)"
+    }, 200
+
+@app.route('/process', methods=['POST'])
+def process():
+    """Airflow gọi API này để tiền xử lý ảnh"""
+    body, status_code = _handle_process(request.json)
+    return jsonify(body), status_code
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch():
+    """Batch DAG gọi API này để tiền xử lý nhiều ảnh trong 1 request"""
+    body, status_code = _handle_process_batch(request.json)
+    return jsonify(body), status_code
+
+@app.route('/process_document', methods=['POST'])
+def process_document():
+    """
+    Tiền xử lý tài liệu nhiều trang (PDF/TIFF), trả kết quả từng trang dạng NDJSON ngay khi xong
+    Tối đa max_pages_in_flight trang đã decode nằm trong RAM cùng lúc
+    """
+    data = request.json
+    document_path = data.get('document_path')
+    
+    if not document_path:
+        return jsonify({"error": "Missing document_path parameter"}), 400
+    if not os.path.exists(document_path):
+        return jsonify({"error": f"Document not found: {document_path}"}), 400
+    
+    model_name, model_info, error = _ensure_model(data, 'ssd_mobilenet_v2')
+    if error:
+        body, status_code = error
+        return jsonify(body), status_code
+    
+    max_pages = data.get('max_pages_in_flight', DEFAULT_MAX_PAGES_IN_FLIGHT)
+    doc_key = hashlib.sha256(document_path.encode()).hexdigest()[:16]
+    
+    def generate():
+        num_pages = num_failed = 0
+        try:
+            for page_index, page in iter_pages_prefetch(document_path, max_pages=max_pages, dpi=data.get('dpi', 200)):
+                num_pages += 1
+                # Lỗi của 1 trang không làm hỏng cả tài liệu
+                try:
+                    result, _ = _process_single(model_info, page, output_name=f"{doc_key}_p{page_index:04d}")
+                    yield {"page": page_index, "status": "success", "data": result}
+                except Exception as e:
+                    num_failed += 1
+                    logger.error(f"Processing failed for {document_path} page {page_index}: {str(e)}")
+                    yield {"page": page_index, "status": "error", "error": str(e)}
+        except Exception as e:
+            # Lỗi đọc tài liệu giữa chừng: báo ở dòng cuối (status 200 đã gửi đi)
+            logger.error(f"Cannot read document {document_path}: {str(e)}")
+            yield {"done": True, "status": "error", "error": str(e), "num_pages": num_pages, "num_failed": num_failed}
+            return
+        
+        yield {"done": True, "status": "success", "model_used": model_name, "num_pages": num_pages, "num_failed": num_failed}
+    
+    return ndjson_response(generate())
+
+# Background jobs cho operator deferrable: POST /jobs, GET /jobs/<job_id>
+job_manager = register_job_routes(app, {
+    "process": _handle_process,
+    "process_batch": _handle_process_batch
+})
 
 @app.route('/unload_model', methods=['POST'])
 def unload_model():
     """Giải phóng RAM sau khi chạy xong"""
     model_name = request.json.get('model_name')
+    # purge=true: bỏ luôn artifacts khỏi cache của process (lần load sau đọc lại từ disk)
+    purge = bool(request.json.get('purge', False))
     
     if model_name not in active_models:
         return jsonify({"status": "not_found", "model": model_name})
     
     try:
         model_info = active_models[model_name]
+        rss_before = get_rss_mb()
         
         # Gọi unload nếu có instance
         if "instance" in model_info:
-            model_info["instance"].unload_model()
+            if model_info.get("type") in ("detection", "recognition"):
+                model_info["instance"].unload_model(artifact_cache=model_cache, keep_cached=not purge)
+            else:
+                model_info["instance"].unload_model()
         
         with models_lock:
             del active_models[model_name]
+        state_version.bump()
+        del model_info
         
-        import gc
-        gc.collect()
+        # gc + malloc_trim (+ cache CUDA của torch): gc.collect() không làm RSS giảm vì glibc giữ lại heap đã free
+        released = release_memory()
+        memory = memory_ledger.record_unload(model_name, rss_before, get_rss_mb())
+        memory.update(released)
         
-        logger.info(f"Unloaded model: {model_name}")
-        return jsonify({"status": "unloaded", "model": model_name})
+        logger.info(f"Unloaded model: {model_name} (memory: {memory})")
+        return jsonify({
+            "status": "unloaded",
+            "model": model_name,
+            "memory": memory,
+            "artifact_cache": model_cache.stats() if model_cache else None
+        })
         
     except Exception as e:
         logger.error(f"Failed to unload model {model_name}: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+startup.record("app_init", _app_init_t0)
+
+# Preload + warm-up trên thread nền; chạy bằng script (debug reloader) thì chỉ process con preload
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    preload_in_background(startup, _load_model)
+
 if __name__ == '__main__':
     print("Starting Preprocessing API on port 5000...")
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,4 +1,7 @@
 # src/api/recognition_app.py
+import time
+_startup_t0 = time.perf_counter()  # Mốc đo thời gian import + khởi động
+
 from flask import Flask, request, jsonify
 import sys
 import os
@@ -8,44 +11,113 @@ import threading
 # Thêm đường dẫn cha để import được src.core
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
-from src.core.recognition import EasyOCRRecognizer
+from src.core.recognition import EasyOCRRecognizer, RECOGNITION_PROFILES, DEFAULT_PROFILE
+from src.core.crops import prepare_crops, rescale_regions, offset_regions
+from src.utils.artifacts import put_artifact, resolve_artifact
+from src.utils.jobs import register_job_routes
+from src.utils.http import enable_gzip_requests, enable_tracing, ndjson_response
+from src.utils.documents import is_multipage_document, iter_pages_prefetch, DEFAULT_MAX_PAGES_IN_FLIGHT
+from src.utils.model_state import ModelStateVersion, register_model_state_routes
+from src.utils.memory import get_rss_mb, release_memory, MemoryLedger, register_memory_routes
+from src.utils.model_cache import model_cache
+from src.utils.startup import StartupState, register_ready_route, preload_in_background, WARMUP_RUNS
+from src.utils.tracing import span, install_log_filter, LOG_FORMAT
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+install_log_filter()  # %(trace_id)s có giá trị ngay từ log khởi động đầu tiên
 logger = logging.getLogger(__name__)
 
+startup = StartupState("recognition", started_at=_startup_t0)
+startup.record("imports", _startup_t0)
+_app_init_t0 = time.perf_counter()
+
 app = Flask(__name__)
+enable_gzip_requests(app)  # Airflow client nén gzip các payload lớn
+enable_tracing(app, "recognition")  # X-Trace-Id từ DAG run -> spans ghi ra OCR_TRACE_DIR
 
 # KHO CHỨA MODEL TRONG RAM (Global Variable) - Thread-safe
 # Key: tên model, Value: instance của class
 active_models = {}
 models_lock = threading.Lock()  # Prevent race conditions
+load_lock = threading.Lock()  # Chỉ 1 model được load tại 1 thời điểm
+state_version = ModelStateVersion()  # Tăng mỗi lần load/unload (ETag của /model_state)
+memory_ledger = MemoryLedger()  # RSS theo model qua các chu kỳ load/unload
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Kiểm tra service hoạt động"""
     return jsonify({"status": "healthy", "service": "recognition"})
 
-@app.route('/load_model', methods=['POST'])
-def load_model():
-    """Airflow gọi API này để nạp model trước khi chạy"""
-    config = request.json
-    model_name = config.get('model_name', 'easyocr_vi_en')
-    
-    with models_lock:
-        if model_name in active_models:
-            return jsonify({"status": "already_loaded", "model": model_name})
+# GET /model_state + header X-Model-State-Version
+register_model_state_routes(app, "recognition", active_models, models_lock, state_version)
+# GET /ready: 503 cho tới khi models preload (OCR_PRELOAD_MODELS) đã load + warm-up xong
+register_ready_route(app, startup)
+# GET /memory, snapshot/diff tracemalloc: kiểm chứng unload trả lại RAM
+allocation_tracker = register_memory_routes(app, "recognition", memory_ledger)
+
+def _load_model(model_name, config):
+    """
+    Nạp model vào RAM, trả về (body, status_code)
+    Dùng cho /load_model và cho lazy load khi request có auto_load
+    """
+    # Serialize các lần load để 2 request cùng lúc không load trùng 1 model
+    with load_lock:
+        with models_lock:
+            if model_name in active_models:
+                return {"status": "already_loaded", "model": model_name}, 200
+        
+        # Đo RAM tăng thêm khi load (chỉ 1 model load tại 1 thời điểm nên chênh lệch RSS là của model này)
+        rss_before = get_rss_mb()
+        start = time.perf_counter()
+        body, status_code = _load_model_locked(model_name, config)
+        if status_code == 200:
+            rss_after = get_rss_mb()
+            memory_ledger.record_load(model_name, rss_before, rss_after)
+            load_stats = {
+                "load_rss_mb": round(rss_after - rss_before, 1),
+                "load_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            with models_lock:
+                instance = active_models.get(model_name, {}).get("instance")
+            # cold: đọc weights từ disk, cached: build lại từ artifact cache của process
+            load_stats["load_kind"] = getattr(instance, "load_kind", None)
+            # Precision / số thread thực tế để đối chiếu khi tune theo loại node
+            if hasattr(instance, "inference_settings"):
+                load_stats["inference"] = instance.inference_settings()
+            
+            # Warm-up trên ảnh giả để request thật đầu tiên không chịu chi phí khởi tạo
+            warmup_runs = int(config.get('warmup_runs', WARMUP_RUNS))
+            if warmup_runs > 0 and hasattr(instance, "warmup"):
+                try:
+                    load_stats["warmup_ms"] = instance.warmup(warmup_runs)
+                except Exception as e:
+                    logger.warning(f"Warm-up {model_name} failed: {str(e)}")
+            
+            with models_lock:
+                if model_name in active_models:
+                    active_models[model_name].update(load_stats)
+            body.update(load_stats)
+            logger.info(f"Load {model_name}: {load_stats}")
+        return body, status_code
 
+def _load_model_locked(model_name, config):
+    """Phần load thật, chỉ gọi khi đang giữ load_lock"""
     try:
         if model_name == 'easyocr_vi_en' or model_name == 'easyocr':
             # Khởi tạo EasyOCR
             languages = config.get('languages', ['vi', 'en'])
             gpu = config.get('gpu', False)
             
+            # CPU: quantize (int8 dynamic, mặc định bật), cpu_optimized, torch_threads, torch_interop_threads
             recognizer = EasyOCRRecognizer(
                 languages=languages,
-                gpu=gpu
+                gpu=gpu,
+                quantize=config.get('quantize', True),
+                cpu_optimized=config.get('cpu_optimized'),
+                num_threads=config.get('torch_threads'),
+                interop_threads=config.get('torch_interop_threads')
             )
-            recognizer.load_model()
+            recognizer.load_model(artifact_cache=model_cache)
             
             with models_lock:
                 active_models[model_name] = {
@@ -54,126 +126,374 @@ def load_model():
                     "loaded": True
                 }
             
+            state_version.bump()
             logger.info(f"Loaded model: {model_name}")
-            return jsonify({"status": "loaded", "model": model_name})
+            return {"status": "loaded", "model": model_name}, 200
         else:
             # Fallback cho các model khác
             with models_lock:
                 active_models[model_name] = {"loaded": True, "type": "recognition"}
-            return jsonify({"status": "loaded", "model": model_name, "message": "Skeleton model"})
+            state_version.bump()
+            return {"status": "loaded", "model": model_name, "message": "Skeleton model"}, 200
             
     except Exception as e:
         logger.error(f"Failed to load model {model_name}: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    """Airflow gọi API này để dự đoán"""
-    data = request.json
-    model_name = data.get('model_name', 'easyocr_vi_en')
+@app.route('/load_model', methods=['POST'])
+def load_model():
+    """Airflow gọi API này để nạp model trước khi chạy"""
+    config = request.json
+    model_name = config.get('model_name', 'easyocr_vi_en')
+    
+    body, status_code = _load_model(model_name, config)
+    return jsonify(body), status_code
+
+def _ensure_model(data, default_model):
+    """
+    Trả về (model_name, model_info, error_response)
+    Nếu model chưa load và request có auto_load=true thì load luôn (lazy load lần dùng đầu)
+    model_info lấy trong models_lock: /unload_model chạy song song chỉ xóa entry khỏi active_models,
+    request đang chạy vẫn dùng object đã lấy thay vì tra lại active_models[model_name] (KeyError)
+    """
+    model_name = data.get('model_name', default_model)
+    
+    with models_lock:
+        model_info = active_models.get(model_name)
+    if model_info is not None:
+        return model_name, model_info, None
+    
+    if not data.get('auto_load'):
+        return model_name, None, ({"error": f"Model {model_name} not loaded. Please load it first"}, 400)
+    
+    body, status_code = _load_model(model_name, data.get('load_config') or {})
+    if status_code != 200:
+        return model_name, None, (body, status_code)
+    
+    with models_lock:
+        model_info = active_models.get(model_name)
+    if model_info is None:
+        # Bị unload ngay sau khi load xong: client retry
+        return model_name, None, ({"error": f"Model {model_name} was unloaded during the request"}, 503)
+    return model_name, model_info, None
+
+# Key hợp lệ của "crop_filter" trong request (giá trị mặc định theo env OCR_CROP_*)
+CROP_FILTER_KEYS = ("min_width", "min_height", "min_contrast", "max_area_ratio", "normalize_height")
+# Xếp crop vào canvas mosaic khi request không chỉ định pack_crops (OCR_PACK_CROPS=1)
+PACK_CROPS = os.environ.get("OCR_PACK_CROPS", "0") == "1"
+# Ít crop hơn mức này thì OCR từng crop (chi phí 1 canvas không đáng)
+PACK_MIN_CROPS = int(os.environ.get("OCR_PACK_MIN_CROPS", "8"))
+
+def _resolve_options(data):
+    """
+    Tùy chọn nhận diện của request, trả về (options, error_response)
+        profile: tốc độ/độ chính xác, chuỗi rỗng (vd template Airflow khi conf không có) = OCR_RECOGNITION_PROFILE
+        crop_filter: ngưỡng lọc vùng (min_width, min_height, min_contrast, max_area_ratio, normalize_height)
+        pack_crops: xếp nhiều crop nhỏ vào canvas mosaic, mỗi canvas 1 lần readtext
+    """
+    profile = data.get('profile') or DEFAULT_PROFILE
+    if profile is not None and profile not in RECOGNITION_PROFILES:
+        return None, ({"error": f"Unknown profile: {profile} (available: {', '.join(RECOGNITION_PROFILES)})"}, 400)
+    
+    crop_filter = data.get('crop_filter') or {}
+    unknown = sorted(set(crop_filter) - set(CROP_FILTER_KEYS))
+    if unknown:
+        return None, ({"error": f"Unknown crop_filter keys: {', '.join(unknown)}"}, 400)
+    
+    pack_crops = data.get('pack_crops')
+    return {
+        "profile": profile,
+        "crop_filter": crop_filter,
+        "pack_crops": PACK_CROPS if pack_crops is None else bool(pack_crops)
+    }, None
+
+def _recognize_single(model_info, image_path, detection_data=None, options=None):
+    """
+    Nhận diện 1 ảnh (đường dẫn hoặc trang đã decode) với model đã load, trả về (data, message)
+    options: kết quả của _resolve_options (profile, crop_filter, pack_crops)
+    """
+    if "instance" not in model_info:
+        # Skeleton model
+        return None, "Recognition completed (skeleton mode)"
+    
+    # Model thật đã được load
+    recognizer = model_info["instance"]
+    options = options or {}
+    profile = options.get("profile")
+    crop_filter = dict(options.get("crop_filter") or {})
+    normalize = crop_filter.pop('normalize_height', True)
+    
+    # detection_data có thể là artifact reference do preprocessing ghi ra
+    detection_data = resolve_artifact(detection_data)
+    
+    # Nếu có detection_data từ preprocessing, xử lý theo từng vùng
+    if detection_data and detection_data.get('boxes'):
+        import cv2
+        
+        # Crop các vùng detected (trang của tài liệu nhiều trang đã là numpy array)
+        if isinstance(image_path, (str, os.PathLike)):
+            with span("decode"):
+                image = cv2.imread(str(image_path))
+        else:
+            image = image_path
+        if image is None:
+            raise ValueError(f"Cannot read image: {image_path}")
+        
+        # Clip + bỏ vùng rỗng/quá nhỏ/trắng trơn/phủ cả trang, resize vùng 1 dòng về chiều cao chữ của recognizer
+        boxes = detection_data['boxes']
+        with span("crop", num_boxes=len(boxes)) as crop_span:
+            prepared, crop_report = prepare_crops(
+                image, [box['bbox'] for box in boxes],
+                target_height=getattr(recognizer, "TEXT_HEIGHT", None) if normalize else None,
+                **crop_filter
+            )
+            crop_span.set(num_kept=crop_report["num_kept"])
+        
+        results_per_region = []
+        full_text_parts = []
+        pack_report = None
+        ocr_start = time.perf_counter()
+        
+        # OCR từng crop (span "ocr" ghi trong recognizer), hoặc xếp nhiều crop vào ít canvas mosaic
+        crops = [item["crop"] for item in prepared]
+        if options.get("pack_crops") and len(crops) >= PACK_MIN_CROPS and hasattr(recognizer, "recognize_packed"):
+            ocr_results, pack_report = recognizer.recognize_packed(crops, profile=profile)
+        else:
+            ocr_results = [recognizer.recognize(crop, detail=1, profile=profile) for crop in crops]
+        
+        for item, ocr_result in zip(prepared, ocr_results):
+            box = boxes[item["index"]]
+            # bbox của ocr_regions theo tọa độ crop gốc, image_bbox theo tọa độ ảnh
+            ocr_regions = offset_regions(rescale_regions(ocr_result['regions'], item["scale"]), *item["bbox"][:2])
+            
+            results_per_region.append({
+                "region_id": item["index"],
+                "bbox": item["bbox"],
+                "detection_confidence": box['confidence'],
+                "ocr_text": ocr_result['text'],
+                "ocr_regions": ocr_regions
+            })
+            
+            full_text_parts.append(ocr_result['text'])
+        
+        # Ước lượng thời gian tiết kiệm: số vùng bỏ qua × thời gian OCR trung bình của 1 vùng
+        num_skipped = crop_report["num_input"] - crop_report["num_kept"]
+        ocr_ms = (time.perf_counter() - ocr_start) * 1000
+        crop_report["estimated_saved_ms"] = round(num_skipped * ocr_ms / len(prepared), 1) if prepared else None
+        if num_skipped:
+            logger.info(f"Skipped {num_skipped}/{crop_report['num_input']} regions: {crop_report['skipped']}")
+        
+        data = {
+            "full_text": " ".join(full_text_parts),
+            "regions": results_per_region,
+            "num_regions": len(results_per_region),
+            "crop_filter": crop_report
+        }
+        if pack_report is not None:
+            data["packing"] = pack_report
+        return data, f"Recognized text in {len(results_per_region)} regions"
+    
+    # Không có boxes: OCR toàn bộ ảnh (ảnh đã làm sạch nếu preprocessing có ghi output_path)
+    if detection_data and detection_data.get('output_path'):
+        image_path = detection_data['output_path']
+    result = recognizer.recognize(image_path, detail=1, profile=profile)
+    return result, f"Recognized {result['num_regions']} text regions"
+
+def _handle_predict(data):
+    """Logic của /predict, tách riêng để dùng được cả trong background job"""
     image_path = data.get('image_path')
     detection_data = data.get('detection_data')  # Dữ liệu từ preprocessing step
     
     if not image_path:
-        return jsonify({"error": "Missing image_path parameter"}), 400
+        return {"error": "Missing image_path parameter"}, 400
     
-    if model_name not in active_models:
-        return jsonify({"error": f"Model {model_name} not loaded. Please load it first"}), 400
+    if is_multipage_document(image_path):
+        return {"error": "Multi-page document (PDF/TIFF): use /predict_document"}, 400
+    
+    options, error = _resolve_options(data)
+    if error:
+        return error
+    
+    model_name, model_info, error = _ensure_model(data, 'easyocr_vi_en')
+    if error:
+        return error
     
     try:
-        model_info = active_models[model_name]
+        result, message = _recognize_single(model_info, image_path, detection_data, options)
         
-        if "instance" in model_info:
-            # Model thật đã được load
-            recognizer = model_info["instance"]
-            
-            # Nếu có detection_data từ preprocessing, xử lý theo từng vùng
-            if detection_data and detection_data.get('boxes'):
-                import cv2
-                
-                # Crop các vùng detected
-                image = cv2.imread(str(image_path))
-                results_per_region = []
-                full_text_parts = []
-                
-                for idx, box in enumerate(detection_data['boxes']):
-                    x1, y1, x2, y2 = box['bbox']
-                    cropped = image[y1:y2, x1:x2]
-                    
-                    # OCR trên vùng crop
-                    ocr_result = recognizer.recognize(cropped, detail=1)
-                    
-                    results_per_region.append({
-                        "region_id": idx,
-                        "bbox": box['bbox'],
-                        "detection_confidence": box['confidence'],
-                        "ocr_text": ocr_result['text'],
-                        "ocr_regions": ocr_result['regions']
-                    })
-                    
-                    full_text_parts.append(ocr_result['text'])
-                
-                return jsonify({
-                    "status": "success",
-                    "model_used": model_name,
-                    "data": {
-                        "full_text": " ".join(full_text_parts),
-                        "regions": results_per_region,
-                        "num_regions": len(results_per_region)
-                    },
-                    "message": f"Recognized text in {len(results_per_region)} regions"
-                })
-            else:
-                # Không có detection data, OCR toàn bộ ảnh
-                result = recognizer.recognize(image_path, detail=1)
-                
-                return jsonify({
-                    "status": "success",
-                    "model_used": model_name,
-                    "data": result,
-                    "message": f"Recognized {result['num_regions']} text regions"
-                })
-        else:
-            # Skeleton model
-            return jsonify({
-                "status": "success",
-                "model_used": model_name,
-                "data": None,
-                "message": "Recognition completed (skeleton mode)"
-            })
+        # Ghi kết quả ra artifact store, chỉ trả về reference (tránh đẩy payload lớn vào XCom)
+        if data.get('output_artifact') and result is not None:
+            result = put_artifact(result)
+        
+        return {
+            "status": "success",
+            "model_used": model_name,
+            "profile": options["profile"],
+            "data": result,
+            "message": message
+        }, 200
             
     except Exception as e:
         logger.error(f"Recognition failed: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+def _handle_predict_batch(data):
+    """Logic của /predict_batch, tách riêng để dùng được cả trong background job"""
+    items = data.get('items')  # [{"image_path": ..., "detection_data": ...}, ...]
+    
+    if not items:
+        return {"error": "Missing items parameter"}, 400
+    
+    options, error = _resolve_options(data)
+    if error:
+        return error
+    
+    model_name, model_info, error = _ensure_model(data, 'easyocr_vi_en')
+    if error:
+        return error
+    
+    results = []
+    
+    # Lỗi của 1 ảnh không làm hỏng cả batch
+    for item in items:
+        image_path = item.get('image_path')
+        try:
+            if not image_path:
+                raise ValueError("Missing image_path in item")
+            result, _ = _recognize_single(model_info, image_path, item.get('detection_data'), options)
+            results.append({"image_path": image_path, "status": "success", "data": result})
+        except Exception as e:
+            logger.error(f"Recognition failed for {image_path}: {str(e)}")
+            results.append({"image_path": image_path, "status": "error", "error": str(e)})
+    
+    num_failed = sum(1 for r in results if r["status"] == "error")
+    
+    return {
+        "status": "success",
+        "model_used": model_name,
+        "profile": options["profile"],
+        "data": results,
+        "message": f"Recognized {len(results)} images ({num_failed} failed)"
+    }, 200
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    """Airflow gọi API này để dự đoán"""
+    body, status_code = _handle_predict(request.json)
+    return jsonify(body), status_code
+
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Batch DAG gọi API này để nhận diện nhiều ảnh trong 1 request"""
+    body, status_code = _handle_predict_batch(request.json)
+    return jsonify(body), status_code
+
+@app.route('/predict_document', methods=['POST'])
+def predict_document():
+    """
+    Nhận diện tài liệu nhiều trang (PDF/TIFF), trả kết quả từng trang dạng NDJSON ngay khi xong
+    detection_pages (optional): {"<page>": detection_data} lấy từ /process_document
+    """
+    data = request.json
+    document_path = data.get('document_path')
+    detection_pages = data.get('detection_pages') or {}
+    
+    if not document_path:
+        return jsonify({"error": "Missing document_path parameter"}), 400
+    if not os.path.exists(document_path):
+        return jsonify({"error": f"Document not found: {document_path}"}), 400
+    
+    options, error = _resolve_options(data)
+    if error:
+        body, status_code = error
+        return jsonify(body), status_code
+    
+    model_name, model_info, error = _ensure_model(data, 'easyocr_vi_en')
+    if error:
+        body, status_code = error
+        return jsonify(body), status_code
+    
+    max_pages = data.get('max_pages_in_flight', DEFAULT_MAX_PAGES_IN_FLIGHT)
+    
+    def generate():
+        num_pages = num_failed = 0
+        try:
+            for page_index, page in iter_pages_prefetch(document_path, max_pages=max_pages, dpi=data.get('dpi', 200)):
+                num_pages += 1
+                # Lỗi của 1 trang không làm hỏng cả tài liệu
+                try:
+                    result, _ = _recognize_single(model_info, page, detection_pages.get(str(page_index)), options)
+                    yield {"page": page_index, "status": "success", "data": result}
+                except Exception as e:
+                    num_failed += 1
+                    logger.error(f"Recognition failed for {document_path} page {page_index}: {str(e)}")
+                    yield {"page": page_index, "status": "error", "error": str(e)}
+        except Exception as e:
+            # Lỗi đọc tài liệu giữa chừng: báo ở dòng cuối (status 200 đã gửi đi)
+            logger.error(f"Cannot read document {document_path}: {str(e)}")
+            yield {"done": True, "status": "error", "error": str(e), "num_pages": num_pages, "num_failed": num_failed}
+            return
+        
+        yield {"done": True, "status": "success", "model_used": model_name, "profile": options["profile"],
+               "num_pages": num_pages, "num_failed": num_failed}
+    
+    return ndjson_response(generate())
+
+# Background jobs cho operator deferrable: POST /jobs, GET /jobs/<job_id>
+job_manager = register_job_routes(app, {
+    "predict": _handle_predict,
+    "predict_batch": _handle_predict_batch
+})
 
 @app.route('/unload_model', methods=['POST'])
 def unload_model():
     """Giải phóng RAM sau khi chạy xong"""
     model_name = request.json.get('model_name')
+    # purge=true: bỏ luôn artifacts khỏi cache của process (lần load sau đọc lại từ disk)
+    purge = bool(request.json.get('purge', False))
     
     if model_name not in active_models:
         return jsonify({"status": "not_found", "model": model_name})
     
     try:
         model_info = active_models[model_name]
+        rss_before = get_rss_mb()
         
         # Gọi unload nếu có instance
         if "instance" in model_info:
-            model_info["instance"].unload_model()
+            if model_info.get("type") in ("detection", "recognition"):
+                model_info["instance"].unload_model(artifact_cache=model_cache, keep_cached=not purge)
+            else:
+                model_info["instance"].unload_model()
         
         with models_lock:
             del active_models[model_name]
+        state_version.bump()
+        del model_info
         
-        import gc
-        gc.collect()
+        # gc + malloc_trim (+ cache CUDA của torch): gc.collect() không làm RSS giảm vì glibc giữ lại heap đã free
+        released = release_memory()
+        memory = memory_ledger.record_unload(model_name, rss_before, get_rss_mb())
+        memory.update(released)
         
-        logger.info(f"Unloaded model: {model_name}")
-        return jsonify({"status": "unloaded", "model": model_name})
+        logger.info(f"Unloaded model: {model_name} (memory: {memory})")
+        return jsonify({
+            "status": "unloaded",
+            "model": model_name,
+            "memory": memory,
+            "artifact_cache": model_cache.stats() if model_cache else None
+        })
         
     except Exception as e:
         logger.error(f"Failed to unload model {model_name}: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+startup.record("app_init", _app_init_t0)
+
+# Preload + warm-up trên thread nền; chạy bằng script (debug reloader) thì chỉ process con preload
+if __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    preload_in_background(startup, _load_model)
+
 if __name__ == '__main__':
     print("Starting Recognition API on port 5001...")
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Crops - Lọc và chuẩn hóa vùng detect trước khi đưa vào OCR
+Box bị cắt (clip) về trong ảnh; vùng rỗng, quá nhỏ, gần như trắng trơn hoặc phủ gần cả trang bị bỏ qua
+(mỗi vùng bỏ được là 1 lần gọi readtext tiết kiệm được); vùng 1 dòng được resize về chiều cao chữ của recognizer
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Ngưỡng mặc định (ghi đè theo request qua "crop_filter")
+CROP_MIN_WIDTH = int(os.environ.get("OCR_CROP_MIN_WIDTH", "6"))
+CROP_MIN_HEIGHT = int(os.environ.get("OCR_CROP_MIN_HEIGHT", "6"))
+# Độ lệch chuẩn tối thiểu của mức sáng (kênh lớn nhất): thấp hơn là vùng trắng/đen trơn, không có nét chữ
+CROP_MIN_CONTRAST = float(os.environ.get("OCR_CROP_MIN_CONTRAST", "6.0"))
+# Box phủ quá tỉ lệ này của trang là detection hỏng (OCR cả trang thì gọi không kèm boxes)
+CROP_MAX_AREA_RATIO = float(os.environ.get("OCR_CROP_MAX_AREA_RATIO", "0.9"))
+# Crop cao hơn (hệ số × chiều cao chữ) coi là khối nhiều dòng: giữ nguyên kích thước
+MAX_LINE_HEIGHT_RATIO = 3.0
+# Giới hạn phóng to crop quá nhỏ (phóng quá mức chỉ làm nhòe nét)
+MAX_UPSCALE = 4.0
+
+SKIP_REASONS = ("empty", "too_small", "oversized", "low_contrast")
+
+
+def clip_boxes(bboxes, width, height):
+    """
+    Clip các box [x1, y1, x2, y2] về trong ảnh (vectorized)
+
+    Returns:
+        tuple: (boxes int32 Nx4 đã clip, mask các box bị thay đổi khi clip)
+    """
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    # Box ngược chiều (x2 < x1) do detector trả về: đổi lại thứ tự
+    boxes = np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+    clipped = np.empty_like(boxes)
+    clipped[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    clipped[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    clipped = np.round(clipped).astype(np.int32)
+    return clipped, np.any(clipped != np.round(boxes), axis=1)
+
+
+def classify_regions(image, boxes, min_width=None, min_height=None, min_contrast=None, max_area_ratio=None):
+    """
+    Lý do bỏ qua từng box (mảng chuỗi, "" = giữ lại)
+    Kiểm tra kích thước chạy vectorized trên cả mảng box; độ tương phản (cv2.meanStdDev trên view của ảnh,
+    không copy hay đổi màu pixel) chỉ tính cho các box đã qua kiểm tra kích thước
+    """
+    min_width = CROP_MIN_WIDTH if min_width is None else min_width
+    min_height = CROP_MIN_HEIGHT if min_height is None else min_height
+    min_contrast = CROP_MIN_CONTRAST if min_contrast is None else min_contrast
+    max_area_ratio = CROP_MAX_AREA_RATIO if max_area_ratio is None else max_area_ratio
+
+    widths = boxes[:, 2] - boxes[:, 0]
+    heights = boxes[:, 3] - boxes[:, 1]
+    image_area = image.shape[0] * image.shape[1]
+
+    reasons = np.full(len(boxes), "", dtype=f"<U{max(map(len, SKIP_REASONS))}")
+    reasons[(widths <= 0) | (heights <= 0)] = "empty"
+    reasons[(reasons == "") & ((widths < min_width) | (heights < min_height))] = "too_small"
+    reasons[(reasons == "") & (widths * heights > max_area_ratio * image_area)] = "oversized"
+
+    for i in np.flatnonzero(reasons == ""):
+        x1, y1, x2, y2 = boxes[i]
+        _, std = cv2.meanStdDev(image[y1:y2, x1:x2])
+        if std.max() < min_contrast:
+            reasons[i] = "low_contrast"
+    return reasons
+
+
+def normalize_crop_height(crop, target_height):
+    """
+    Resize crop 1 dòng về chiều cao chữ của recognizer (giữ tỉ lệ)
+
+    Returns:
+        tuple: (crop, scale) - tọa độ trên crop mới / scale = tọa độ trên crop gốc
+    """
+    height = crop.shape[0]
+    if not target_height or height == target_height or height > target_height * MAX_LINE_HEIGHT_RATIO:
+        return crop, 1.0
+
+    scale = min(target_height / height, MAX_UPSCALE)
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    width = max(int(round(crop.shape[1] * scale)), 1)
+    resized = cv2.resize(crop, (width, int(round(height * scale))), interpolation=interpolation)
+    return resized, scale
+
+
+def prepare_crops(image, bboxes, target_height=None, **thresholds):
+    """
+    Clip + lọc + chuẩn hóa các vùng detect
+
+    Args:
+        image: Ảnh BGR (hoặc xám)
+        bboxes: List [x1, y1, x2, y2]
+        target_height: Chiều cao chữ của recognizer (None = không resize)
+        thresholds: min_width, min_height, min_contrast, max_area_ratio (None = mặc định theo env)
+
+    Returns:
+        tuple: (
+            [{"index", "bbox" (đã clip), "crop", "scale"}],
+            {"num_input", "num_kept", "num_clipped", "skipped": {reason: count}, "skipped_regions": [...], "filter_ms"}
+        )
+    """
+    start = time.perf_counter()
+    height, width = image.shape[:2]
+    if not len(bboxes):
+        return [], {"num_input": 0, "num_kept": 0, "num_clipped": 0,
+                    "skipped": dict.fromkeys(SKIP_REASONS, 0), "skipped_regions": [], "filter_ms": 0.0}
+
+    boxes, clipped_mask = clip_boxes(bboxes, width, height)
+    reasons = classify_regions(image, boxes, **thresholds)
+
+    prepared = []
+    for i in np.flatnonzero(reasons == ""):
+        x1, y1, x2, y2 = (int(v) for v in boxes[i])
+        crop, scale = normalize_crop_height(image[y1:y2, x1:x2], target_height)
+        prepared.append({"index": int(i), "bbox": [x1, y1, x2, y2], "crop": crop, "scale": scale})
+
+    report = {
+        "num_input": len(boxes),
+        "num_kept": len(prepared),
+        "num_clipped": int(clipped_mask.sum()),
+        "skipped": {reason: int(np.sum(reasons == reason)) for reason in SKIP_REASONS},
+        "skipped_regions": [{"region_id": int(i), "reason": str(reasons[i])} for i in np.flatnonzero(reasons != "")],
+        "filter_ms": round((time.perf_counter() - start) * 1000, 2)
+    }
+    return prepared, report
+
+
+def rescale_regions(regions, scale):
+    """Đưa bbox của kết quả OCR trên crop đã resize về tọa độ crop gốc"""
+    if scale == 1.0:
+        return regions
+    for region in regions:
+        region["bbox"] = [[int(round(x / scale)), int(round(y / scale))] for x, y in region["bbox"]]
+    return regions
+
+
+def offset_regions(regions, x, y):
+    """Thêm image_bbox: bbox của kết quả OCR trên crop dịch theo góc trên-trái (x, y) của crop trong ảnh"""
+    for region in regions:
+        region["image_bbox"] = [[px + x, py + y] for px, py in region["bbox"]]
+    return regions
+
+
+def shelf_pack(sizes, canvas_width, canvas_height, gap_x, gap_y):
+    """
+    Xếp các hình chữ nhật (h, w) vào ít canvas nhất có thể: shelf packing, first-fit theo chiều cao giảm dần
+    Mỗi shelf là 1 hàng cao bằng crop đầu tiên của nó; crop sau vào shelf đầu tiên còn đủ chỗ ngang,
+    không có thì mở shelf mới bên dưới, canvas hết chiều cao thì mở canvas mới.
+    gap_x/gap_y là khoảng trắng giữa các crop (và với mép canvas) để OCR không nối chữ của 2 crop
+
+    Returns:
+        tuple: (placements [(canvas_index, x, y)] theo thứ tự sizes, [(height, width)] của từng canvas)
+    """
+    placements = [None] * len(sizes)
+    canvases = []  # [{"shelves": [[y, height, x_cursor]], "bottom": y tiếp theo}]
+
+    for i in sorted(range(len(sizes)), key=lambda k: sizes[k][0], reverse=True):
+        h, w = sizes[i]
+        if w + 2 * gap_x > canvas_width or h + 2 * gap_y > canvas_height:
+            raise ValueError(f"Crop {w}x{h} does not fit in a {canvas_width}x{canvas_height} canvas")
+
+        placed = False
+        for canvas_index, canvas in enumerate(canvases):
+            for shelf in canvas["shelves"]:
+                y, shelf_height, x_cursor = shelf
+                if h <= shelf_height and x_cursor + w + gap_x <= canvas_width:
+                    placements[i] = (canvas_index, x_cursor, y)
+                    shelf[2] = x_cursor + w + gap_x
+                    placed = True
+                    break
+            if not placed and canvas["bottom"] + h + gap_y <= canvas_height:
+                canvas["shelves"].append([canvas["bottom"], h, gap_x + w + gap_x])
+                placements[i] = (canvas_index, gap_x, canvas["bottom"])
+                canvas["bottom"] += h + gap_y
+                placed = True
+            if placed:
+                break
+
+        if not placed:
+            canvases.append({"shelves": [[gap_y, h, gap_x + w + gap_x]], "bottom": gap_y + h + gap_y})
+            placements[i] = (len(canvases) - 1, gap_x, gap_y)
+
+    shapes = [(canvas["bottom"], max(shelf[2] for shelf in canvas["shelves"])) for canvas in canvases]
+    return placements, shapes
@@ -3,50 +3,237 @@ Object Detection Module - SSD MobileNet V2
 Phát hiện đối tượng trong ảnh và trả về tọa độ bounding boxes
 """
 
+import os
 import cv2
 import numpy as np
+import time
 from pathlib import Path
 import logging
 
+from src.utils.tracing import span
+from src.utils.instance_pool import InstancePool
+from src.utils.cpu import available_cpus
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow chỉ dùng để đọc header ảnh, thiếu thì decode full như cũ
+    Image = None
+
 logger = logging.getLogger(__name__)
 
+# Backend/target mặc định của OpenCV DNN (ghi đè theo từng lần load qua dnn_backend / dnn_target)
+DNN_BACKEND = os.environ.get("OCR_DNN_BACKEND", "default")
+DNN_TARGET = os.environ.get("OCR_DNN_TARGET", "cpu")
+# cv2.setNumThreads cho worker (0 = để OpenCV tự chọn)
+DNN_THREADS = int(os.environ.get("OCR_DNN_THREADS", "0"))
+# Số lần forward đo thời gian sau khi load (median được báo cáo trong forward_ms)
+FORWARD_PROBE_RUNS = int(os.environ.get("OCR_DNN_PROBE_RUNS", "3"))
+# Số bản cv2.dnn.Net của mỗi model (setInput + forward trên cùng 1 Net không thread-safe)
+# và thời gian tối đa 1 request chờ bản rảnh trước khi bị từ chối
+POOL_SIZE = int(os.environ.get("OCR_DETECTOR_POOL_SIZE", "1"))
+POOL_TIMEOUT = float(os.environ.get("OCR_DETECTOR_POOL_TIMEOUT", "30"))
+
+# Tên -> hằng số OpenCV (chỉ giữ những gì bản OpenCV đang cài có)
+DNN_BACKENDS = {
+    name: getattr(cv2.dnn, const)
+    for name, const in (
+        ("default", "DNN_BACKEND_DEFAULT"),
+        ("opencv", "DNN_BACKEND_OPENCV"),
+        ("inference_engine", "DNN_BACKEND_INFERENCE_ENGINE"),
+        ("cuda", "DNN_BACKEND_CUDA"),
+    )
+    if hasattr(cv2.dnn, const)
+}
+DNN_TARGETS = {
+    name: getattr(cv2.dnn, const)
+    for name, const in (
+        ("cpu", "DNN_TARGET_CPU"),
+        ("cpu_fp16", "DNN_TARGET_CPU_FP16"),
+        ("opencl", "DNN_TARGET_OPENCL"),
+        ("opencl_fp16", "DNN_TARGET_OPENCL_FP16"),
+        ("cuda", "DNN_TARGET_CUDA"),
+        ("cuda_fp16", "DNN_TARGET_CUDA_FP16"),
+    )
+    if hasattr(cv2.dnn, const)
+}
+PRECISIONS = ("fp32", "int8")
+
+# Các mức scale JPEG DCT mà OpenCV hỗ trợ khi decode (libjpeg scaling 1/2, 1/4, 1/8)
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def read_image_header(image_path):
+    """
+    Đọc kích thước + định dạng ảnh từ header (không decode pixel)
+    
+    Returns:
+        tuple: (width, height, format) hoặc None nếu không đọc được
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(str(image_path)) as img:
+            return img.width, img.height, img.format
+    except Exception:
+        return None
+
+
+def choose_reduced_scale(width, height, target_size):
+    """
+    Chọn mức giảm lớn nhất mà ảnh decode ra vẫn không nhỏ hơn input của model
+    
+    Returns:
+        tuple: (scale, imread_flag) - scale=1 nghĩa là decode full
+    """
+    target_w, target_h = target_size
+    for scale, flag in REDUCED_DECODE_FLAGS:
+        if width // scale >= target_w and height // scale >= target_h:
+            return scale, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def imread_for_input(image_path, target_size):
+    """
+    Decode ảnh ở độ phân giải vừa đủ cho input của model
+    JPEG được decode thẳng ở 1/2, 1/4, 1/8 (DCT scaling) thay vì decode full rồi resize
+    
+    Returns:
+        tuple: (image, full_width, full_height, scale)
+    """
+    header = read_image_header(image_path)
+    if header and header[2] == "JPEG":
+        width, height, _ = header
+        scale, flag = choose_reduced_scale(width, height, target_size)
+        image = cv2.imread(str(image_path), flag)
+        if image is not None:
+            # imread áp dụng EXIF orientation, header thì không: đổi w/h nếu ảnh bị xoay 90 độ
+            if (image.shape[1] > image.shape[0]) != (width > height) and width != height:
+                width, height = height, width
+            return image, width, height, scale
+
+    # Định dạng khác (PNG...) không có DCT scaling: decode full
+    image = cv2.imread(str(image_path))
+    if image is None:
+        return None, 0, 0, 1
+    h, w = image.shape[:2]
+    return image, w, h, 1
+
+
+def imread_for_max_side(image_path, max_side):
+    """
+    Decode ảnh vừa đủ để cạnh dài còn >= max_side (ảnh sẽ bị thu nhỏ về max_side sau đó)
+    JPEG lớn được decode thẳng ở 1/2, 1/4, 1/8; định dạng khác decode full
+
+    Returns:
+        tuple: (image, full_long_side) - cạnh dài của ảnh gốc để scale bbox về tọa độ gốc
+    """
+    header = read_image_header(image_path)
+    if max_side and header and header[2] == "JPEG":
+        long_side = max(header[0], header[1])
+        for scale, flag in REDUCED_DECODE_FLAGS:
+            if long_side // scale >= max_side:
+                image = cv2.imread(str(image_path), flag)
+                if image is not None:
+                    return image, long_side
+                break
+
+    image = cv2.imread(str(image_path))
+    return image, (max(image.shape[:2]) if image is not None else 0)
+
 
 class SSDMobileNetDetector:
     """
     SSD MobileNet V2 detector sử dụng OpenCV DNN
     """
     
-    def __init__(self, model_path=None, config_path=None, confidence_threshold=0.5, nms_threshold=0.4):
+    # SSD MobileNet V2 standard input
+    INPUT_SIZE = (300, 300)
+    
+    def __init__(self, model_path=None, config_path=None, confidence_threshold=0.5, nms_threshold=0.4,
+                 reduced_decode=True, backend=None, target=None, num_threads=None, precision="fp32",
+                 calibration_images=None, pool_size=None, pool_timeout=None):
         """
         Args:
             model_path: Đường dẫn đến file .pb hoặc .caffemodel
             config_path: Đường dẫn đến file config (.pbtxt hoặc .prototxt)
             confidence_threshold: Ngưỡng confidence để filter detections
             nms_threshold: Ngưỡng Non-Maximum Suppression để loại bỏ overlapping boxes
+            reduced_decode: Decode JPEG ở độ phân giải giảm (đủ cho input 300x300) thay vì full-size
+            backend: Tên trong DNN_BACKENDS (None = OCR_DNN_BACKEND)
+            target: Tên trong DNN_TARGETS, vd "cpu_fp16", "opencl" (None = OCR_DNN_TARGET)
+            num_threads: cv2.setNumThreads khi load (None = OCR_DNN_THREADS, 0 = mặc định của OpenCV)
+            precision: "fp32" hoặc "int8" (quantize network bằng Net.quantize sau khi đọc weights)
+            calibration_images: Ảnh mẫu để calibrate khi precision="int8"
+            pool_size: Số bản network để các request forward song song (None = OCR_DETECTOR_POOL_SIZE)
+            pool_timeout: Số giây chờ bản rảnh tối đa (None = OCR_DETECTOR_POOL_TIMEOUT)
         """
         self.model_path = model_path
         self.config_path = config_path
         self.confidence_threshold = confidence_threshold
         self.nms_threshold = nms_threshold
+        self.reduced_decode = reduced_decode
+        self.backend = backend or DNN_BACKEND
+        self.target = target or DNN_TARGET
+        self.precision = precision
+        self.calibration_images = list(calibration_images or [])
+        self.pool_size = max(int(POOL_SIZE if pool_size is None else pool_size), 1)
+        self.pool_timeout = float(POOL_TIMEOUT if pool_timeout is None else pool_timeout)
+        self.num_threads = DNN_THREADS if num_threads is None else int(num_threads)
+        if self.num_threads == 0 and self.pool_size > 1:
+            # N forward chạy cùng lúc trên thread pool chung của OpenCV: chia core để không oversubscribe
+            self.num_threads = max(available_cpus() // self.pool_size, 1)
+        if self.backend not in DNN_BACKENDS:
+            raise ValueError(f"Unsupported DNN backend: {self.backend} (available: {', '.join(DNN_BACKENDS)})")
+        if self.target not in DNN_TARGETS:
+            raise ValueError(f"Unsupported DNN target: {self.target} (available: {', '.join(DNN_TARGETS)})")
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision: {self.precision}")
+        if self.precision == "int8" and not self.calibration_images:
+            raise ValueError("precision=int8 requires calibration_images")
         self.net = None
+        self.pool = None
+        self.load_kind = None  # "cold" (đọc từ disk) hoặc "cached" (từ artifact cache)
+        self.forward_ms = None  # Median thời gian forward đo ngay sau khi load
+        self.dnn_fallback = None  # Lý do quay về opencv/cpu nếu backend/target yêu cầu không chạy được
+        
+    def load_model(self, artifact_cache=None):
+        """
+        Load model vào RAM
         
-    def load_model(self):
-        """Load model vào RAM"""
+        Args:
+            artifact_cache: ModelArtifactCache (optional) - weights được mmap 1 lần cho cả process,
+                các lần load sau build network từ buffer thay vì đọc lại file
+        """
+        self.load_kind = "cold"
         try:
             if self.model_path and self.config_path:
                 logger.info(f"Loading SSD MobileNet V2 from {self.model_path}")
                 
-                # Detect model type
-                if self.model_path.endswith('.pb'):
-                    # TensorFlow model
-                    self.net = cv2.dnn.readNetFromTensorflow(self.model_path, self.config_path)
-                elif self.model_path.endswith('.caffemodel'):
-                    # Caffe model
-                    self.net = cv2.dnn.readNetFromCaffe(self.config_path, self.model_path)
-                else:
+                if not self.model_path.endswith(('.pb', '.caffemodel')):
                     raise ValueError(f"Unsupported model format: {self.model_path}")
                 
-                logger.info("SSD MobileNet V2 loaded successfully")
+                if artifact_cache is not None:
+                    misses = artifact_cache.misses
+                    self.net = self._read_net(artifact_cache)
+                    if artifact_cache.misses == misses:
+                        self.load_kind = "cached"
+                else:
+                    self.net = self._read_net()
+                
+                if self.precision == "int8":
+                    self.net = self._quantize(self.net)
+                self._apply_dnn_preferences()
+                self.pool = InstancePool(
+                    [self.net] + [self._replicate_net(artifact_cache) for _ in range(self.pool_size - 1)],
+                    timeout=self.pool_timeout,
+                    name=Path(self.model_path).stem
+                )
+                
+                logger.info(f"SSD MobileNet V2 loaded successfully ({self.load_kind}, {self.inference_settings()})")
             else:
                 # Sử dụng pretrained model từ OpenCV (nếu có)
                 logger.warning("No model path provided. Using default OpenCV model if available.")
@@ -56,12 +243,116 @@ class SSDMobileNetDetector:
             logger.error(f"Failed to load SSD model: {str(e)}")
             raise
     
+    def _read_net(self, artifact_cache=None):
+        """Build 1 cv2.dnn.Net từ weights (buffer trong artifact_cache nếu có, không thì đọc file)"""
+        if artifact_cache is not None:
+            model_buffer = artifact_cache.get_buffer(self.model_path)
+            config_buffer = artifact_cache.get_buffer(self.config_path)
+            if self.model_path.endswith('.pb'):
+                return cv2.dnn.readNetFromTensorflow(model_buffer, config_buffer)
+            return cv2.dnn.readNetFromCaffe(config_buffer, model_buffer)
+        if self.model_path.endswith('.pb'):
+            # TensorFlow model
+            return cv2.dnn.readNetFromTensorflow(self.model_path, self.config_path)
+        # Caffe model
+        return cv2.dnn.readNetFromCaffe(self.config_path, self.model_path)
+    
+    def _replicate_net(self, artifact_cache=None):
+        """
+        Thêm 1 bản network cho pool: cùng weights, precision và backend/target đã chọn được ở bản đầu
+        (không probe lại; weights đọc từ artifact_cache nên không tốn thêm lần đọc disk)
+        """
+        net = self._read_net(artifact_cache)
+        if self.precision == "int8":
+            net = self._quantize(net)
+        net.setPreferableBackend(DNN_BACKENDS[self.backend])
+        net.setPreferableTarget(DNN_TARGETS[self.target])
+        return net
+    
+    def _make_blob(self, image):
+        """Ảnh BGR -> blob input của SSD (resize về INPUT_SIZE, chuẩn hóa về [-1, 1])"""
+        return cv2.dnn.blobFromImage(
+            image,
+            size=self.INPUT_SIZE,
+            mean=(127.5, 127.5, 127.5),
+            scalefactor=1.0/127.5,
+            swapRB=True,
+            crop=False
+        )
+    
+    def _quantize(self, net):
+        """
+        Int8 bằng Net.quantize (OpenCV >= 4.5.4): calibrate range activation trên calibration_images
+        Input/output giữ float32 nên phần parse detections không đổi
+        """
+        if not hasattr(net, "quantize"):
+            raise RuntimeError(f"OpenCV {cv2.__version__} does not support Net.quantize")
+        
+        calibration = []
+        for path in self.calibration_images:
+            image, _, _, _ = imread_for_input(path, self.INPUT_SIZE)
+            if image is None:
+                raise ValueError(f"Cannot read calibration image: {path}")
+            calibration.append(self._make_blob(image))
+        
+        logger.info(f"SSD quantized to int8 with {len(calibration)} calibration images")
+        return net.quantize(calibration, cv2.CV_32F, cv2.CV_32F)
+    
+    def _apply_dnn_preferences(self):
+        """
+        Đặt số thread + backend/target rồi forward thử trên ảnh giả
+        OpenCV chỉ báo backend/target không dùng được ở lần forward đầu: khi đó quay về opencv/cpu
+        và ghi lý do vào dnn_fallback. forward_ms = median của FORWARD_PROBE_RUNS lần forward sau đó
+        """
+        if self.num_threads > 0:
+            # Cấu hình của cả process (mọi network trong worker dùng chung thread pool của OpenCV)
+            cv2.setNumThreads(self.num_threads)
+        
+        blob = self._make_blob(np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8))
+        self.net.setPreferableBackend(DNN_BACKENDS[self.backend])
+        self.net.setPreferableTarget(DNN_TARGETS[self.target])
+        try:
+            self.net.setInput(blob)
+            self.net.forward()
+        except cv2.error as e:
+            self.dnn_fallback = f"{self.backend}/{self.target}: {str(e).strip().splitlines()[-1]}"
+            logger.warning(f"DNN backend/target not usable, falling back to opencv/cpu ({self.dnn_fallback})")
+            self.backend, self.target = "opencv", "cpu"
+            self.net.setPreferableBackend(DNN_BACKENDS["opencv"])
+            self.net.setPreferableTarget(DNN_TARGETS["cpu"])
+            self.net.setInput(blob)
+            self.net.forward()
+        
+        timings = []
+        for _ in range(max(FORWARD_PROBE_RUNS, 1)):
+            start = time.perf_counter()
+            self.net.setInput(blob)
+            self.net.forward()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.forward_ms = round(float(np.median(timings)), 2)
+    
+    def inference_settings(self):
+        """Cấu hình DNN thực tế + thời gian forward đo khi load (báo cáo trong response /load_model)"""
+        return {
+            "backend": self.backend,
+            "target": self.target,
+            "precision": self.precision,
+            "num_threads": cv2.getNumThreads(),
+            "pool_size": self.pool_size,
+            "forward_ms": self.forward_ms,
+            "fallback": self.dnn_fallback
+        }
+    
+    def pool_stats(self):
+        """Số liệu sử dụng pool network (None khi chưa load)"""
+        return self.pool.stats() if self.pool is not None else None
+    
     def detect(self, image_path):
         """
         Phát hiện đối tượng trong ảnh
         
         Args:
-            image_path: Đường dẫn đến ảnh input
+            image_path: Đường dẫn đến ảnh input hoặc numpy array BGR
             
         Returns:
             dict: {
@@ -76,30 +367,38 @@ class SSDMobileNetDetector:
                 "image_shape": [height, width, channels]
             }
         """
-        if self.net is None:
-            raise RuntimeError("Model not loaded. Call load_model() first.")
+        # Giữ reference cục bộ: unload_model ở thread khác có thể gán self.pool = None giữa chừng,
+        # các network đang được mượn vẫn sống tới khi request này trả lại
+        pool = self.pool
+        if pool is None:
+            raise RuntimeError("Model not loaded or unloaded. Call load_model() first.")
         
         try:
-            # Đọc ảnh
-            image = cv2.imread(str(image_path))
-            if image is None:
-                raise ValueError(f"Cannot read image: {image_path}")
-            
-            h, w = image.shape[:2]
+            # Đọc ảnh - h, w luôn là kích thước gốc dù decode ở độ phân giải giảm
+            with span("decode") as decode_span:
+                if isinstance(image_path, np.ndarray):
+                    # Trang đã decode sẵn (tài liệu nhiều trang)
+                    image, scale = image_path, 1
+                    h, w = image.shape[:2]
+                    image_path = "<array>"
+                elif self.reduced_decode:
+                    image, w, h, scale = imread_for_input(image_path, self.INPUT_SIZE)
+                else:
+                    image, scale = cv2.imread(str(image_path)), 1
+                    if image is not None:
+                        h, w = image.shape[:2]
+                if image is None:
+                    raise ValueError(f"Cannot read image: {image_path}")
+                decode_span.set(width=w, height=h, decode_scale=scale)
             
             # Tạo blob từ ảnh
-            blob = cv2.dnn.blobFromImage(
-                image, 
-                size=(300, 300),  # SSD MobileNet V2 standard input
-                mean=(127.5, 127.5, 127.5),
-                scalefactor=1.0/127.5,
-                swapRB=True,
-                crop=False
-            )
+            with span("blob"):
+                blob = self._make_blob(image)
             
-            # Forward pass
-            self.net.setInput(blob)
-            detections = self.net.forward()
+            # Forward pass trên 1 bản network mượn từ pool (chờ tối đa pool_timeout, hết thì PoolExhausted)
+            with pool.checkout() as net, span("forward"):
+                net.setInput(blob)
+                detections = net.forward()
             
             # Parse detections
             boxes = []
@@ -107,7 +406,7 @@ class SSDMobileNetDetector:
                 confidence = detections[0, 0, i, 2]
                 
                 if confidence > self.confidence_threshold:
-                    # Get bounding box coordinates
+                    # Tọa độ SSD là tỉ lệ [0, 1] nên nhân với kích thước gốc là ra box full-resolution
                     box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
                     x1, y1, x2, y2 = box.astype(int)
                     
@@ -121,21 +420,50 @@ class SSDMobileNetDetector:
                         "bbox": [int(x1), int(y1), int(x2), int(y2)]
                     })
             
-            logger.info(f"Detected {len(boxes)} objects in {image_path}")
+            logger.info(f"Detected {len(boxes)} objects in {image_path} (decode scale 1/{scale})")
             
             return {
                 "boxes": boxes,
                 "image_shape": [h, w, 3],
-                "num_detections": len(boxes)
+                "num_detections": len(boxes),
+                "decode_scale": scale
             }
             
         except Exception as e:
             logger.error(f"Detection failed: {str(e)}")
             raise
     
-    def unload_model(self):
-        """Giải phóng model khỏi RAM"""
+    def warmup(self, runs=1):
+        """
+        Chạy forward trên ảnh giả sau khi load để trả trước chi phí lần đầu
+        (khởi tạo graph, cấp phát bộ nhớ, chọn kernel)
+        
+        Returns:
+            float: Thời gian warm-up (ms)
+        """
+        if self.net is None:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        image = np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype=np.uint8)
+        
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.detect(image)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"SSD warm-up: {runs} runs in {elapsed_ms}ms")
+        return elapsed_ms
+    
+    def unload_model(self, artifact_cache=None, keep_cached=True):
+        """
+        Giải phóng model khỏi RAM
+        keep_cached=False thì bỏ luôn weights khỏi artifact_cache (lần load sau đọc lại từ disk)
+        """
         self.net = None
+        self.pool = None
+        self.forward_ms = None
+        if artifact_cache is not None and not keep_cached:
+            artifact_cache.evict_buffer(self.model_path)
+            artifact_cache.evict_buffer(self.config_path)
         logger.info("SSD MobileNet V2 unloaded from memory")
 
 
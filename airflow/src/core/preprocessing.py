@@ -0,0 +1,258 @@
+"""
+Document Preprocessing Module
+Làm sạch ảnh scan trước khi OCR: grayscale, khử nhiễu, nhị phân hóa, chỉnh nghiêng, cắt viền
+"""
+
+import cv2
+import numpy as np
+import os
+import time
+import hashlib
+import threading
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STEPS = ("grayscale", "denoise", "binarize", "deskew", "crop_border")
+
+
+class DocumentPreprocessor:
+    """
+    Pipeline tiền xử lý tài liệu bằng OpenCV/NumPy (không cần weights)
+    Các bước ghi đè vào buffer cấp phát sẵn (dst=...) để không tạo mảng mới cho mỗi ảnh
+    """
+
+    def __init__(self, steps=DEFAULT_STEPS, output_dir="/data/preprocessed", denoise_ksize=3,
+                 block_size=31, threshold_c=15, max_skew_angle=5.0, skew_step=0.5,
+                 deskew_max_side=1000, border_margin=10, border_density=0.6):
+        """
+        Args:
+            steps: Các bước cần chạy (theo thứ tự của DEFAULT_STEPS)
+            output_dir: Thư mục ghi ảnh đã xử lý
+            denoise_ksize: Kích thước kernel median blur (số lẻ)
+            block_size: Kích thước vùng lân cận cho adaptive threshold (số lẻ)
+            threshold_c: Hằng số trừ đi trong adaptive threshold
+            max_skew_angle: Góc nghiêng tối đa cần dò (độ)
+            skew_step: Bước dò góc (độ)
+            deskew_max_side: Ảnh được thu nhỏ về cạnh này khi dò góc (chỉ để tính profile)
+            border_margin: Lề giữ lại quanh vùng nội dung khi cắt viền (pixel)
+            border_density: Hàng/cột ở mép có tỉ lệ pixel đen lớn hơn mức này coi là viền scan
+        """
+        unknown = set(steps) - set(DEFAULT_STEPS)
+        if unknown:
+            raise ValueError(f"Unknown preprocessing steps: {sorted(unknown)}")
+
+        self.steps = [step for step in DEFAULT_STEPS if step in steps]
+        self.output_dir = output_dir
+        self.denoise_ksize = int(denoise_ksize)
+        self.block_size = int(block_size)
+        self.threshold_c = threshold_c
+        self.max_skew_angle = max_skew_angle
+        self.skew_step = skew_step
+        self.deskew_max_side = deskew_max_side
+        self.border_margin = border_margin
+        self.border_density = border_density
+        # Mọi tham số ảnh hưởng tới ảnh output: 2 cấu hình khác nhau không ghi đè file của nhau
+        self.config_key = hashlib.sha256(repr((
+            self.steps, self.denoise_ksize, self.block_size, self.threshold_c, self.max_skew_angle,
+            self.skew_step, self.deskew_max_side, self.border_margin, self.border_density
+        )).encode()).hexdigest()[:12]
+
+        self._angles = None
+        self._local = threading.local()  # Buffers riêng cho mỗi thread (Flask chạy threaded)
+        self.loaded = False
+
+    def load_model(self):
+        """Không có weights: chỉ chuẩn bị bảng góc dò nghiêng và thư mục output"""
+        num = int(round(2 * self.max_skew_angle / self.skew_step)) + 1
+        self._angles = np.linspace(-self.max_skew_angle, self.max_skew_angle, num)
+        Path(self.output_dir).mkdir(parents=True, exist_ok=True)
+        self.loaded = True
+        logger.info(f"DocumentPreprocessor ready: steps={self.steps}")
+
+    def _buffers(self, shape):
+        """2 buffer uint8 cùng kích thước ảnh, chỉ cấp phát lại khi kích thước đổi"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers[0].shape != shape:
+            buffers = (np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.uint8))
+            self._local.buffers = buffers
+        return buffers
+
+    def _estimate_skew(self, binary):
+        """
+        Dò góc nghiêng bằng projection profile: góc đúng cho profile theo hàng "nhọn" nhất
+        Tính trên tọa độ pixel chữ (đã thu nhỏ), mỗi góc chỉ là 1 phép bincount
+        """
+        h, w = binary.shape
+        scale = min(1.0, self.deskew_max_side / max(h, w))
+        small = binary if scale == 1.0 else cv2.resize(
+            binary, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA
+        )
+        ys, xs = np.nonzero(small < 128)  # Pixel chữ (đen)
+        if len(ys) < 100:
+            return 0.0
+
+        xs = xs.astype(np.float32) - small.shape[1] / 2
+        ys = ys.astype(np.float32)
+        radians = np.deg2rad(self._angles).astype(np.float32)
+        offset = small.shape[1] + 1
+
+        best_angle, best_score = 0.0, -1.0
+        for angle, rad in zip(self._angles, radians):
+            rows = (ys * np.cos(rad) + xs * np.sin(rad)).astype(np.int32) + offset
+            profile = np.bincount(rows).astype(np.float64)
+            score = float(np.dot(np.diff(profile), np.diff(profile)))
+            if score > best_score:
+                best_angle, best_score = float(angle), score
+        return best_angle
+
+    def _crop_box(self, binary):
+        """Bounding box nội dung sau khi bỏ viền đen của máy scan ở các mép"""
+        h, w = binary.shape
+        # Tỉ lệ pixel đen theo hàng/cột (cv2.reduce nhanh hơn np.mean trên uint8)
+        row_dark = 1.0 - cv2.reduce(binary, 1, cv2.REDUCE_AVG, dtype=cv2.CV_32F).ravel() / 255
+        col_dark = 1.0 - cv2.reduce(binary, 0, cv2.REDUCE_AVG, dtype=cv2.CV_32F).ravel() / 255
+
+        def trim(density):
+            # Bỏ các hàng/cột "gần như đen" liền nhau ở 2 mép
+            border = density > self.border_density
+            start = int(np.argmin(border)) if border[0] else 0
+            end = len(density) - (int(np.argmin(border[::-1])) if border[-1] else 0)
+            return start, max(end, start + 1)
+
+        y1, y2 = trim(row_dark)
+        x1, x2 = trim(col_dark)
+
+        content = binary[y1:y2, x1:x2]
+        inverted = cv2.bitwise_not(content)
+        bx, by, bw, bh = cv2.boundingRect(inverted)
+        if bw == 0 or bh == 0:
+            return [x1, y1, x2, y2]
+
+        m = self.border_margin
+        return [
+            max(x1 + bx - m, 0), max(y1 + by - m, 0),
+            min(x1 + bx + bw + m, w), min(y1 + by + bh + m, h)
+        ]
+
+    def process(self, image_path, output_name=None):
+        """
+        Chạy pipeline trên 1 ảnh và ghi ảnh kết quả ra output_dir
+
+        Args:
+            image_path: Đường dẫn ảnh hoặc numpy array BGR (trang của tài liệu nhiều trang)
+            output_name: Tiền tố tên file output (thêm hash cấu hình phía sau), mặc định hash theo đường dẫn + cấu hình
+
+        Returns:
+            dict: {
+                "output_path": "/data/preprocessed/<hash>.png",
+                "image_shape": [h, w],          # Kích thước ảnh output
+                "original_shape": [h, w],
+                "skew_angle": 1.5,
+                "crop_box": [x1, y1, x2, y2],   # Theo tọa độ ảnh sau deskew
+                "timings_ms": {"grayscale": 12.3, ...},
+                "steps": [...]
+            }
+        """
+        if not self.loaded:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+
+        timings = {}
+
+        def timed(name, start):
+            timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+        # Decode thẳng sang grayscale (không decode 3 kênh rồi mới chuyển)
+        start = time.perf_counter()
+        if isinstance(image_path, np.ndarray):
+            image = image_path
+            if "grayscale" in self.steps and image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            image_path = output_name or "<array>"
+            timed("grayscale", start)
+        else:
+            flag = cv2.IMREAD_GRAYSCALE if "grayscale" in self.steps else cv2.IMREAD_COLOR
+            image = cv2.imread(str(image_path), flag)
+            if image is None:
+                raise ValueError(f"Cannot read image: {image_path}")
+            timed("decode" if flag == cv2.IMREAD_COLOR else "grayscale", start)
+
+        original_shape = list(image.shape[:2])
+        skew_angle = 0.0
+        crop_box = None
+
+        if image.ndim == 2:
+            current, spare = self._buffers(image.shape)
+            np.copyto(current, image)
+
+            if "denoise" in self.steps:
+                start = time.perf_counter()
+                cv2.medianBlur(current, self.denoise_ksize, dst=spare)
+                current, spare = spare, current
+                timed("denoise", start)
+
+            if "binarize" in self.steps:
+                start = time.perf_counter()
+                cv2.adaptiveThreshold(
+                    current, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                    self.block_size, self.threshold_c, dst=spare
+                )
+                current, spare = spare, current
+                timed("binarize", start)
+
+            if "deskew" in self.steps:
+                start = time.perf_counter()
+                skew_angle = self._estimate_skew(current)
+                if abs(skew_angle) >= self.skew_step / 2:
+                    h, w = current.shape
+                    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), -skew_angle, 1.0)
+                    cv2.warpAffine(
+                        current, matrix, (w, h), dst=spare, flags=cv2.INTER_LINEAR,
+                        borderMode=cv2.BORDER_CONSTANT, borderValue=255
+                    )
+                    current, spare = spare, current
+                timed("deskew", start)
+
+            if "crop_border" in self.steps:
+                start = time.perf_counter()
+                x1, y1, x2, y2 = crop_box = self._crop_box(current)
+                current = current[y1:y2, x1:x2]
+                timed("crop_border", start)
+
+            result_image = current
+        else:
+            # Không chuyển grayscale thì các bước còn lại không áp dụng được
+            result_image = image
+
+        # Tên file theo đường dẫn ảnh + cấu hình -> chạy lại cùng ảnh + cấu hình ghi đè đúng 1 file
+        start = time.perf_counter()
+        if output_name:
+            key = f"{output_name}_{self.config_key}"
+        else:
+            key = hashlib.sha256(f"{image_path}|{self.config_key}".encode()).hexdigest()[:24]
+        output_path = os.path.join(self.output_dir, f"{key}.png")
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp.png"
+        if not cv2.imwrite(tmp_path, result_image):
+            raise IOError(f"Cannot write preprocessed image: {output_path}")
+        os.replace(tmp_path, output_path)
+        timed("write", start)
+
+        timings["total"] = round(sum(timings.values()), 2)
+        logger.info(f"Preprocessed {image_path} -> {output_path} in {timings['total']}ms")
+
+        return {
+            "output_path": output_path,
+            "image_shape": list(result_image.shape[:2]),
+            "original_shape": original_shape,
+            "skew_angle": skew_angle,
+            "crop_box": crop_box,
+            "timings_ms": timings,
+            "steps": self.steps
+        }
+
+    def unload_model(self):
+        """Giải phóng buffers"""
+        self._local = threading.local()
+        self.loaded = False
+        logger.info("DocumentPreprocessor unloaded")
@@ -3,46 +3,175 @@ OCR Recognition Module - EasyOCR
 Nhận diện text trong ảnh (hoặc các vùng đã detect)
 """
 
-import easyocr
+import os
+import sys
 import numpy as np
 import cv2
+import time
+from contextlib import nullcontext
 from pathlib import Path
 import logging
 
+from src.core.crops import shelf_pack
+from src.core.detection import imread_for_max_side
+from src.utils.tracing import span
+from src.utils.cpu import available_cpus
+
 logger = logging.getLogger(__name__)
 
+# Chế độ tối ưu CPU mặc định (int8 + inference_mode + số thread cố định), bật riêng qua load_config
+CPU_OPTIMIZED = os.environ.get("OCR_CPU_OPTIMIZED", "0") == "1"
+# Số thread intra-op / inter-op của torch (0 = để torch tự chọn)
+TORCH_THREADS = int(os.environ.get("OCR_TORCH_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.environ.get("OCR_TORCH_INTEROP_THREADS", "0"))
+
+# Profile tốc độ/độ chính xác cho readtext:
+#   readtext: tham số truyền thẳng cho easyocr (canvas, magnification, decoder, cỡ chữ tối thiểu, batch)
+#   max_side: thu nhỏ ảnh để cạnh dài <= max_side trước khi OCR (bbox được scale lại về ảnh gốc), None = giữ nguyên
+# paragraph luôn tắt: kết quả cần confidence của từng dòng
+RECOGNITION_PROFILES = {
+    "fast": {
+        "readtext": {"canvas_size": 1280, "mag_ratio": 1.0, "decoder": "greedy", "min_size": 20, "batch_size": 8},
+        "max_side": 1600
+    },
+    "balanced": {
+        "readtext": {"canvas_size": 2048, "mag_ratio": 1.0, "decoder": "greedy", "min_size": 10, "batch_size": 4},
+        "max_side": 2560
+    },
+    "accurate": {
+        "readtext": {"canvas_size": 3200, "mag_ratio": 1.5, "decoder": "beamsearch", "beamWidth": 10, "min_size": 5},
+        "max_side": None
+    },
+}
+# Kích thước tối đa của canvas mosaic khi xếp nhiều crop nhỏ vào 1 lần readtext (recognize_packed)
+PACK_CANVAS_SIZE = int(os.environ.get("OCR_PACK_CANVAS_SIZE", "1280"))
+
+# Profile khi request không chỉ định (rỗng = tham số mặc định của easyocr, không thu nhỏ ảnh)
+DEFAULT_PROFILE = os.environ.get("OCR_RECOGNITION_PROFILE", "") or None
+
 
 class EasyOCRRecognizer:
     """
     EasyOCR wrapper cho nhận diện text tiếng Việt và tiếng Anh
     """
     
-    def __init__(self, languages=['vi', 'en'], gpu=False):
+    # Chiều cao dòng chữ mà model recognition của EasyOCR xử lý (imgH): crop 1 dòng được resize về mức này
+    TEXT_HEIGHT = 64
+    
+    def __init__(self, languages=['vi', 'en'], gpu=False, quantize=True, cpu_optimized=None,
+                 num_threads=None, interop_threads=None):
         """
         Args:
             languages: List các ngôn ngữ cần nhận diện
             gpu: Sử dụng GPU hay không
+            quantize: Dynamic int8 quantization các lớp Linear/LSTM khi chạy CPU
+                (mặc định của easyocr.Reader; False = fp32, dùng làm mốc so sánh độ chính xác)
+            cpu_optimized: Chế độ tối ưu CPU: bắt buộc int8, chạy trong torch.inference_mode,
+                số thread intra-op mặc định = số CPU của container (None = theo OCR_CPU_OPTIMIZED)
+            num_threads: torch.set_num_threads (None = OCR_TORCH_THREADS, 0 = mặc định của torch)
+            interop_threads: torch.set_num_interop_threads (None = OCR_TORCH_INTEROP_THREADS)
         """
         self.languages = languages
         self.gpu = gpu
+        self.cpu_optimized = CPU_OPTIMIZED if cpu_optimized is None else bool(cpu_optimized)
+        # Quantization của easyocr chỉ áp dụng trên CPU
+        self.quantize = not gpu and (bool(quantize) or self.cpu_optimized)
+        self.num_threads = TORCH_THREADS if num_threads is None else int(num_threads)
+        if self.cpu_optimized and not self.num_threads:
+            self.num_threads = available_cpus()
+        self.interop_threads = TORCH_INTEROP_THREADS if interop_threads is None else int(interop_threads)
         self.reader = None
+        self.load_kind = None  # "cold" (build Reader từ disk) hoặc "cached" (Reader đã park)
+    
+    @property
+    def cache_key(self):
+        """Key của Reader trong artifact cache (Reader phụ thuộc languages + gpu + quantize)"""
+        return ("easyocr", tuple(self.languages), bool(self.gpu), self.quantize)
+    
+    def _apply_torch_threads(self):
+        """
+        Đặt số thread của torch (toàn process) trước khi build/dùng Reader
+        Inter-op chỉ đặt được 1 lần và trước khi torch chạy song song lần đầu: đặt muộn thì bỏ qua + cảnh báo
+        """
+        import torch
         
-    def load_model(self):
-        """Load EasyOCR model vào RAM"""
+        if self.num_threads > 0 and torch.get_num_threads() != self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.interop_threads > 0 and torch.get_num_interop_threads() != self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                logger.warning(f"Cannot set torch interop threads to {self.interop_threads}: {str(e)}")
+    
+    def _inference_context(self):
+        """torch.inference_mode ở chế độ tối ưu CPU (bỏ version counter/autograd bookkeeping), còn lại no-op"""
+        torch = sys.modules.get("torch")
+        if self.cpu_optimized and torch is not None:
+            return torch.inference_mode()
+        return nullcontext()
+    
+    def inference_settings(self):
+        """Cấu hình inference thực tế (báo cáo trong response /load_model)"""
+        torch = sys.modules.get("torch")
+        return {
+            "device": "cuda" if self.gpu else "cpu",
+            "precision": "int8_dynamic" if self.quantize else "fp32",
+            "cpu_optimized": self.cpu_optimized,
+            "inference_mode": self.cpu_optimized,
+            "torch_threads": torch.get_num_threads() if torch is not None else None,
+            "torch_interop_threads": torch.get_num_interop_threads() if torch is not None else None
+        }
+        
+    def load_model(self, artifact_cache=None):
+        """
+        Load EasyOCR model vào RAM
+        
+        Args:
+            artifact_cache: ModelArtifactCache (optional) - dùng lại Reader đã park khi unload trước đó
+        """
         try:
-            logger.info(f"Loading EasyOCR for languages: {self.languages}")
+            self._apply_torch_threads()
+            
+            if artifact_cache is not None:
+                self.reader = artifact_cache.take(self.cache_key)
+                if self.reader is not None:
+                    self.load_kind = "cached"
+                    logger.info(f"EasyOCR reused from cache for languages: {self.languages}")
+                    return
+            
+            # Import lazy: torch + easyocr mất vài giây, chỉ trả khi thật sự build Reader
+            import easyocr
+            
+            logger.info(f"Loading EasyOCR for languages: {self.languages} (quantize={self.quantize})")
             self.reader = easyocr.Reader(
                 self.languages,
                 gpu=self.gpu,
+                quantize=self.quantize,
                 verbose=False
             )
+            self.load_kind = "cold"
             logger.info("EasyOCR loaded successfully")
             
         except Exception as e:
             logger.error(f"Failed to load EasyOCR: {str(e)}")
             raise
     
-    def recognize(self, image_input, detail=1):
+    @staticmethod
+    def resolve_profile(profile=None):
+        """
+        Tên profile -> (tên, cấu hình); None thì dùng DEFAULT_PROFILE
+        
+        Raises:
+            ValueError: profile không tồn tại
+        """
+        profile = profile or DEFAULT_PROFILE
+        if profile is None:
+            return None, {"readtext": {}, "max_side": None}
+        if profile not in RECOGNITION_PROFILES:
+            raise ValueError(f"Unknown recognition profile: {profile} (available: {', '.join(RECOGNITION_PROFILES)})")
+        return profile, RECOGNITION_PROFILES[profile]
+    
+    def recognize(self, image_input, detail=1, profile=None):
         """
         Nhận diện text trong ảnh
         
@@ -51,6 +180,7 @@ class EasyOCRRecognizer:
             detail: 
                 - 1: Trả về [bbox, text, confidence]
                 - 0: Chỉ trả về text
+            profile: "fast" | "balanced" | "accurate" (None = DEFAULT_PROFILE)
                 
         Returns:
             dict: {
@@ -68,18 +198,36 @@ class EasyOCRRecognizer:
         if self.reader is None:
             raise RuntimeError("Model not loaded. Call load_model() first.")
         
+        profile, settings = self.resolve_profile(profile)
+        
         try:
-            # Đọc ảnh nếu là đường dẫn
+            max_side = settings["max_side"]
+            # Đọc ảnh nếu là đường dẫn: profile có max_side thì JPEG lớn decode thẳng ở độ phân giải giảm
             if isinstance(image_input, (str, Path)):
-                image = cv2.imread(str(image_input))
+                with span("decode") as decode_span:
+                    image, full_side = imread_for_max_side(image_input, max_side)
+                    if image is not None:
+                        decode_span.set(decode_scale=round(full_side / max(image.shape[:2]), 2))
                 if image is None:
                     raise ValueError(f"Cannot read image: {image_input}")
             else:
                 # Đã là numpy array
                 image = image_input
+                full_side = max(image.shape[:2])
+            
+            # Thu nhỏ ảnh lớn theo profile
+            if max_side and max(image.shape[:2]) > max_side:
+                resize = max(image.shape[:2]) / max_side
+                image = cv2.resize(
+                    image, (round(image.shape[1] / resize), round(image.shape[0] / resize)), interpolation=cv2.INTER_AREA
+                )
+            # Tọa độ bbox nhân lại với scale (tính trên ảnh gốc, gồm cả phần giảm lúc decode)
+            scale = full_side / max(image.shape[:2])
             
             # Nhận diện text
-            results = self.reader.readtext(image, detail=detail)
+            with span("ocr", height=int(image.shape[0]), width=int(image.shape[1]), profile=profile), \
+                    self._inference_context():
+                results = self.reader.readtext(image, detail=detail, **settings["readtext"])
             
             if detail == 0:
                 # Chỉ có text
@@ -93,6 +241,8 @@ class EasyOCRRecognizer:
                 full_text_parts = []
                 
                 for bbox, text, confidence in results:
+                    if scale != 1.0:
+                        bbox = [[int(round(x * scale)), int(round(y * scale))] for x, y in bbox]
                     regions.append({
                         "bbox": bbox,
                         "text": text,
@@ -114,13 +264,131 @@ class EasyOCRRecognizer:
             logger.error(f"Recognition failed: {str(e)}")
             raise
     
-    def recognize_batch(self, image_list, detail=1):
+    def recognize_packed(self, crops, profile=None, canvas_size=None):
+        """
+        Nhận diện nhiều crop nhỏ bằng ít lần readtext: xếp crop vào các canvas mosaic (shelf packing,
+        khoảng trắng giữa các crop), OCR từng canvas rồi trả mỗi kết quả về crop chứa tâm bbox của nó
+        Crop không xếp được (cao hơn 2 dòng chữ hoặc rộng hơn canvas) được OCR riêng như recognize()
+        
+        Args:
+            crops: List numpy arrays (BGR hoặc xám)
+            profile: Profile tốc độ/độ chính xác
+            canvas_size: Cạnh tối đa của canvas (None = OCR_PACK_CANVAS_SIZE)
+            
+        Returns:
+            tuple: (
+                [{"text", "regions", "num_regions"}] cùng thứ tự với crops, bbox theo tọa độ của crop,
+                {"num_packed", "num_canvases", "num_single", "num_unassigned"}
+            )
+        """
+        if self.reader is None:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        canvas_size = canvas_size or PACK_CANVAS_SIZE
+        # Khoảng cách ngang >= 1 chiều cao chữ để EasyOCR không gộp chữ của 2 crop cạnh nhau thành 1 dòng
+        gap_x, gap_y = self.TEXT_HEIGHT, self.TEXT_HEIGHT // 4
+        crops = [cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR) if crop.ndim == 2 else crop for crop in crops]
+        
+        packable = [
+            i for i, crop in enumerate(crops)
+            if crop.shape[0] <= 2 * self.TEXT_HEIGHT and crop.shape[1] + 2 * gap_x <= canvas_size
+        ]
+        packable_set = set(packable)
+        results = [None] * len(crops)
+        for i, crop in enumerate(crops):
+            if i not in packable_set:
+                results[i] = self.recognize(crop, detail=1, profile=profile)
+        
+        stats = {"num_packed": len(packable), "num_canvases": 0, "num_single": len(crops) - len(packable),
+                 "num_unassigned": 0}
+        if not packable:
+            return results, stats
+        
+        placements, shapes = shelf_pack(
+            [crops[i].shape[:2] for i in packable], canvas_size, canvas_size, gap_x, gap_y
+        )
+        stats["num_canvases"] = len(shapes)
+        assigned = {i: [] for i in packable}
+        
+        with span("ocr_packed", num_crops=len(packable), num_canvases=len(shapes)):
+            for canvas_index, (height, width) in enumerate(shapes):
+                members = [(i, x, y) for i, (c, x, y) in zip(packable, placements) if c == canvas_index]
+                canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+                for i, x, y in members:
+                    h, w = crops[i].shape[:2]
+                    canvas[y:y + h, x:x + w] = crops[i]
+                
+                # Vị trí các crop trên canvas: [x1, y1, x2, y2]
+                rects = np.array([[x, y, x + crops[i].shape[1], y + crops[i].shape[0]] for i, x, y in members])
+                for region in self.recognize(canvas, detail=1, profile=profile)["regions"]:
+                    points = np.asarray(region["bbox"], dtype=np.float64)
+                    cx, cy = points.mean(axis=0)
+                    inside = np.flatnonzero(
+                        (rects[:, 0] <= cx) & (cx < rects[:, 2]) & (rects[:, 1] <= cy) & (cy < rects[:, 3])
+                    )
+                    if inside.size:
+                        k = inside[0]
+                    else:
+                        # Tâm rơi vào khoảng trắng (bbox tràn qua gap): gán cho crop giao nhiều nhất
+                        overlap_w = np.minimum(rects[:, 2], points[:, 0].max()) - np.maximum(rects[:, 0], points[:, 0].min())
+                        overlap_h = np.minimum(rects[:, 3], points[:, 1].max()) - np.maximum(rects[:, 1], points[:, 1].min())
+                        overlap = np.clip(overlap_w, 0, None) * np.clip(overlap_h, 0, None)
+                        if overlap.max() <= 0:
+                            stats["num_unassigned"] += 1
+                            continue
+                        k = int(overlap.argmax())
+                    
+                    i, x, y = members[k]
+                    h, w = crops[i].shape[:2]
+                    local = np.clip(points - (x, y), 0, (w, h))
+                    assigned[i].append({
+                        "bbox": [[int(round(px)), int(round(py))] for px, py in local],
+                        "text": region["text"],
+                        "confidence": region["confidence"]
+                    })
+        
+        for i, regions in assigned.items():
+            # Thứ tự đọc trong crop: theo dòng (nửa chiều cao chữ) rồi từ trái sang phải
+            regions.sort(key=lambda r: (r["bbox"][0][1] // max(self.TEXT_HEIGHT // 2, 1), r["bbox"][0][0]))
+            results[i] = {
+                "text": " ".join(r["text"] for r in regions),
+                "regions": regions,
+                "num_regions": len(regions)
+            }
+        
+        logger.info(f"Packed {len(packable)} crops into {len(shapes)} canvases ({stats['num_single']} recognized alone)")
+        return results, stats
+    
+    def warmup(self, runs=1):
+        """
+        Chạy inference trên ảnh giả sau khi load để trả trước chi phí lần đầu
+        (khởi tạo graph, cấp phát bộ nhớ, chọn kernel)
+        
+        Returns:
+            float: Thời gian warm-up (ms)
+        """
+        if self.reader is None:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        image = np.full((64, 320, 3), 255, dtype=np.uint8)
+        cv2.putText(image, "Warm-up 0123", (8, 44), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+        
+        start = time.perf_counter()
+        with self._inference_context():
+            for _ in range(runs):
+                self.reader.readtext(image, detail=1)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"EasyOCR warm-up: {runs} runs in {elapsed_ms}ms")
+        return elapsed_ms
+    
+    def recognize_batch(self, image_list, detail=1, profile=None):
         """
         Nhận diện text từ nhiều ảnh cùng lúc
         
         Args:
             image_list: List các đường dẫn ảnh hoặc numpy arrays
             detail: 1 hoặc 0
+            profile: Profile tốc độ/độ chính xác (xem RECOGNITION_PROFILES)
             
         Returns:
             list: Danh sách kết quả cho từng ảnh
@@ -130,13 +398,19 @@ class EasyOCRRecognizer:
         
         results = []
         for image in image_list:
-            result = self.recognize(image, detail=detail)
+            result = self.recognize(image, detail=detail, profile=profile)
             results.append(result)
         
         return results
     
-    def unload_model(self):
-        """Giải phóng model khỏi RAM"""
+    def unload_model(self, artifact_cache=None, keep_cached=True):
+        """
+        Giải phóng model khỏi RAM
+        Có artifact_cache và keep_cached thì Reader được park lại cho lần load sau
+        """
+        if artifact_cache is not None and keep_cached and self.reader is not None:
+            artifact_cache.park(self.cache_key, self.reader)
+            logger.info("EasyOCR parked in model cache")
         self.reader = None
         logger.info("EasyOCR unloaded from memory")
 
@@ -0,0 +1,119 @@
+"""
+Staging ảnh upload vào volume /data dùng chung
+Tên file theo hash nội dung: cùng 1 ảnh (dù upload lại hay Streamlit rerun) chỉ ghi đĩa 1 lần
+File stage dùng chung giữa các run (cùng nội dung = cùng file) nên DAG không xóa, chỉ ocr_maintenance
+xóa theo tuổi (mtime được làm mới mỗi lần dùng lại)
+"""
+
+import hashlib
+import io
+import os
+import re
+from pathlib import Path
+
+# Ảnh có cạnh dài hơn mức này sẽ được thu nhỏ trước khi ghi vào /data
+MAX_IMAGE_SIDE = 3000
+# File lớn hơn mức này sẽ được nén lại JPEG dù kích thước ảnh không vượt MAX_IMAGE_SIDE
+RECOMPRESS_MIN_BYTES = 3 * 1024 * 1024
+JPEG_QUALITY = 90
+
+# Glob cho GC (gồm cả file .tmp sót lại khi ghi dở) và regex nhận diện file stage
+STAGED_UPLOAD_PATTERN = "upload_*"
+_STAGED_NAME_RE = re.compile(r"^upload_[0-9a-f]{16}\.[0-9a-z]+$")
+
+
+def content_hash(data):
+    """sha256 của nội dung file upload"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def is_staged_upload(path):
+    """File do stage_upload tạo ra (dùng chung giữa các run, không được xóa theo từng run)"""
+    return bool(path) and _STAGED_NAME_RE.match(os.path.basename(path)) is not None
+
+
+def shrink_image(data, max_side=MAX_IMAGE_SIDE, recompress_min_bytes=RECOMPRESS_MIN_BYTES):
+    """
+    Thu nhỏ / nén lại ảnh quá lớn
+
+    Returns:
+        tuple: (bytes, extension) - giữ nguyên ảnh gốc nếu không cần xử lý
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        too_large = max(image.size) > max_side
+        too_heavy = len(data) > recompress_min_bytes
+
+        if not too_large and not too_heavy:
+            return data, None
+
+        # Áp dụng EXIF orientation trước khi resize để ảnh không bị xoay sai
+        image = ImageOps.exif_transpose(image)
+        if too_large:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+
+    shrunk = output.getvalue()
+    # Nén lại mà to hơn (vd PNG scan đen trắng) thì giữ file gốc nếu kích thước ảnh vẫn hợp lệ
+    if not too_large and len(shrunk) >= len(data):
+        return data, None
+
+    return shrunk, ".jpg"
+
+
+def stage_upload(data, original_name, data_dir):
+    """
+    Ghi ảnh upload vào data_dir nếu chưa có (ghi file tạm rồi rename)
+
+    Args:
+        data: Nội dung file (bytes)
+        original_name: Tên file gốc (lấy phần đuôi)
+        data_dir: Thư mục staging (/data)
+
+    Returns:
+        dict: {"filename", "path", "sha256", "size", "reused", "resized"}
+    """
+    digest = content_hash(data)
+    extension = Path(original_name).suffix.lower() or ".jpg"
+
+    # File đã stage trước đó (có thể đã đổi đuôi sang .jpg khi thu nhỏ)
+    for candidate_ext in dict.fromkeys([extension, ".jpg"]):
+        filename = f"upload_{digest[:16]}{candidate_ext}"
+        path = os.path.join(data_dir, filename)
+        try:
+            # Làm mới mtime: GC tính tuổi từ lần dùng gần nhất chứ không phải lần ghi đầu tiên
+            os.utime(path)
+        except FileNotFoundError:
+            continue
+        return {
+            "filename": filename,
+            "path": path,
+            "sha256": digest,
+            "size": os.path.getsize(path),
+            "reused": True,
+            "resized": False
+        }
+
+    staged_data, new_extension = shrink_image(data)
+    filename = f"upload_{digest[:16]}{new_extension or extension}"
+    path = os.path.join(data_dir, filename)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(staged_data)
+    os.replace(tmp_path, path)
+
+    return {
+        "filename": filename,
+        "path": path,
+        "sha256": digest,
+        "size": len(staged_data),
+        "reused": False,
+        "resized": staged_data is not data
+    }
@@ -7,9 +7,17 @@ import streamlit as st
 import requests
 import time
 import os
+import sys
 from datetime import datetime
 from pathlib import Path
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+# Thêm đường dẫn gốc để import được src.pipeline
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+
+from src.pipeline.notifications import read_run_notification
+from src.frontend.staging import stage_upload
 
 # Cấu hình
 AIRFLOW_URL = "http://airflow-apiserver:8080"
@@ -18,10 +26,39 @@ AIRFLOW_PASS = "airflow"
 DATA_DIR = "/data"
 MAX_FILE_SIZE_MB = 10  # Giới hạn file upload 10MB
 
+# Chờ kết quả DAG run
+RUN_RESULTS_DIR = "/data/run_results"  # DAG ghi thông báo kết thúc run vào đây
+RESULT_TASK_ID = "publish_result"  # Task trả về kết quả cuối cùng (XCom return_value)
+NOTIFY_CHECK_INTERVAL = 0.2  # Kiểm tra file thông báo (local, rất rẻ)
+POLL_INITIAL_INTERVAL = 0.5  # Poll Airflow API: bắt đầu dưới 1 giây...
+POLL_MAX_INTERVAL = 5.0  # ... tăng dần tới tối đa 5 giây
+POLL_BACKOFF = 1.5
+RESULT_TIMEOUT = 300  # 5 phút
+
+# Chế độ bulk (nhiều ảnh -> 1 run của DAG ocr_batch_pipeline)
+BATCH_DAG_ID = "ocr_batch_pipeline"
+BATCH_RESULTS_DIR = "/data/batch_results"
+MANIFEST_DIR = "/data/manifests"
+BULK_CHUNK_SIZE = 20  # Số ảnh mỗi chunk (mỗi chunk = 1 mapped task / bước)
+BULK_STAGING_WORKERS = 8  # Số luồng ghi file song song
+BULK_TIMEOUT = 1800  # 30 phút
+BATCH_STAGES = [
+    ("preprocess_chunk", "Tiền xử lý"),
+    ("recognize_chunk", "Nhận diện"),
+    ("postprocess_chunk", "Hậu xử lý"),
+]
+
 # API URLs - Phải khớp với service name trong docker-compose.yaml
 PREPROCESS_API = "http://api-preprocessing:5000"
 RECOGNITION_API = "http://api-recognition:5001"
 POSTPROCESS_API = "http://api-postprocessing:5002"
+SERVICE_APIS = {
+    "preprocess": PREPROCESS_API,
+    "recognition": RECOGNITION_API,
+    "postprocess": POSTPROCESS_API
+}
+STATUS_TTL = 5  # Cache trạng thái services (giây), dùng chung mọi session
+STATUS_TIMEOUT = 2  # Timeout mỗi lần probe (giây)
 
 # Cấu hình trang
 st.set_page_config(
@@ -68,7 +105,8 @@ def get_dag_run_status(dag_run_id):
     try:
         response = requests.get(
             url,
-            auth=(AIRFLOW_USER, AIRFLOW_PASS)
+            auth=(AIRFLOW_USER, AIRFLOW_PASS),
+            timeout=10
         )
         response.raise_for_status()
         return response.json()
@@ -76,6 +114,195 @@ def get_dag_run_status(dag_run_id):
         st.error(f"Lỗi khi kiểm tra status: {str(e)}")
         return None
 
+def get_task_result(dag_run_id, task_id=RESULT_TASK_ID):
+    """Lấy giá trị return của task (XCom return_value) thay vì đọc logs"""
+    url = f"{AIRFLOW_URL}/api/v2/dags/ocr_system_pipeline_v2/dagRuns/{dag_run_id}/taskInstances/{task_id}/xcomEntries/return_value"
+    
+    try:
+        response = requests.get(
+            url,
+            params={"deserialize": "true", "stringify": "false"},
+            auth=(AIRFLOW_USER, AIRFLOW_PASS),
+            timeout=10
+        )
+        response.raise_for_status()
+        value = response.json().get("value")
+        # Một số phiên bản Airflow vẫn trả về dạng string JSON
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        return value
+    except Exception as e:
+        st.error(f"Lỗi khi lấy kết quả: {str(e)}")
+        return None
+
+def get_failed_tasks(dag_run_id):
+    """Danh sách task lỗi của run (1 request cho cả run)"""
+    url = f"{AIRFLOW_URL}/api/v2/dags/ocr_system_pipeline_v2/dagRuns/{dag_run_id}/taskInstances"
+    
+    try:
+        response = requests.get(url, auth=(AIRFLOW_USER, AIRFLOW_PASS), timeout=10)
+        response.raise_for_status()
+        return [ti["task_id"] for ti in response.json().get("task_instances", [])
+                if ti.get("state") in ("failed", "upstream_failed")]
+    except Exception:
+        return []
+
+def wait_for_run_result(dag_run_id, on_progress):
+    """
+    Chờ DAG run kết thúc, trả về (state, result)
+    - Kiểm tra file thông báo do DAG ghi ra mỗi NOTIFY_CHECK_INTERVAL (push, gần như tức thì)
+    - Poll Airflow API với backoff tăng dần (dự phòng khi không có file thông báo)
+    
+    Returns:
+        ("success", result) | ("failed", None) | ("timeout", None)
+    """
+    start = time.monotonic()
+    interval = POLL_INITIAL_INTERVAL
+    next_api_poll = start
+    
+    while time.monotonic() - start < RESULT_TIMEOUT:
+        notification = read_run_notification(dag_run_id, RUN_RESULTS_DIR)
+        if notification:
+            return notification["status"], notification.get("result")
+        
+        now = time.monotonic()
+        if now >= next_api_poll:
+            status_data = get_dag_run_status(dag_run_id)
+            state = status_data.get("state") if status_data else None
+            
+            if state == "success":
+                return "success", get_task_result(dag_run_id)
+            if state == "failed":
+                return "failed", None
+            
+            on_progress(state, now - start)
+            next_api_poll = now + interval
+            interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+        
+        time.sleep(NOTIFY_CHECK_INTERVAL)
+    
+    return "timeout", None
+
+def resolve_pipeline_models(preprocess_model, recognition_model, postprocess_model):
+    """Ưu tiên model đã load, sau đó model chọn ở sidebar, cuối cùng là model mặc định"""
+    loaded = st.session_state.loaded_models
+    return {
+        "preprocess_model": loaded["preprocess"] or (preprocess_model if preprocess_model != "Không" else "ssd_mobilenet_v2"),
+        "recognition_model": loaded["recognition"] or (recognition_model if recognition_model != "Không" else "easyocr_vi_en"),
+        "postprocess_model": loaded["postprocess"] or (postprocess_model if postprocess_model != "Không" else "regex_invoice_vn")
+    }
+
+def trigger_batch_dag(dag_run_id, manifest_path, output_dir, config):
+    """Trigger DAG batch cho 1 danh sách ảnh (1 run cho cả lô)"""
+    url = f"{AIRFLOW_URL}/api/v2/dags/{BATCH_DAG_ID}/dagRuns"
+    payload = {
+        "dag_run_id": dag_run_id,
+        "conf": {
+            "manifest_path": manifest_path,
+            "output_dir": output_dir,
+            "chunk_size": BULK_CHUNK_SIZE,
+            **config
+        }
+    }
+    
+    try:
+        response = requests.post(url, json=payload, auth=(AIRFLOW_USER, AIRFLOW_PASS), timeout=30)
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        st.error(f"Lỗi khi trigger batch DAG: {str(e)}")
+        return None
+
+def get_batch_task_states(dag_run_id):
+    """
+    Trạng thái mọi task instance (kể cả mapped) của run batch trong 1 truy vấn tổng hợp
+    
+    Returns:
+        dict: {(task_id, map_index): state}
+    """
+    url = f"{AIRFLOW_URL}/api/v2/dags/{BATCH_DAG_ID}/dagRuns/{dag_run_id}/taskInstances"
+    states = {}
+    offset = 0
+    
+    try:
+        while True:
+            response = requests.get(
+                url,
+                params={"limit": 100, "offset": offset},
+                auth=(AIRFLOW_USER, AIRFLOW_PASS),
+                timeout=10
+            )
+            response.raise_for_status()
+            data = response.json()
+            task_instances = data.get("task_instances", [])
+            for ti in task_instances:
+                states[(ti["task_id"], ti.get("map_index", -1))] = ti.get("state")
+            
+            offset += len(task_instances)
+            if not task_instances or offset >= data.get("total_entries", 0):
+                return states
+    except Exception as e:
+        st.error(f"Lỗi khi kiểm tra status batch: {str(e)}")
+        return states
+
+def build_bulk_progress(bulk_run, task_states):
+    """
+    Suy ra trạng thái từng file từ trạng thái các chunk task
+    
+    Returns:
+        tuple: (rows cho bảng tiến độ, finished)
+    """
+    failed_states = ("failed", "upstream_failed")
+    finished = (
+        task_states.get(("summarize", -1)) in ("success", *failed_states)
+        or task_states.get(("list_inputs", -1)) in failed_states
+        or task_states.get(("load_models", -1)) in failed_states
+    )
+    
+    # Kết quả cuối của các chunk đã xong (đọc từ volume /data dùng chung)
+    final_records = {}
+    for (task_id, map_index), state in task_states.items():
+        if task_id == "postprocess_chunk" and state == "success":
+            chunk_path = os.path.join(bulk_run["output_dir"], "final", f"chunk_{map_index:05d}.jsonl")
+            if os.path.exists(chunk_path):
+                with open(chunk_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        final_records[record["image_path"]] = record
+    
+    rows = []
+    for idx, file_info in enumerate(bulk_run["files"]):
+        chunk_id = idx // bulk_run["chunk_size"]
+        status = "✅ Hoàn tất"
+        for task_id, label in BATCH_STAGES:
+            state = task_states.get((task_id, chunk_id))
+            if state == "success":
+                continue
+            if state in failed_states:
+                status = f"❌ Lỗi ở bước {label}"
+            elif state in ("running", "deferred"):
+                status = f"⏳ Đang {label.lower()}"
+            else:
+                status = f"🕒 Chờ {label.lower()}"
+            break
+        
+        record = final_records.get(file_info["path"]) or {}
+        if record.get("status") == "error":
+            status = f"❌ {record.get('error')}"
+        recognition = record.get("recognition") or {}
+        
+        rows.append({
+            "File": file_info["name"],
+            "Chunk": chunk_id,
+            "Trạng thái": status,
+            "Text": recognition.get("full_text", "") if isinstance(recognition, dict) else ""
+        })
+    
+    return rows, finished
+
 def get_task_logs(dag_run_id, task_id):
     """Lấy logs của task cụ thể"""
     url = f"{AIRFLOW_URL}/api/v2/dags/ocr_system_pipeline_v2/dagRuns/{dag_run_id}/taskInstances/{task_id}/logs/1"
@@ -117,12 +344,36 @@ def unload_model_api(service_url, model_name):
         return {"error": str(e)}
 
 def check_api_health(service_url):
-    """Kiểm tra API service có hoạt động không"""
+    """
+    Probe 1 service qua /model_state: còn sống không, models đang load, RAM đang dùng
+    
+    Returns:
+        dict: {"healthy", "latency_ms", "models", "rss_mb", "error"}
+    """
+    start = time.time()
     try:
-        response = requests.get(f"{service_url}/health", timeout=3)
-        return response.status_code == 200
-    except:
-        return False
+        response = requests.get(f"{service_url}/model_state", timeout=STATUS_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        return {
+            "healthy": True,
+            "latency_ms": round((time.time() - start) * 1000),
+            "models": data.get("models", {}),
+            "rss_mb": data.get("rss_mb"),
+            "error": None
+        }
+    except Exception as e:
+        return {"healthy": False, "latency_ms": None, "models": {}, "rss_mb": None, "error": str(e)}
+
+@st.cache_data(ttl=STATUS_TTL, show_spinner=False)
+def get_services_status():
+    """
+    Probe song song tất cả services, cache ngắn hạn giữa các lần rerun và các session
+    Thời gian chờ = service chậm nhất (tối đa STATUS_TIMEOUT), không cộng dồn
+    """
+    with ThreadPoolExecutor(max_workers=len(SERVICE_APIS)) as executor:
+        futures = {key: executor.submit(check_api_health, url) for key, url in SERVICE_APIS.items()}
+        return {key: future.result() for key, future in futures.items()}
 
 # Header
 st.title("Hệ thống OCR Tự động")
@@ -140,6 +391,9 @@ if "loaded_models" not in st.session_state:
 with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
     st.markdown("**Nạp models vào RAM trước khi xử lý để tăng tốc độ**")
     
+    # Trạng thái thật trên services (cache ngắn hạn), để thấy cả model do session/DAG khác load
+    services_status = get_services_status()
+    
     col_model1, col_model2, col_model3 = st.columns(3)
     
     # Detection Model
@@ -151,7 +405,10 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
             key="detection_choice"
         )
         
-        is_loaded = st.session_state.loaded_models["preprocess"] == detection_choice
+        is_loaded = (
+            st.session_state.loaded_models["preprocess"] == detection_choice
+            or detection_choice in services_status["preprocess"]["models"]
+        )
         
         if is_loaded:
             st.success(f"✓ Đã load: {detection_choice}")
@@ -160,6 +417,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = unload_model_api(PREPROCESS_API, detection_choice)
                     if "error" not in result:
                         st.session_state.loaded_models["preprocess"] = None
+                        get_services_status.clear()
                         st.success("Đã unload thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -175,6 +433,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = load_model_api(PREPROCESS_API, detection_choice, config)
                     if "error" not in result:
                         st.session_state.loaded_models["preprocess"] = detection_choice
+                        get_services_status.clear()
                         st.success(f"Đã load {detection_choice} thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -190,7 +449,10 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
             key="recognition_choice"
         )
         
-        is_loaded = st.session_state.loaded_models["recognition"] == recognition_choice
+        is_loaded = (
+            st.session_state.loaded_models["recognition"] == recognition_choice
+            or recognition_choice in services_status["recognition"]["models"]
+        )
         
         if is_loaded:
             st.success(f"✓ Đã load: {recognition_choice}")
@@ -199,6 +461,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = unload_model_api(RECOGNITION_API, recognition_choice)
                     if "error" not in result:
                         st.session_state.loaded_models["recognition"] = None
+                        get_services_status.clear()
                         st.success("Đã unload thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -214,6 +477,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = load_model_api(RECOGNITION_API, recognition_choice, config)
                     if "error" not in result:
                         st.session_state.loaded_models["recognition"] = recognition_choice
+                        get_services_status.clear()
                         st.success(f"Đã load {recognition_choice} thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -229,7 +493,10 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
             key="postprocess_choice"
         )
         
-        is_loaded = st.session_state.loaded_models["postprocess"] == postprocess_choice
+        is_loaded = (
+            st.session_state.loaded_models["postprocess"] == postprocess_choice
+            or postprocess_choice in services_status["postprocess"]["models"]
+        )
         
         if is_loaded:
             st.success(f"✓ Đã load: {postprocess_choice}")
@@ -238,6 +505,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = unload_model_api(POSTPROCESS_API, postprocess_choice)
                     if "error" not in result:
                         st.session_state.loaded_models["postprocess"] = None
+                        get_services_status.clear()
                         st.success("Đã unload thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -249,6 +517,7 @@ with st.expander("⚙️ Quản lý Models (Load/Unload)", expanded=False):
                     result = load_model_api(POSTPROCESS_API, postprocess_choice)
                     if "error" not in result:
                         st.session_state.loaded_models["postprocess"] = postprocess_choice
+                        get_services_status.clear()
                         st.success(f"Đã load {postprocess_choice} thành công!")
                         time.sleep(1)
                         st.rerun()
@@ -285,6 +554,19 @@ with st.sidebar:
         help="Trích xuất thông tin có cấu trúc từ text đã nhận dạng"
     )
     
+    st.markdown("---")
+    st.subheader("Trạng thái services")
+    for key, status in get_services_status().items():
+        if status["healthy"]:
+            rss = f", RAM {status['rss_mb']:.0f}MB" if status["rss_mb"] is not None else ""
+            st.markdown(f"🟢 **{key}** ({status['latency_ms']}ms{rss})")
+            for model_name, info in status["models"].items():
+                load_rss = f" (+{info['load_rss_mb']:.0f}MB)" if info.get("load_rss_mb") is not None else ""
+                st.caption(f"• {model_name}{load_rss}")
+        else:
+            st.markdown(f"🔴 **{key}**")
+            st.caption(status["error"])
+    
     st.markdown("---")
     st.caption(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -310,15 +592,22 @@ with col1:
             st.image(uploaded_file, caption="Ảnh đã upload", use_column_width=True)
             st.caption(f"Kích thước: {file_size_mb:.2f}MB")
             
-            # Lưu file vào /data
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"upload_{timestamp}_{uploaded_file.name}"
-            filepath = os.path.join(DATA_DIR, filename)
-            
-            with open(filepath, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            # Stage file vào /data theo hash nội dung - chỉ ghi 1 lần cho mỗi file upload,
+            # các lần rerun sau dùng lại thông tin trong session_state
+            staged_files = st.session_state.setdefault("staged_files", {})
+            staged = staged_files.get(uploaded_file.file_id)
+            if staged is None or not os.path.exists(staged["path"]):
+                # Lần đầu thấy file này, hoặc file đã bị ocr_maintenance xóa (không dùng quá retention)
+                staged = stage_upload(uploaded_file.getvalue(), uploaded_file.name, DATA_DIR)
+                staged_files[uploaded_file.file_id] = staged
+            filename = staged["filename"]
             
-            st.success(f"✓ Đã lưu: {filename}")
+            if staged["reused"]:
+                st.success(f"✓ Dùng lại file đã có: {filename}")
+            elif staged["resized"]:
+                st.success(f"✓ Đã thu nhỏ và lưu: {filename} ({staged['size'] / (1024 * 1024):.2f}MB)")
+            else:
+                st.success(f"✓ Đã lưu: {filename}")
         
             # Nút xử lý
             if st.button("Bắt đầu xử lý OCR", type="primary"):
@@ -329,18 +618,10 @@ with col1:
                     st.rerun()
                 else:
                     # Sử dụng models đã load hoặc chọn từ sidebar
-                    selected_preprocess = st.session_state.loaded_models["preprocess"] or (preprocess_model if preprocess_model != "Không" else "ssd_mobilenet_v2")
-                    selected_recognition = st.session_state.loaded_models["recognition"] or (recognition_model if recognition_model != "Không" else "easyocr_vi_en")
-                    selected_postprocess = st.session_state.loaded_models["postprocess"] or (postprocess_model if postprocess_model != "Không" else "regex_invoice_vn")
-                    
-                    config = {
-                        "preprocess_model": selected_preprocess,
-                        "recognition_model": selected_recognition,
-                        "postprocess_model": selected_postprocess
-                    }
+                    config = resolve_pipeline_models(preprocess_model, recognition_model, postprocess_model)
                     
                     # Hiển thị thông báo về models sẽ được sử dụng
-                    st.info(f"Sử dụng models: {selected_preprocess} → {selected_recognition} → {selected_postprocess}")
+                    st.info(f"Sử dụng models: {config['preprocess_model']} → {config['recognition_model']} → {config['postprocess_model']}")
                     
                     with st.spinner("Đang gửi yêu cầu đến Airflow..."):
                         result = trigger_airflow_dag(filename, config)
@@ -366,64 +647,159 @@ with col2:
         progress_bar = st.progress(0)
         status_text = st.empty()
         
-        # Poll DAG status
-        max_attempts = 60  # 5 phút (mỗi 5s check 1 lần)
-        for attempt in range(max_attempts):
-            status_data = get_dag_run_status(dag_run_id)
+        def show_progress(state, elapsed):
+            progress_bar.progress(min(10 + int(elapsed * 2), 90))
+            status_text.info(f"Đang xử lý... ({state or 'queued'}, {elapsed:.1f}s)")
+        
+        # Chờ kết quả: thông báo từ DAG (push) + poll Airflow API với backoff
+        state, result = wait_for_run_result(dag_run_id, show_progress)
+        progress_bar.progress(100)
+        
+        if state == "success":
+            status_text.success("Xử lý hoàn tất!")
+            
+            st.markdown("### Kết quả xử lý")
+            st.info("Pipeline đã chạy thành công qua 3 bước: Preprocessing → Recognition → Postprocessing")
             
-            if status_data:
-                state = status_data.get("state")
+            # Kết quả lấy trực tiếp từ giá trị return của task cuối
+            if result is not None:
+                recognition = result.get("recognition") or {}
+                text = recognition.get("full_text") or recognition.get("text")
+                if text:
+                    st.markdown("#### Văn bản nhận diện")
+                    st.text_area("OCR", text, height=200, label_visibility="collapsed")
+                    st.caption(f"{recognition.get('num_regions', 0)} vùng văn bản")
+                with st.expander("Kết quả chi tiết (JSON)", expanded=not text):
+                    st.json(result)
+                st.download_button(
+                    "Tải xuống kết quả (JSON)",
+                    data=json.dumps(result, ensure_ascii=False, indent=2),
+                    file_name=f"ocr_result_{dag_run_id}.json",
+                    mime="application/json"
+                )
+            else:
+                st.warning("Run thành công nhưng không có kết quả trả về")
                 
-                if state == "success":
-                    progress_bar.progress(100)
-                    status_text.success("Xử lý hoàn tất!")
-                    
-                    # Lấy kết quả từ logs của task cuối
-                    logs = get_task_logs(dag_run_id, "postprocessing_step")
-                    
-                    st.markdown("### Kết quả xử lý")
-                    
-                    # Hiển thị thông báo hoàn thành
-                    st.info("Pipeline đã chạy thành công qua 3 bước: Preprocessing → Recognition → Postprocessing")
-                    
-                    # Hiển thị logs nếu có
+        elif state == "failed":
+            status_text.error("Xử lý thất bại!")
+            
+            # Chỉ tải log của task lỗi khi người dùng cần xem
+            failed_tasks = get_failed_tasks(dag_run_id)
+            if failed_tasks:
+                st.caption(f"Task lỗi: {', '.join(failed_tasks)}")
+                with st.expander("Xem logs lỗi"):
+                    logs = get_task_logs(dag_run_id, failed_tasks[0])
                     if logs:
-                        with st.expander("Xem logs chi tiết"):
-                            st.code(logs, language="log")
-                    
-                    st.caption("Lưu ý: Hiện tại các API chỉ thực hiện skeleton processing. Cần implement logic thật vào src/core/")
-                    
-                    st.session_state.processing = False
-                    break
-                    
-                elif state == "failed":
-                    progress_bar.progress(100)
-                    status_text.error("Xử lý thất bại!")
-                    
-                    with st.expander("Xem logs lỗi"):
-                        for task in ["preprocessing_step", "recognition_step", "postprocessing_step"]:
-                            logs = get_task_logs(dag_run_id, task)
-                            if logs:
-                                st.code(logs, language="log")
-                    
-                    st.session_state.processing = False
-                    break
-                    
-                elif state == "running":
-                    progress = min(30 + attempt * 2, 90)
-                    progress_bar.progress(progress)
-                    status_text.info(f"Đang xử lý... ({state})")
-                
-            time.sleep(5)  # Đợi 5 giây trước khi check lại
+                        st.code(logs[-5000:], language="log")
         
         else:
             # Timeout
             status_text.warning("Timeout! Vui lòng kiểm tra Airflow UI để xem chi tiết.")
-            st.session_state.processing = False
+        
+        st.session_state.processing = False
     
     else:
         st.info("Upload ảnh và nhấn 'Bắt đầu xử lý' để xem kết quả")
 
+# Section: Xử lý hàng loạt (nhiều file -> 1 run của DAG batch)
+st.markdown("---")
+st.subheader("Xử lý hàng loạt")
+st.caption(f"Upload nhiều ảnh cùng lúc, toàn bộ được xử lý trong 1 run của DAG `{BATCH_DAG_ID}` (mỗi chunk {BULK_CHUNK_SIZE} ảnh)")
+
+bulk_files = st.file_uploader(
+    "Chọn nhiều ảnh (JPG, PNG)",
+    type=["jpg", "jpeg", "png"],
+    accept_multiple_files=True,
+    key="bulk_uploader"
+)
+
+if bulk_files:
+    oversized = [f.name for f in bulk_files if f.size > MAX_FILE_SIZE_MB * 1024 * 1024]
+    valid_files = [f for f in bulk_files if f.size <= MAX_FILE_SIZE_MB * 1024 * 1024]
+    if oversized:
+        st.warning(f"Bỏ qua {len(oversized)} file quá {MAX_FILE_SIZE_MB}MB: {', '.join(oversized)}")
+    st.caption(f"{len(valid_files)} file hợp lệ")
+    
+    if valid_files and st.button("Xử lý hàng loạt", type="primary"):
+        # Stage song song, dùng lại file đã stage ở các lần rerun trước
+        staged_files = st.session_state.setdefault("staged_files", {})
+        pending = [
+            f for f in valid_files
+            if f.file_id not in staged_files or not os.path.exists(staged_files[f.file_id]["path"])
+        ]
+        with st.spinner(f"Đang lưu {len(pending)} file..."):
+            with ThreadPoolExecutor(max_workers=BULK_STAGING_WORKERS) as executor:
+                staged_list = list(executor.map(
+                    lambda f: stage_upload(f.getvalue(), f.name, DATA_DIR), pending
+                ))
+            staged_files.update({f.file_id: staged for f, staged in zip(pending, staged_list)})
+        
+        # Bỏ trùng nội dung: nhiều file giống nhau chỉ xử lý 1 lần
+        files = []
+        seen_paths = set()
+        for f in valid_files:
+            staged = staged_files[f.file_id]
+            if staged["path"] not in seen_paths:
+                seen_paths.add(staged["path"])
+                files.append({"name": f.name, "path": staged["path"]})
+        
+        dag_run_id = f"bulk__{datetime.now().strftime('%Y%m%dT%H%M%S')}__{os.urandom(3).hex()}"
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        manifest_path = os.path.join(MANIFEST_DIR, f"{dag_run_id}.txt")
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(file_info["path"] for file_info in files) + "\n")
+        
+        output_dir = os.path.join(BATCH_RESULTS_DIR, dag_run_id)
+        config = resolve_pipeline_models(preprocess_model, recognition_model, postprocess_model)
+        if trigger_batch_dag(dag_run_id, manifest_path, output_dir, config):
+            st.session_state.bulk_run = {
+                "dag_run_id": dag_run_id,
+                "output_dir": output_dir,
+                "chunk_size": BULK_CHUNK_SIZE,
+                "files": files
+            }
+            st.rerun()
+
+if "bulk_run" in st.session_state:
+    bulk_run = st.session_state.bulk_run
+    st.caption(f"Run: `{bulk_run['dag_run_id']}` - {len(bulk_run['files'])} file")
+    
+    progress_bar = st.progress(0)
+    table = st.empty()
+    
+    # 1 truy vấn taskInstances mỗi vòng, giãn dần khoảng poll
+    start_time = time.time()
+    interval = POLL_INITIAL_INTERVAL
+    while True:
+        task_states = get_batch_task_states(bulk_run["dag_run_id"])
+        rows, finished = build_bulk_progress(bulk_run, task_states)
+        num_done = sum(1 for row in rows if not row["Trạng thái"].startswith(("⏳", "🕒")))
+        progress_bar.progress(num_done / max(len(rows), 1))
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+        
+        if finished or time.time() - start_time > BULK_TIMEOUT:
+            break
+        time.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    
+    if finished:
+        st.success(f"Hoàn tất: {num_done}/{len(rows)} file")
+        summary_path = os.path.join(bulk_run["output_dir"], "summary.json")
+        if os.path.exists(summary_path):
+            with open(summary_path, "r", encoding="utf-8") as f:
+                st.download_button(
+                    "Tải xuống tổng hợp (JSON)",
+                    data=f.read(),
+                    file_name=f"batch_summary_{bulk_run['dag_run_id']}.json",
+                    mime="application/json"
+                )
+    else:
+        st.warning("Timeout! Vui lòng kiểm tra Airflow UI để xem chi tiết.")
+    
+    if st.button("Đóng kết quả hàng loạt"):
+        del st.session_state.bulk_run
+        st.rerun()
+
 # Footer
 st.markdown("---")
 col_a, col_b, col_c = st.columns(3)
@@ -0,0 +1 @@
+# chứa các helper phía Airflow (gọi API, chia batch) dùng chung cho các DAG
\ No newline at end of file
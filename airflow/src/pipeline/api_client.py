@@ -0,0 +1,134 @@
+"""
+API Client - Helper gọi các Flask services từ Airflow DAG
+Dùng chung cho DAG xử lý từng ảnh và DAG xử lý batch
+
+Mỗi worker process giữ 1 session (connection pool + keep-alive) cho mỗi service,
+dùng chung cho mọi task chạy trong process đó thay vì tạo kết nối mới mỗi lần gọi
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.utils.tracing import span, trace_headers, get_trace_id
+
+logger = logging.getLogger(__name__)
+
+# Timeout mặc định cho API calls (giây) - 5 phút cho model nặng
+DEFAULT_TIMEOUT = 300
+
+# Số kết nối tối đa giữ trong pool cho mỗi service (nên >= worker concurrency)
+POOL_MAXSIZE = int(os.environ.get("OCR_HTTP_POOL_MAXSIZE", "16"))
+# Nén gzip body request lớn hơn ngưỡng này (bytes), 0 = tắt nén
+COMPRESS_MIN_BYTES = int(os.environ.get("OCR_HTTP_COMPRESS_MIN_BYTES", "65536"))
+
+# Session dùng chung theo service: {url_base: (pid, session)}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_retry():
+    """Retry khi gặp server errors, backoff 1s, 2s, 4s + jitter để các worker không retry đồng loạt"""
+    params = dict(
+        total=3,  # Retry tối đa 3 lần
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["POST", "GET"]
+    )
+    try:
+        return Retry(backoff_jitter=0.5, **params)
+    except TypeError:
+        # urllib3 < 2.0 không hỗ trợ backoff_jitter
+        return Retry(**params)
+
+
+def _build_session():
+    """Tạo requests session với connection pool + retry logic"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        max_retries=_build_retry(),
+        pool_connections=1,  # Mỗi session chỉ nói chuyện với 1 service
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=False
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url_base):
+    """
+    Lấy session dùng chung cho 1 service trong process hiện tại
+    Tạo lại sau khi fork (Celery prefork) để không dùng chung socket giữa các process
+    """
+    pid = os.getpid()
+    with _sessions_lock:
+        entry = _sessions.get(url_base)
+        if entry is None or entry[0] != pid:
+            entry = (pid, _build_session())
+            _sessions[url_base] = entry
+        return entry[1]
+
+
+def close_sessions():
+    """Đóng toàn bộ session (giải phóng kết nối keep-alive)"""
+    with _sessions_lock:
+        for _, session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _encode_body(payload, compress):
+    """Serialize payload thành JSON, nén gzip nếu đủ lớn"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    # X-Trace-Id của DAG run (nếu task đang chạy trong traced(...)) để services ghi span cùng trace
+    headers = {"Content-Type": "application/json", **trace_headers()}
+
+    if compress and COMPRESS_MIN_BYTES and len(body) >= COMPRESS_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+
+    return body, headers
+
+
+def call_api_step(url_base, endpoint, payload, task_name, timeout=DEFAULT_TIMEOUT, compress=True):
+    """Hàm chung để gọi API và xử lý lỗi cơ bản với retry"""
+    full_url = f"{url_base}/{endpoint}"
+    logger.info(f"[{task_name}] Calling: {full_url} (trace={get_trace_id() or '-'}) with payload: {payload}")
+
+    try:
+        # Span client = thời gian service xử lý + mạng + retry (so với span server để thấy overhead)
+        with span(f"call {endpoint}", kind="client", url=full_url):
+            body, headers = _encode_body(payload, compress)
+            response = get_session(url_base).post(full_url, data=body, headers=headers, timeout=timeout)
+            response.raise_for_status()  # Báo lỗi nếu status != 200
+            return response.json()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"[{task_name}] Failed after retries: {str(e)}")
+        raise e
+
+
+def stream_api_step(url_base, endpoint, payload, task_name, timeout=DEFAULT_TIMEOUT):
+    """
+    Gọi endpoint trả NDJSON (vd: /process_document), yield từng bản ghi ngay khi service gửi về
+    Dòng cuối có "done": true kèm tổng kết; lỗi đọc tài liệu giữa chừng được raise
+    """
+    full_url = f"{url_base}/{endpoint}"
+    logger.info(f"[{task_name}] Streaming: {full_url} (trace={get_trace_id() or '-'}) with payload: {payload}")
+
+    body, headers = _encode_body(payload, compress=True)
+    with get_session(url_base).post(full_url, data=body, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("done") and record.get("status") == "error":
+                raise RuntimeError(f"[{task_name}] Document failed: {record.get('error')}")
+            yield record
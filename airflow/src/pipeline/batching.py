@@ -0,0 +1,109 @@
+"""
+Batching - Liệt kê ảnh đầu vào, chia chunk và đọc/ghi file kết quả theo chunk
+Dùng cho DAG batch (ocr_batch_pipeline)
+"""
+
+import json
+import os
+from pathlib import Path
+
+# Các định dạng ảnh được nhận khi quét thư mục đầu vào
+DEFAULT_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+
+def list_image_paths(input_dir=None, manifest_path=None, extensions=DEFAULT_IMAGE_EXTENSIONS):
+    """
+    Liệt kê danh sách ảnh cần xử lý
+
+    Args:
+        input_dir: Thư mục chứa ảnh (quét đệ quy)
+        manifest_path: File manifest, mỗi dòng là 1 đường dẫn ảnh (ưu tiên hơn input_dir)
+        extensions: Các đuôi file được chấp nhận khi quét thư mục
+
+    Returns:
+        list: Danh sách đường dẫn ảnh (đã sắp xếp, không trùng lặp)
+    """
+    if manifest_path:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        # Giữ thứ tự trong manifest nhưng bỏ dòng trùng
+        return list(dict.fromkeys(paths))
+
+    if input_dir:
+        extensions = tuple(ext.lower() for ext in extensions)
+        paths = []
+        for root, _, files in os.walk(input_dir):
+            for name in files:
+                if name.lower().endswith(extensions):
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+
+    raise ValueError("Cần cung cấp 'input_dir' hoặc 'manifest_path'")
+
+
+def split_into_chunks(items, chunk_size):
+    """Chia list thành các chunk liên tiếp có kích thước tối đa chunk_size"""
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size phải > 0, nhận được: {chunk_size}")
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def _chunk_dir(output_dir, run_key):
+    """Manifest của từng run nằm riêng: output_dir dùng lại không trộn manifest của run trước"""
+    return Path(output_dir) / "chunks" / run_key.replace(":", "_").replace("/", "_")
+
+
+def write_chunk_manifests(chunks, output_dir, run_key):
+    """
+    Ghi mỗi chunk ra 1 file manifest để XCom chỉ cần giữ đường dẫn file,
+    không phải giữ toàn bộ danh sách ảnh
+    Manifest cũ của cùng run (lần thử trước của task) bị xóa trước khi ghi
+
+    Returns:
+        list: [{"chunk_id", "manifest_path", "num_images", "output_dir"}, ...]
+    """
+    chunk_dir = _chunk_dir(output_dir, run_key)
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    for stale in chunk_dir.glob("chunk_*.txt"):
+        stale.unlink()
+
+    chunk_infos = []
+    for chunk_id, chunk in enumerate(chunks):
+        manifest_path = chunk_dir / f"chunk_{chunk_id:05d}.txt"
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(chunk) + "\n")
+
+        chunk_infos.append({
+            "chunk_id": chunk_id,
+            "manifest_path": str(manifest_path),
+            "num_images": len(chunk),
+            "output_dir": str(output_dir)
+        })
+
+    return chunk_infos
+
+
+def list_chunk_manifests(output_dir, run_key):
+    """Các file manifest đã ghi của 1 run (rỗng nếu bước chia chunk chưa chạy tới)"""
+    return sorted(str(path) for path in _chunk_dir(output_dir, run_key).glob("chunk_*.txt"))
+
+
+def chunk_output_path(chunk_info, stage):
+    """Đường dẫn file kết quả của 1 chunk tại 1 bước (preprocess/recognition/final)"""
+    return str(Path(chunk_info["output_dir"]) / stage / f"chunk_{chunk_info['chunk_id']:05d}.jsonl")
+
+
+def write_jsonl(path, records):
+    """Ghi list records ra file JSONL (ghi file tạm rồi rename để tránh file dở dang)"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def read_jsonl(path):
+    """Đọc file JSONL thành list records"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,114 @@
+"""
+Model Readiness - Cache trạng thái "model đã load" của từng service trong worker process
+Tránh gọi /load_model trước mỗi bước: steady state chỉ còn đúng 1 request / bước
+"""
+
+import logging
+import os
+import threading
+import time
+
+from src.pipeline.api_client import call_api_step, get_session
+
+logger = logging.getLogger(__name__)
+
+# Thời gian tin cache readiness (giây) trước khi kiểm tra lại bằng GET /model_state
+READINESS_TTL = float(os.environ.get("OCR_MODEL_READY_TTL", "60"))
+
+# {(url_base, model_name): expires_at}
+_ready_until = {}
+# {url_base: model state version (ETag) lần cuối thấy}
+_state_versions = {}
+# {url_base: (version, frozenset model đã load ở version đó)} - 304 chỉ có nghĩa "giống lần trước"
+_state_models = {}
+_lock = threading.Lock()
+
+
+def mark_ready(url_base, model_name, version=None):
+    """Ghi nhận model đang load trên service (gia hạn TTL)"""
+    with _lock:
+        _ready_until[(url_base, model_name)] = time.monotonic() + READINESS_TTL
+        if version is not None:
+            previous = _state_versions.get(url_base)
+            if previous is not None and previous != version:
+                # Service đã load/unload model khác -> bỏ cache các model còn lại của service
+                for key in [k for k in _ready_until if k[0] == url_base and k[1] != model_name]:
+                    del _ready_until[key]
+            _state_versions[url_base] = version
+
+
+def is_ready_cached(url_base, model_name):
+    with _lock:
+        return _ready_until.get((url_base, model_name), 0) > time.monotonic()
+
+
+def invalidate(url_base, model_name=None):
+    """Xóa cache (vd sau khi chủ động unload model)"""
+    with _lock:
+        for key in [k for k in _ready_until if k[0] == url_base and model_name in (None, k[1])]:
+            del _ready_until[key]
+        _state_models.pop(url_base, None)
+
+
+def _fetch_loaded_models(url_base):
+    """
+    GET /model_state có điều kiện theo ETag, trả về (version, set model đã load)
+    Chỉ gửi If-None-Match khi còn giữ tập model của version đó: 304 thì dùng lại tập đã cache
+    """
+    with _lock:
+        version, models = _state_models.get(url_base, (None, None))
+
+    headers = {"If-None-Match": f'"{version}"'} if version is not None else {}
+    response = get_session(url_base).get(f"{url_base}/model_state", headers=headers, timeout=10)
+
+    if response.status_code == 304:
+        return version, models
+
+    response.raise_for_status()
+    state = response.json()
+    version, models = str(state["version"]), frozenset(state["models"])
+    with _lock:
+        _state_models[url_base] = (version, models)
+    return version, models
+
+
+def ensure_model_loaded(url_base, model_name, task_name, load_config=None):
+    """
+    Đảm bảo model đã load trên service
+    - Cache còn hạn: không gọi gì
+    - Hết hạn: GET /model_state (304 nếu không đổi), chỉ gọi /load_model khi model thật sự chưa load
+    """
+    if is_ready_cached(url_base, model_name):
+        return
+
+    try:
+        version, loaded_models = _fetch_loaded_models(url_base)
+    except Exception as e:
+        # Service cũ không có /model_state -> quay về cách cũ
+        logger.warning(f"[{task_name}] Cannot read model state: {str(e)}")
+        version, loaded_models = None, set()
+
+    if model_name in loaded_models:
+        mark_ready(url_base, model_name, version)
+        return
+
+    call_api_step(url_base, "load_model", {"model_name": model_name, **(load_config or {})}, f"{task_name}-Load")
+    mark_ready(url_base, model_name)
+
+
+def call_model_step(url_base, endpoint, payload, task_name, load_config=None, **kwargs):
+    """
+    Gọi 1 bước xử lý với model trong payload["model_name"]
+    Gửi kèm auto_load để service tự load nếu model bị unload giữa chừng (cache readiness lỗi thời)
+    """
+    model_name = payload["model_name"]
+    ensure_model_loaded(url_base, model_name, task_name, load_config)
+
+    body = {**payload, "auto_load": True}
+    if load_config:
+        body["load_config"] = load_config
+
+    result = call_api_step(url_base, endpoint, body, task_name, **kwargs)
+    # Mỗi lần gọi thành công gia hạn cache -> steady state không cần kiểm tra lại
+    mark_ready(url_base, model_name)
+    return result
@@ -0,0 +1,69 @@
+"""
+Run Notifications - Báo kết quả DAG run ngay khi xong qua file trên volume /data dùng chung
+Frontend chỉ cần kiểm tra file local (rất rẻ) thay vì poll Airflow API liên tục
+
+    {notify_dir}/{dag_run_id}.json = {"status": "success|failed", "result": {...}, "error": ..., "finished_at": ...}
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+DEFAULT_NOTIFY_DIR = "/data/run_results"
+
+
+def _notification_path(dag_run_id, notify_dir=None):
+    # run_id có thể chứa ':' '+' -> đổi thành '_' để làm tên file an toàn
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", dag_run_id)
+    return Path(notify_dir or DEFAULT_NOTIFY_DIR) / f"{safe_id}.json"
+
+
+def notify_run_finished(dag_run_id, status, result=None, error=None, notify_dir=None):
+    """Ghi thông báo kết thúc run (ghi file tạm rồi rename để reader không đọc file dở dang)"""
+    path = _notification_path(dag_run_id, notify_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "dag_run_id": dag_run_id,
+            "status": status,
+            "result": result,
+            "error": error,
+            "finished_at": time.time()
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return str(path)
+
+
+def read_run_notification(dag_run_id, notify_dir=None):
+    """Đọc thông báo kết thúc run, None nếu run chưa xong"""
+    try:
+        with open(_notification_path(dag_run_id, notify_dir), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def has_run_notification(dag_run_id, notify_dir=None):
+    return _notification_path(dag_run_id, notify_dir).exists()
+
+
+def gc_run_notifications(max_age_hours, notify_dir=None):
+    """Xóa thông báo của các run đã kết thúc quá max_age_hours giờ, trả về số file đã xóa"""
+    root = Path(notify_dir or DEFAULT_NOTIFY_DIR)
+    if not root.exists():
+        return 0
+
+    cutoff = time.time() - max_age_hours * 3600
+    deleted = 0
+    for path in root.glob("*.json"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                deleted += 1
+        except FileNotFoundError:
+            continue
+    return deleted
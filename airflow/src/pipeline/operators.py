@@ -0,0 +1,116 @@
+"""
+Operators - Operator deferrable gọi 1 bước của OCR pipeline
+Submit job lên service -> defer cho airflow-triggerer poll -> resume khi có kết quả
+"""
+
+import logging
+from datetime import timedelta
+
+from airflow.exceptions import AirflowException
+
+try:
+    from airflow.sdk import BaseOperator
+except ImportError:
+    # Airflow 2.x
+    from airflow.models import BaseOperator
+
+from src.pipeline.api_client import call_api_step
+from src.pipeline.model_readiness import ensure_model_loaded
+from src.pipeline.triggers import OCRJobTrigger
+from src.utils.tracing import traced, trace_id_for_run
+
+logger = logging.getLogger(__name__)
+
+
+class OCRServiceOperator(BaseOperator):
+    """
+    Gọi 1 endpoint của Flask service dưới dạng background job, không giữ worker slot khi chờ
+
+    Args:
+        service_url: URL gốc của service (settings.PREPROC_URL, ...)
+        endpoint: Endpoint cần chạy (process, predict, process_batch, ...)
+        payload: Body gửi cho endpoint (hỗ trợ Jinja template)
+        load_model_name: Nếu có, đảm bảo model đã load (theo cache readiness) trước khi submit job
+        result_key: Chỉ trả về field này của response (vd "data"), None = cả response
+        poll_interval: Khoảng cách poll ban đầu của trigger (giây)
+        job_timeout: Thời gian tối đa chờ job (giây)
+        max_resubmits: Số lần submit lại khi job biến mất khỏi service (404, vd service restart)
+    """
+
+    template_fields = ("payload", "load_model_name")
+
+    def __init__(
+        self,
+        *,
+        service_url,
+        endpoint,
+        payload,
+        load_model_name=None,
+        result_key=None,
+        poll_interval=1.0,
+        job_timeout=3600,
+        max_resubmits=2,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.service_url = service_url
+        self.endpoint = endpoint
+        self.payload = payload
+        self.load_model_name = load_model_name
+        self.result_key = result_key
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.max_resubmits = max_resubmits
+
+    def execute(self, context, resubmits=0):
+        payload = dict(self.payload)
+        if self.load_model_name:
+            ensure_model_loaded(self.service_url, self.load_model_name, self.task_id)
+            # Service tự load lại nếu model bị unload trước khi job chạy
+            payload["auto_load"] = True
+
+        # POST /jobs được retry khi gặp 5xx: idempotency key theo task instance để service
+        # trả về job đã nhận thay vì tạo job trùng
+        ti = context['ti']
+        idempotency_key = (
+            f"{ti.dag_id}:{ti.run_id}:{ti.task_id}:{getattr(ti, 'map_index', -1)}:{ti.try_number}:{resubmits}"
+        )
+
+        # Job chạy nền trên service vẫn thuộc trace của run (service giữ trace ID của request submit)
+        with traced(trace_id_for_run(context['dag_run'].run_id), f"{self.task_id}.submit"):
+            submitted = call_api_step(
+                self.service_url,
+                "jobs",
+                {"endpoint": self.endpoint, "payload": payload, "idempotency_key": idempotency_key},
+                f"{self.task_id}-Submit"
+            )
+        job_id = submitted["job_id"]
+        logger.info(f"[{self.task_id}] Submitted job {job_id} ({submitted.get('status')}), deferring to triggerer")
+
+        # Giải phóng worker slot, triggerer sẽ poll trạng thái job
+        self.defer(
+            trigger=OCRJobTrigger(self.service_url, job_id, poll_interval=self.poll_interval),
+            method_name="execute_complete",
+            kwargs={"resubmits": resubmits},
+            timeout=timedelta(seconds=self.job_timeout),
+        )
+
+    def execute_complete(self, context, event=None, resubmits=0):
+        """Resume trên worker khi trigger báo job đã xong (hoặc job bị mất -> submit lại)"""
+        if event and event.get("status") == "lost":
+            if resubmits >= self.max_resubmits:
+                # Lỗi tạm thời của service: để retries của task xử lý
+                raise AirflowException(f"[{self.task_id}] {event.get('error')} (after {resubmits} resubmits)")
+            logger.warning(f"[{self.task_id}] {event.get('error')}, resubmitting ({resubmits + 1}/{self.max_resubmits})")
+            return self.execute(context, resubmits=resubmits + 1)
+
+        if not event or event.get("status") != "success":
+            error = (event or {}).get("error", "Unknown error")
+            raise AirflowException(f"[{self.task_id}] Job failed: {error}")
+
+        result = event.get("result") or {}
+        logger.info(f"[{self.task_id}] Job {event.get('job_id')} finished: {result.get('message')}")
+
+        if self.result_key:
+            return result.get(self.result_key)
+        return result
@@ -0,0 +1,171 @@
+"""
+Result Index - Chỉ mục kết quả OCR theo nội dung ảnh + cấu hình model
+Dùng để bỏ qua xử lý lại ảnh trùng (cùng nội dung, khác tên file) và cho run trùng
+đang chạy song song chờ run đầu tiên thay vì xử lý lần nữa
+
+Cấu trúc trên đĩa (volume /data dùng chung):
+    {index_dir}/{key[:2]}/{key}.json   - kết quả đã xong
+    {index_dir}/{key[:2]}/{key}.lock   - run đang xử lý (chứa owner + thời điểm)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """sha256 của nội dung file (đọc theo chunk để không tốn RAM với ảnh lớn)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_result_key(image_hash, model_config):
+    """Key = hash(nội dung ảnh + cấu hình model), cấu hình khác nhau cho kết quả khác nhau"""
+    config_json = json.dumps(model_config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{image_hash}:{config_json}".encode("utf-8")).hexdigest()
+
+
+class ResultIndex:
+    """
+    Chỉ mục kết quả dạng file, an toàn khi nhiều worker dùng chung
+    (lock tạo bằng O_CREAT | O_EXCL nên chỉ 1 run giành được)
+    """
+
+    def __init__(self, index_dir="/data/result_index", lock_ttl=1800, max_age=None):
+        """
+        Args:
+            index_dir: Thư mục chứa index
+            lock_ttl: Lock cũ hơn số giây này coi như run giữ lock đã chết
+            max_age: Kết quả cũ hơn số giây này coi như chưa có (None = không hết hạn).
+                Không được dài hơn retention của artifacts mà kết quả có thể tham chiếu
+        """
+        self.index_dir = Path(index_dir)
+        self.lock_ttl = lock_ttl
+        self.max_age = max_age
+
+    def _path(self, key, suffix):
+        return self.index_dir / key[:2] / f"{key}{suffix}"
+
+    def get(self, key):
+        """Lấy kết quả đã lưu, None nếu chưa có hoặc đã quá max_age"""
+        path = self._path(key, ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        if self.max_age is not None and time.time() - record.get("created_at", 0) > self.max_age:
+            return None
+        return record
+
+    def put(self, key, result, **metadata):
+        """Lưu kết quả cuối cùng (ghi file tạm rồi rename)"""
+        path = self._path(key, ".json")
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        record = {"key": key, "result": result, "created_at": time.time(), **metadata}
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return record
+
+    def try_acquire(self, key, owner):
+        """Giành quyền xử lý key, False nếu run khác đang giữ lock còn hạn"""
+        path = self._path(key, ".lock")
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o664)
+            except FileExistsError:
+                if not self._is_stale(path) or not self._take_over_stale(path):
+                    return False
+                continue
+
+            with os.fdopen(fd, "w") as f:
+                json.dump({"owner": owner, "acquired_at": time.time()}, f)
+            return True
+
+        return False
+
+    def release(self, key, owner):
+        """Trả lock nếu đang được owner giữ"""
+        path = self._path(key, ".lock")
+        if self.lock_owner(key) == owner:
+            self._unlink(path)
+
+    def lock_owner(self, key):
+        try:
+            with open(self._path(key, ".lock"), "r", encoding="utf-8") as f:
+                return json.load(f).get("owner")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def wait_for(self, key, timeout, poll_interval=2.0):
+        """
+        Chờ run đang giữ lock ghi kết quả
+        Trả về record khi có kết quả, None khi hết timeout hoặc lock biến mất mà không có kết quả (run kia lỗi)
+        """
+        deadline = time.monotonic() + timeout
+        lock_path = self._path(key, ".lock")
+
+        while time.monotonic() < deadline:
+            record = self.get(key)
+            if record is not None:
+                return record
+            if not lock_path.exists() or self._is_stale(lock_path):
+                # Kiểm tra lần cuối vì run kia có thể vừa ghi kết quả rồi mới trả lock
+                return self.get(key)
+            time.sleep(poll_interval)
+
+        return None
+
+    def _is_stale(self, lock_path):
+        try:
+            return time.time() - lock_path.stat().st_mtime > self.lock_ttl
+        except FileNotFoundError:
+            return True
+
+    def _take_over_stale(self, path):
+        """
+        Gỡ lock quá hạn của run đã chết (worker crash), True nếu được phép thử tạo lock lại
+        Không unlink trực tiếp: 2 run cùng thấy lock quá hạn thì run chậm hơn có thể xóa nhầm
+        lock mới của run kia. os.rename sang tên riêng là atomic nên chỉ một run gỡ được,
+        và mtime giữ nguyên nên kiểm tra lại được file vừa lấy đúng là lock quá hạn
+        """
+        taken = path.with_name(f"{path.name}.{os.getpid()}.{os.urandom(4).hex()}.stale")
+        try:
+            os.rename(path, taken)
+        except FileNotFoundError:
+            # Run khác đã gỡ trước -> thử O_EXCL, ai tạo trước thì thắng
+            return True
+
+        if not self._is_stale(taken):
+            # Lấy nhầm lock mới của run khác (giữa lúc kiểm tra và rename) -> trả lại chỗ cũ
+            try:
+                os.link(taken, path)
+            except FileExistsError:
+                pass
+            self._unlink(taken)
+            return False
+
+        logger.warning(f"Removed stale lock {path}")
+        self._unlink(taken)
+        return True
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,69 @@
+"""
+Triggers - Poll trạng thái job của Flask services bất đồng bộ trong airflow-triggerer
+Task đã defer không chiếm worker slot trong lúc chờ model chạy
+"""
+
+import asyncio
+import logging
+
+import httpx
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+
+logger = logging.getLogger(__name__)
+
+
+class OCRJobTrigger(BaseTrigger):
+    """
+    Poll GET {service_url}/jobs/{job_id} đến khi job xong
+    Khoảng cách poll tăng dần từ poll_interval đến max_poll_interval
+    """
+
+    def __init__(self, service_url, job_id, poll_interval=1.0, max_poll_interval=15.0):
+        super().__init__()
+        self.service_url = service_url
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def serialize(self):
+        return (
+            "src.pipeline.triggers.OCRJobTrigger",
+            {
+                "service_url": self.service_url,
+                "job_id": self.job_id,
+                "poll_interval": self.poll_interval,
+                "max_poll_interval": self.max_poll_interval,
+            },
+        )
+
+    async def run(self):
+        url = f"{self.service_url}/jobs/{self.job_id}"
+        interval = self.poll_interval
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            while True:
+                try:
+                    response = await client.get(url)
+                except httpx.HTTPError as e:
+                    # Service tạm thời không phản hồi - thử lại ở lần poll sau
+                    logger.warning(f"Polling {url} failed: {str(e)}")
+                else:
+                    if response.status_code == 404:
+                        # Job chỉ nằm trong RAM: service đã restart hoặc job đã hết hạn -> operator submit lại
+                        yield TriggerEvent({
+                            "status": "lost",
+                            "job_id": self.job_id,
+                            "error": f"Job {self.job_id} not found on {self.service_url}"
+                        })
+                        return
+
+                    if response.status_code == 200:
+                        job = response.json()
+                        if job.get("status") in ("success", "error"):
+                            yield TriggerEvent(job)
+                            return
+                    else:
+                        logger.warning(f"Polling {url} returned HTTP {response.status_code}")
+
+                await asyncio.sleep(interval)
+                interval = min(interval * 1.5, self.max_poll_interval)
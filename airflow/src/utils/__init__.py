@@ -0,0 +1 @@
+# chứa các tiện ích dùng chung giữa Airflow DAG và các API services
\ No newline at end of file
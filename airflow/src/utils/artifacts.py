@@ -0,0 +1,148 @@
+"""
+Artifact Store - Lưu kết quả trung gian (detection, recognition) ra file nén
+Địa chỉ theo nội dung (sha256), XCom và request giữa các bước chỉ mang reference nhỏ:
+    "artifact://sha256/<hex>"
+DAG và các services đều mount chung /data nên đọc/ghi trực tiếp được
+"""
+
+import gzip
+import json
+import hashlib
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+from src.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Thư mục lưu artifacts (trên volume /data dùng chung)
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "/data/artifacts")
+ARTIFACT_PREFIX = "artifact://sha256/"
+COMPRESS_LEVEL = 6
+
+_REF_PATTERN = re.compile(r"^artifact://sha256/([0-9a-f]{64})$")
+
+
+def is_artifact_ref(value):
+    """Kiểm tra value có phải artifact reference không"""
+    return isinstance(value, str) and _REF_PATTERN.match(value) is not None
+
+
+def _artifact_path(digest, artifact_dir=None):
+    """Đường dẫn file theo digest, chia thư mục con theo 2 ký tự đầu"""
+    return Path(artifact_dir or ARTIFACT_DIR) / digest[:2] / f"{digest}.json.gz"
+
+
+def _ensure_dir(path):
+    """Tạo thư mục, cho phép group ghi (services chạy root, Airflow chạy uid khác cùng group 0)"""
+    path.mkdir(parents=True, exist_ok=True)
+    try:
+        os.chmod(path, 0o775)
+    except OSError:
+        pass
+
+
+def put_artifact(obj, artifact_dir=None):
+    """
+    Ghi object (JSON-serializable) ra artifact store
+
+    Args:
+        obj: Dữ liệu cần lưu (dict/list)
+        artifact_dir: Thư mục store (mặc định ARTIFACT_DIR)
+
+    Returns:
+        str: Reference dạng "artifact://sha256/<hex>"
+    """
+    with span("serialize") as serialize_span:
+        payload = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(payload).hexdigest()
+        path = _artifact_path(digest, artifact_dir)
+        serialize_span.set(raw_bytes=len(payload))
+
+        if path.exists():
+            # Nội dung giống hệt đã có - chỉ cập nhật mtime để không bị GC xóa
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        else:
+            _ensure_dir(path.parent)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(gzip.compress(payload, compresslevel=COMPRESS_LEVEL, mtime=0))
+            os.chmod(tmp_path, 0o664)
+            os.replace(tmp_path, path)
+
+    ref = f"{ARTIFACT_PREFIX}{digest}"
+    logger.info(f"Stored artifact {ref} ({len(payload)} bytes raw)")
+    return ref
+
+
+def get_artifact(ref, artifact_dir=None):
+    """Đọc object từ artifact reference"""
+    match = _REF_PATTERN.match(ref) if isinstance(ref, str) else None
+    if match is None:
+        raise ValueError(f"Invalid artifact reference: {ref}")
+
+    path = _artifact_path(match.group(1), artifact_dir)
+    if not path.exists():
+        raise FileNotFoundError(f"Artifact not found: {ref}")
+
+    with span("deserialize"):
+        with open(path, "rb") as f:
+            return json.loads(gzip.decompress(f.read()).decode("utf-8"))
+
+
+def resolve_artifact(value, artifact_dir=None):
+    """Nếu value là artifact reference thì đọc nội dung, ngược lại trả về nguyên giá trị"""
+    if is_artifact_ref(value):
+        return get_artifact(value, artifact_dir)
+    return value
+
+
+def missing_artifacts(value, artifact_dir=None):
+    """Các artifact reference nằm trong value (dict/list lồng nhau) mà file đã bị GC xóa"""
+    if is_artifact_ref(value):
+        digest = _REF_PATTERN.match(value).group(1)
+        return [] if _artifact_path(digest, artifact_dir).exists() else [value]
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, list):
+        return []
+    return [ref for item in value for ref in missing_artifacts(item, artifact_dir)]
+
+
+def gc_artifacts(max_age_hours, artifact_dir=None, pattern="*/*.json.gz"):
+    """
+    Xóa các artifacts không được ghi lại trong max_age_hours giờ
+    pattern cho phép dùng lại cho các thư mục file trung gian khác (vd: ảnh đã tiền xử lý)
+
+    Returns:
+        dict: {"deleted": số file đã xóa, "freed_bytes": dung lượng giải phóng, "kept": số file giữ lại}
+    """
+    root = Path(artifact_dir or ARTIFACT_DIR)
+    stats = {"deleted": 0, "freed_bytes": 0, "kept": 0}
+    if not root.exists():
+        return stats
+
+    cutoff = time.time() - max_age_hours * 3600
+    for path in root.glob(pattern):
+        try:
+            st = path.stat()
+            if st.st_mtime < cutoff:
+                path.unlink()
+                stats["deleted"] += 1
+                stats["freed_bytes"] += st.st_size
+            else:
+                stats["kept"] += 1
+        except FileNotFoundError:
+            # Process khác vừa xóa
+            continue
+        except OSError as e:
+            logger.warning(f"Không thể xóa artifact {path}: {str(e)}")
+
+    logger.info(f"Artifact GC: {stats}")
+    return stats
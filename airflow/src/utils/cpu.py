@@ -0,0 +1,12 @@
+"""
+CPU - Số core mà process service được phép dùng (chia thread cho torch / OpenCV)
+"""
+
+import os
+
+
+def available_cpus():
+    """Số CPU process được phép chạy (theo cgroup/affinity của container, không phải của cả máy)"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
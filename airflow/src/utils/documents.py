@@ -0,0 +1,133 @@
+"""
+Documents - Đọc tài liệu nhiều trang (PDF, TIFF) theo từng trang
+Trang được decode lazily qua generator; prefetch chạy trên 1 thread riêng với hàng đợi
+giới hạn nên tối đa chỉ có max_pages trang đã decode nằm trong RAM cùng lúc
+"""
+
+import os
+import queue
+import threading
+import logging
+
+import numpy as np
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:  # Pillow cần cho TIFF nhiều trang
+    Image = ImageSequence = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # pypdfium2 cần cho PDF
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+MULTIPAGE_EXTENSIONS = (".pdf", ".tif", ".tiff")
+DEFAULT_PDF_DPI = 200
+DEFAULT_MAX_PAGES_IN_FLIGHT = int(os.environ.get("OCR_MAX_PAGES_IN_FLIGHT", "2"))
+
+_END = object()
+
+
+def is_multipage_document(path):
+    """Tài liệu có thể nhiều trang (PDF/TIFF), cần đi qua endpoint *_document"""
+    return str(path).lower().endswith(MULTIPAGE_EXTENSIONS)
+
+
+def _to_bgr(pil_image):
+    """PIL image -> numpy BGR (định dạng cv2/các model đang dùng)"""
+    rgb = np.asarray(pil_image.convert("RGB"))
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+
+def _iter_pdf_pages(path, dpi):
+    if pdfium is None:
+        raise RuntimeError("pypdfium2 is required to read PDF documents")
+
+    pdf = pdfium.PdfDocument(str(path))
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            try:
+                bitmap = page.render(scale=dpi / 72)
+                yield index, _to_bgr(bitmap.to_pil())
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+
+def _iter_tiff_pages(path):
+    if Image is None:
+        raise RuntimeError("Pillow is required to read TIFF documents")
+
+    # ImageSequence chỉ decode frame khi được duyệt tới
+    with Image.open(str(path)) as tiff:
+        for index, frame in enumerate(ImageSequence.Iterator(tiff)):
+            yield index, _to_bgr(frame)
+
+
+def iter_pages(path, dpi=DEFAULT_PDF_DPI):
+    """
+    Generator (page_index, image BGR) - mỗi lần chỉ decode 1 trang
+
+    Args:
+        path: Đường dẫn PDF/TIFF
+        dpi: Độ phân giải render trang PDF
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Document not found: {path}")
+
+    if str(path).lower().endswith(".pdf"):
+        yield from _iter_pdf_pages(path, dpi)
+    else:
+        yield from _iter_tiff_pages(path)
+
+
+def iter_pages_prefetch(path, max_pages=DEFAULT_MAX_PAGES_IN_FLIGHT, dpi=DEFAULT_PDF_DPI):
+    """
+    Như iter_pages nhưng decode trang kế tiếp song song với việc xử lý trang hiện tại
+    Semaphore giữ tổng số trang đã decode (đang chờ + đang xử lý) <= max_pages:
+    thread decode phải lấy 1 slot trước khi decode, slot được trả khi consumer xử lý xong trang
+
+    Yields:
+        tuple: (page_index, image BGR)
+    """
+    slots = threading.Semaphore(max(1, int(max_pages)))
+    pages = queue.Queue()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            page_iter = iter_pages(path, dpi=dpi)
+            while True:
+                # Chờ slot, không block mãi nếu consumer đã dừng (client ngắt stream)
+                while not slots.acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                page = next(page_iter, _END)
+                pages.put(page)
+                if page is _END:
+                    return
+        except Exception as e:
+            pages.put(e)
+
+    producer = threading.Thread(target=produce, name="page-decoder", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = pages.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            # Consumer đã xử lý xong trang này -> trả slot cho trang kế tiếp
+            del item
+            slots.release()
+    finally:
+        stop.set()
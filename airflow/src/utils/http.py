@@ -0,0 +1,122 @@
+"""
+HTTP helpers cho Flask services
+"""
+
+import io
+import os
+import json
+import zlib
+import contextvars
+
+from flask import Response, stream_with_context, request, g
+
+from src.utils import tracing
+
+# Kích thước tối đa của body sau khi giải nén (bytes): chặn gzip bomb (vài KB nén -> vài GB)
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("OCR_MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+
+
+class GzipRequestMiddleware:
+    """
+    WSGI middleware giải nén body request có header "Content-Encoding: gzip"
+    (client trong Airflow nén payload lớn để giảm băng thông giữa worker và services)
+    Giải nén có giới hạn: body vượt max_bytes (trước hoặc sau khi giải nén) trả 413, gzip hỏng trả 400
+    """
+
+    def __init__(self, wsgi_app, max_bytes=MAX_DECOMPRESSED_BYTES):
+        self.wsgi_app = wsgi_app
+        self.max_bytes = max_bytes
+
+    def __call__(self, environ, start_response):
+        if environ.get("HTTP_CONTENT_ENCODING", "").lower() == "gzip":
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            if length > self.max_bytes:
+                return self._error(start_response, 413, f"Request body exceeds {self.max_bytes} bytes")
+
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                # Giải nén tối đa max_bytes + 1: còn dữ liệu chưa giải nén nghĩa là vượt giới hạn
+                body = decompressor.decompress(environ["wsgi.input"].read(length), self.max_bytes + 1)
+            except zlib.error as e:
+                return self._error(start_response, 400, f"Invalid gzip body: {str(e)}")
+            if len(body) > self.max_bytes or decompressor.unconsumed_tail:
+                return self._error(start_response, 413, f"Decompressed body exceeds {self.max_bytes} bytes")
+            if not decompressor.eof:
+                return self._error(start_response, 400, "Invalid gzip body: truncated stream")
+
+            environ["wsgi.input"] = io.BytesIO(body)
+            environ["CONTENT_LENGTH"] = str(len(body))
+            del environ["HTTP_CONTENT_ENCODING"]
+
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def _error(start_response, status_code, message):
+        """Response lỗi {"error": ...} giống các endpoint (middleware chạy ngoài Flask)"""
+        body = json.dumps({"error": message}).encode("utf-8")
+        status = "413 Request Entity Too Large" if status_code == 413 else "400 Bad Request"
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+        return [body]
+
+
+def enable_gzip_requests(app, max_bytes=None):
+    """Cho phép Flask app nhận request body nén gzip (giới hạn theo MAX_CONTENT_LENGTH của app nếu có)"""
+    max_bytes = max_bytes or app.config.get("MAX_CONTENT_LENGTH") or MAX_DECOMPRESSED_BYTES
+    app.wsgi_app = GzipRequestMiddleware(app.wsgi_app, max_bytes=max_bytes)
+    return app
+
+
+def enable_tracing(app, service_name):
+    """
+    Request có header X-Trace-Id (gửi từ Airflow task) chạy trong trace đó:
+    ghi 1 span "server" cho request, các span stage bên trong là con của nó, trace ID trả lại trong response
+    Request không có header (health, poll job, gọi tay, load test) không bị trace
+    """
+    tracing.set_service_name(service_name)
+    tracing.install_log_filter()
+
+    @app.before_request
+    def _start_request_trace():
+        trace_id = request.headers.get(tracing.TRACE_HEADER)
+        if not trace_id:
+            return
+        g.trace_token = tracing.activate(
+            trace_id, service=service_name, parent_span_id=request.headers.get(tracing.PARENT_SPAN_HEADER)
+        )
+        g.trace_span = tracing.span(request.path.lstrip("/"), kind="server").start()
+
+    @app.after_request
+    def _return_trace_id(response):
+        trace_id = tracing.get_trace_id()
+        if trace_id and "trace_token" in g:
+            response.headers[tracing.TRACE_HEADER] = trace_id
+            g.trace_span.set(status_code=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _end_request_trace(exc):
+        if "trace_token" in g:
+            g.trace_span.finish(error=exc)
+            tracing.deactivate(g.pop("trace_token"))
+
+    return app
+
+
+def ndjson_response(records):
+    """
+    Stream 1 generator các dict thành response NDJSON (mỗi dòng 1 JSON)
+    Client nhận được từng kết quả ngay khi xong, không chờ cả tài liệu
+    """
+    # Generator chạy sau khi view đã return: giữ lại trace của request cho các span từng trang
+    context = contextvars.copy_context()
+
+    def generate():
+        iterator = iter(records)
+        while True:
+            try:
+                record = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
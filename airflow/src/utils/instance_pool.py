@@ -0,0 +1,120 @@
+"""
+Instance Pool - N bản của 1 đối tượng không thread-safe (vd cv2.dnn.Net: setInput + forward có state)
+Mỗi request mượn 1 bản trong thời gian xử lý (chờ tối đa timeout), trả lại khi xong
+-> nhiều Flask thread chạy forward song song trên nhiều core mà không dùng chung 1 network
+"""
+
+import time
+import queue
+import threading
+import logging
+from contextlib import contextmanager
+
+from flask import jsonify
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(Exception):
+    """Hết thời gian chờ mà không có instance rảnh (service trả 503 để client retry)"""
+
+
+class InstancePool:
+    """Pool cố định các instance dùng chung + số liệu sử dụng (chờ bao lâu, bận bao nhiêu %)"""
+
+    def __init__(self, instances, timeout=30.0, name="pool"):
+        if not instances:
+            raise ValueError("InstancePool needs at least 1 instance")
+        self.name = name
+        self.size = len(instances)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # LIFO: instance vừa dùng còn nóng cache
+        for instance in instances:
+            self._idle.put(instance)
+
+        self._lock = threading.Lock()
+        self._created_at = time.perf_counter()
+        self._in_use = 0
+        self._busy_since = {}  # id(instance) -> thời điểm checkout
+        self._stats = {
+            "checkouts": 0, "waited": 0, "timeouts": 0, "peak_in_use": 0,
+            "wait_ms_total": 0.0, "wait_ms_max": 0.0, "busy_s": 0.0
+        }
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """
+        Mượn 1 instance trong khối with
+
+        Raises:
+            PoolExhausted: Không có instance rảnh sau timeout giây
+        """
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        try:
+            instance = self._idle.get_nowait()
+            waited = False
+        except queue.Empty:
+            waited = True
+            try:
+                instance = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise PoolExhausted(f"No free instance in {self.name} after {timeout}s (size={self.size})")
+
+        acquired = time.perf_counter()
+        wait_ms = (acquired - start) * 1000
+        with self._lock:
+            self._in_use += 1
+            self._busy_since[id(instance)] = acquired
+            stats = self._stats
+            stats["checkouts"] += 1
+            stats["waited"] += int(waited)
+            stats["wait_ms_total"] += wait_ms
+            stats["wait_ms_max"] = max(stats["wait_ms_max"], wait_ms)
+            stats["peak_in_use"] = max(stats["peak_in_use"], self._in_use)
+
+        try:
+            yield instance
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._stats["busy_s"] += time.perf_counter() - self._busy_since.pop(id(instance))
+            self._idle.put(instance)
+
+    def stats(self):
+        """
+        Returns:
+            dict: size, in_use, checkouts, waited, timeouts, wait_ms_mean/max, peak_in_use,
+                utilization (thời gian bận / (size × thời gian tồn tại) của pool)
+        """
+        now = time.perf_counter()
+        with self._lock:
+            stats = dict(self._stats)
+            in_use = self._in_use
+            busy_s = stats.pop("busy_s") + sum(now - since for since in self._busy_since.values())
+        elapsed = now - self._created_at
+        checkouts = stats["checkouts"]
+        return {
+            "size": self.size,
+            "in_use": in_use,
+            "checkouts": checkouts,
+            "waited": stats["waited"],
+            "timeouts": stats["timeouts"],
+            "peak_in_use": stats["peak_in_use"],
+            "wait_ms_mean": round(stats["wait_ms_total"] / checkouts, 2) if checkouts else 0.0,
+            "wait_ms_max": round(stats["wait_ms_max"], 2),
+            "utilization": round(busy_s / (self.size * elapsed), 3) if elapsed > 0 else 0.0
+        }
+
+
+def register_pool_routes(app, active_models, models_lock):
+    """GET /pools: số liệu pool của các model có pool_stats() (vd SSD detector)"""
+
+    @app.route('/pools', methods=['GET'])
+    def pool_stats():
+        with models_lock:
+            instances = {name: info.get("instance") for name, info in active_models.items()}
+        pools = {name: instance.pool_stats() for name, instance in instances.items() if hasattr(instance, "pool_stats")}
+        return jsonify({name: stats for name, stats in pools.items() if stats is not None})
@@ -0,0 +1,137 @@
+"""
+Job Manager - Chạy request nặng ở background để client không phải giữ kết nối
+Dùng cho operator deferrable của Airflow: submit job -> triggerer poll trạng thái -> lấy kết quả
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+# Số job chạy song song trong 1 service
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Thời gian giữ kết quả job đã xong trong RAM (giây)
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", "3600"))
+
+
+class JobManager:
+    """
+    Hàng đợi job trong RAM của 1 service
+    Mỗi job gọi 1 handler(payload) -> (body, status_code), giống response của endpoint đồng bộ
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.idempotency_keys = {}  # {idempotency_key: job_id}
+        self.lock = threading.Lock()
+
+    def submit(self, endpoint, handler, payload, idempotency_key=None):
+        """
+        Đưa job vào hàng đợi
+        Cùng idempotency_key (client retry POST sau khi job đã được nhận) trả về job cũ thay vì chạy lại
+
+        Returns:
+            tuple: (job_id, created) - created=False khi trùng idempotency_key
+        """
+        self._evict_expired()
+
+        with self.lock:
+            existing = self.idempotency_keys.get(idempotency_key) if idempotency_key else None
+            if existing is not None:
+                logger.info(f"Job {existing} already submitted with key {idempotency_key}")
+                return existing, False
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "job_id": job_id,
+                "endpoint": endpoint,
+                "status": "queued",
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "idempotency_key": idempotency_key
+            }
+            if idempotency_key:
+                self.idempotency_keys[idempotency_key] = job_id
+
+        # Job chạy trên thread khác: mang theo context (trace ID) của request submit
+        self.executor.submit(contextvars.copy_context().run, self._run, job_id, handler, payload)
+        logger.info(f"Submitted job {job_id} ({endpoint})")
+        return job_id, True
+
+    def _run(self, job_id, handler, payload):
+        with self.lock:
+            self.jobs[job_id]["status"] = "running"
+
+        try:
+            body, status_code = handler(payload)
+            update = {"status": "success" if status_code == 200 else "error", "result": body}
+            if status_code != 200:
+                update["error"] = body.get("error")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            update = {"status": "error", "error": str(e)}
+
+        with self.lock:
+            self.jobs[job_id].update(update, finished_at=time.time())
+
+    def get(self, job_id):
+        """Lấy trạng thái job (None nếu không tồn tại hoặc đã hết hạn)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _evict_expired(self):
+        """Xóa kết quả các job đã xong quá result_ttl giây"""
+        cutoff = time.time() - self.result_ttl
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job["finished_at"] and job["finished_at"] < cutoff]
+            for job_id in expired:
+                self.idempotency_keys.pop(self.jobs.pop(job_id).get("idempotency_key"), None)
+
+
+def register_job_routes(app, handlers, job_manager=None):
+    """
+    Thêm 2 endpoint cho Flask app:
+        POST /jobs            {"endpoint": "process", "payload": {...}, "idempotency_key": "..."} -> {"job_id": ...}
+        GET  /jobs/<job_id>   -> {"status": "queued|running|success|error", "result": {...}}
+
+    Args:
+        app: Flask app
+        handlers: dict {endpoint: handler(payload) -> (body, status_code)}
+        job_manager: JobManager (mặc định tạo mới)
+    """
+    job_manager = job_manager or JobManager()
+
+    @app.route('/jobs', methods=['POST'])
+    def submit_job():
+        """Submit request nặng chạy nền, trả về job_id ngay lập tức"""
+        data = request.json or {}
+        endpoint = data.get('endpoint')
+
+        if endpoint not in handlers:
+            return jsonify({"error": f"Unsupported job endpoint: {endpoint}. Supported: {sorted(handlers)}"}), 400
+
+        job_id, created = job_manager.submit(
+            endpoint, handlers[endpoint], data.get('payload') or {}, idempotency_key=data.get('idempotency_key')
+        )
+        return jsonify({"status": "submitted" if created else "duplicate", "job_id": job_id}), 202
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Trả về trạng thái và kết quả (nếu đã xong) của job"""
+        job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({"error": f"Job {job_id} not found"}), 404
+        return jsonify(job)
+
+    return job_manager
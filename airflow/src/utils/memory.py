@@ -0,0 +1,275 @@
+"""
+Memory - Đo bộ nhớ (RSS) của process service
+Dùng để báo cáo mỗi model chiếm bao nhiêu RAM khi load, bao nhiêu được trả lại khi unload,
+và (khi bật tracemalloc) vị trí code cấp phát nhiều nhất giữa 2 thời điểm
+"""
+
+import gc
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import resource
+import threading
+import tracemalloc
+import logging
+from collections import OrderedDict, deque
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Bật tracemalloc ngay khi import với số frame của traceback, vd OCR_TRACEMALLOC=5 (0 = tắt, bật sau qua API)
+TRACEMALLOC_FRAMES = int(os.environ.get("OCR_TRACEMALLOC", "0"))
+# Số snapshot tracemalloc giữ trong RAM (mỗi snapshot có thể vài chục MB)
+MAX_SNAPSHOTS = int(os.environ.get("OCR_TRACEMALLOC_MAX_SNAPSHOTS", "8"))
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+except OSError:
+    _libc = None
+
+
+def get_rss_mb():
+    """
+    RSS hiện tại của process (MB)
+    Đọc /proc/self/statm (Linux, rẻ); nơi khác dùng peak RSS của getrusage
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss tính bằng KB trên Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def trim_native_heap():
+    """
+    malloc_trim(0) của glibc: trả các vùng heap đã free về OS
+    free() của glibc giữ lại bộ nhớ trong arena nên RSS không giảm sau khi unload model (OpenCV/torch cấp phát qua malloc)
+    """
+    if _libc is None or not hasattr(_libc, "malloc_trim"):
+        return False
+    return bool(_libc.malloc_trim(0))
+
+
+def release_memory():
+    """
+    Gọi sau khi bỏ tham chiếu tới model: gc + xả cache allocator CUDA của torch + malloc_trim
+    torch chỉ được xử lý nếu đã import (không import torch chỉ để dọn dẹp)
+    """
+    collected = gc.collect()
+
+    torch = sys.modules.get("torch")
+    cuda_emptied = False
+    if torch is not None:
+        try:
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+                cuda_emptied = True
+        except Exception as e:
+            logger.warning(f"torch.cuda.empty_cache failed: {str(e)}")
+
+    return {"gc_collected": collected, "cuda_empty_cache": cuda_emptied, "malloc_trim": trim_native_heap()}
+
+
+class MemoryLedger:
+    """
+    RSS theo từng model qua các chu kỳ load/unload
+    residual_mb = RSS sau unload - RSS trước load của cùng chu kỳ (RAM không được trả lại)
+    """
+
+    def __init__(self, max_events=200):
+        self.events = deque(maxlen=max_events)
+        self._models = {}  # name -> thống kê tích lũy
+        self._lock = threading.Lock()
+
+    def _stats(self, model_name):
+        """Thống kê tích lũy của 1 model (gọi khi đang giữ lock)"""
+        return self._models.setdefault(model_name, {
+            "loads": 0, "unloads": 0, "last_load_rss_mb": None, "last_residual_mb": None, "total_residual_mb": 0.0
+        })
+
+    def record_load(self, model_name, rss_before, rss_after):
+        with self._lock:
+            stats = self._stats(model_name)
+            stats["loads"] += 1
+            stats["last_load_rss_mb"] = round(rss_after - rss_before, 1)
+            stats["_rss_before_load"] = rss_before
+            self.events.append({"time": time.time(), "model": model_name, "event": "load",
+                                "rss_delta_mb": stats["last_load_rss_mb"], "rss_mb": round(rss_after, 1)})
+
+    def record_unload(self, model_name, rss_before, rss_after):
+        """Trả về {"unload_rss_mb", "residual_mb"} của lần unload này"""
+        with self._lock:
+            stats = self._stats(model_name)
+            stats["unloads"] += 1
+            result = {"unload_rss_mb": round(rss_after - rss_before, 1), "residual_mb": None}
+
+            rss_before_load = stats.pop("_rss_before_load", None)
+            if rss_before_load is not None:
+                result["residual_mb"] = round(rss_after - rss_before_load, 1)
+                stats["last_residual_mb"] = result["residual_mb"]
+                stats["total_residual_mb"] = round(stats["total_residual_mb"] + result["residual_mb"], 1)
+
+            self.events.append({"time": time.time(), "model": model_name, "event": "unload",
+                                "rss_delta_mb": result["unload_rss_mb"], "residual_mb": result["residual_mb"],
+                                "rss_mb": round(rss_after, 1)})
+            return result
+
+    def describe(self):
+        with self._lock:
+            return {
+                name: {key: value for key, value in stats.items() if not key.startswith("_")}
+                for name, stats in self._models.items()
+            }
+
+
+class AllocationTracker:
+    """
+    Snapshot tracemalloc theo label và diff top vị trí cấp phát giữa 2 snapshot
+    Chỉ thấy cấp phát qua Python allocator (gồm numpy); cấp phát native của OpenCV/torch chỉ thấy qua RSS
+    """
+
+    # Bỏ các frame của chính tracemalloc/importlib khỏi thống kê
+    _FILTERS = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    )
+
+    def __init__(self, max_snapshots=MAX_SNAPSHOTS):
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()  # label -> (snapshot, info)
+        self._lock = threading.Lock()
+
+    def start(self, nframes=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(nframes)
+            logger.info(f"tracemalloc started ({nframes} frames)")
+
+    def stop(self):
+        """Tắt tracemalloc (hết overhead) và bỏ các snapshot"""
+        with self._lock:
+            self._snapshots.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc stopped")
+
+    def snapshot(self, label=None):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running. Start it first")
+
+        label = label or f"snap-{int(time.time() * 1000)}"
+        snap = tracemalloc.take_snapshot().filter_traces(self._FILTERS)
+        current, peak = tracemalloc.get_traced_memory()
+        info = {
+            "label": label,
+            "time": time.time(),
+            "traced_mb": round(current / (1024 * 1024), 2),
+            "traced_peak_mb": round(peak / (1024 * 1024), 2),
+            "rss_mb": round(get_rss_mb(), 1)
+        }
+
+        with self._lock:
+            self._snapshots[label] = (snap, info)
+            self._snapshots.move_to_end(label)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return info
+
+    def diff(self, from_label, to_label, top=20, key_type="lineno"):
+        """Top vị trí có dung lượng cấp phát tăng nhiều nhất từ from_label tới to_label"""
+        with self._lock:
+            if from_label not in self._snapshots or to_label not in self._snapshots:
+                missing = [label for label in (from_label, to_label) if label not in self._snapshots]
+                raise KeyError(f"Snapshot not found: {', '.join(missing)}")
+            old, old_info = self._snapshots[from_label]
+            new, new_info = self._snapshots[to_label]
+
+        stats = new.compare_to(old, key_type)
+        return {
+            "from": old_info,
+            "to": new_info,
+            "traced_diff_mb": round(new_info["traced_mb"] - old_info["traced_mb"], 2),
+            "rss_diff_mb": round(new_info["rss_mb"] - old_info["rss_mb"], 1),
+            "top": [
+                {
+                    "location": str(stat.traceback),
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count_diff": stat.count_diff
+                }
+                for stat in stats[:top]
+            ]
+        }
+
+    def describe(self):
+        with self._lock:
+            snapshots = [info for _, info in self._snapshots.values()]
+        described = {"tracing": tracemalloc.is_tracing(), "snapshots": snapshots}
+        if described["tracing"]:
+            current, peak = tracemalloc.get_traced_memory()
+            described.update(traced_mb=round(current / (1024 * 1024), 2), traced_peak_mb=round(peak / (1024 * 1024), 2))
+        return described
+
+
+def register_memory_routes(app, service_name, ledger, tracker=None):
+    """
+    Thêm các endpoint theo dõi bộ nhớ:
+        GET  /memory                                    RSS + thống kê load/unload theo model + trạng thái tracemalloc
+        POST /memory/tracemalloc   {"enabled", "nframes"}  bật/tắt tracemalloc
+        POST /memory/snapshot      {"label"}             chụp snapshot tracemalloc
+        GET  /memory/diff?from=&to=&top=&key_type=       top vị trí cấp phát tăng giữa 2 snapshot
+    """
+    tracker = tracker or AllocationTracker()
+    if TRACEMALLOC_FRAMES > 0:
+        tracker.start(TRACEMALLOC_FRAMES)
+
+    @app.route('/memory', methods=['GET'])
+    def memory_state():
+        return jsonify({
+            "service": service_name,
+            "rss_mb": round(get_rss_mb(), 1),
+            "models": ledger.describe(),
+            "events": list(ledger.events)[-20:],
+            "tracemalloc": tracker.describe()
+        })
+
+    @app.route('/memory/tracemalloc', methods=['POST'])
+    def memory_tracemalloc():
+        data = request.json or {}
+        if data.get('enabled', True):
+            tracker.start(int(data.get('nframes', 1)))
+        else:
+            tracker.stop()
+        return jsonify(tracker.describe())
+
+    @app.route('/memory/snapshot', methods=['POST'])
+    def memory_snapshot():
+        data = request.json or {}
+        try:
+            return jsonify(tracker.snapshot(data.get('label')))
+        except RuntimeError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route('/memory/diff', methods=['GET'])
+    def memory_diff():
+        from_label, to_label = request.args.get('from'), request.args.get('to')
+        if not from_label or not to_label:
+            return jsonify({"error": "Missing from/to parameter"}), 400
+
+        key_type = request.args.get('key_type', 'lineno')
+        if key_type not in ("lineno", "filename", "traceback"):
+            return jsonify({"error": f"Unsupported key_type: {key_type}"}), 400
+
+        try:
+            return jsonify(tracker.diff(from_label, to_label, top=int(request.args.get('top', 20)), key_type=key_type))
+        except KeyError as e:
+            return jsonify({"error": str(e.args[0])}), 404
+
+    return tracker
@@ -0,0 +1,101 @@
+"""
+Model Cache - Cache artifacts của model ở mức process, tồn tại qua các lần /unload_model
+- Weights (.pb, .pbtxt, .caffemodel...) được memory-map 1 lần, load lại thì build network từ buffer
+- Object khó build lại từ buffer (vd: easyocr.Reader) được "park" khi unload và lấy lại khi load
+"""
+
+import os
+import mmap
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Tắt cache (mỗi lần load đọc lại từ disk như trước) bằng OCR_MODEL_CACHE=0
+CACHE_ENABLED = os.environ.get("OCR_MODEL_CACHE", "1") != "0"
+# Số object tối đa được park (mỗi object có thể chiếm hàng trăm MB RAM)
+MAX_PARKED = int(os.environ.get("OCR_MODEL_PARK_MAX", "2"))
+
+
+class ModelArtifactCache:
+    """Cache thread-safe cho weight buffers (mmap) và model objects đã unload"""
+
+    def __init__(self, max_parked=MAX_PARKED):
+        self.max_parked = max_parked
+        self._buffers = {}  # path -> (mtime, size, mmap, np buffer)
+        self._parked = OrderedDict()  # key -> object, LRU
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_buffer(self, path):
+        """
+        Buffer uint8 read-only của file weights (memory-mapped)
+        Map lại nếu file trên disk đã đổi (mtime/size khác)
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+
+        with self._lock:
+            entry = self._buffers.get(path)
+            if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+                self.hits += 1
+                return entry[3]
+
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = np.frombuffer(mapped, dtype=np.uint8)
+            self._buffers[path] = (stat.st_mtime, stat.st_size, mapped, buffer)
+            self.misses += 1
+            return buffer
+
+    def evict_buffer(self, path):
+        """Bỏ buffer khỏi cache (mmap được đóng khi không còn network nào tham chiếu)"""
+        with self._lock:
+            self._buffers.pop(os.path.abspath(path), None)
+
+    def park(self, key, obj):
+        """Giữ lại object đã unload, bỏ object cũ nhất nếu vượt max_parked"""
+        if self.max_parked <= 0:
+            return False
+        with self._lock:
+            self._parked[key] = obj
+            self._parked.move_to_end(key)
+            while len(self._parked) > self.max_parked:
+                evicted, _ = self._parked.popitem(last=False)
+                logger.info(f"Model cache: evicted parked {evicted}")
+        return True
+
+    def take(self, key):
+        """Lấy object đã park ra (không còn nằm trong cache), None nếu không có"""
+        with self._lock:
+            obj = self._parked.pop(key, None)
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return obj
+
+    def purge(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._buffers.clear()
+            self._parked.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": CACHE_ENABLED,
+                "buffers": len(self._buffers),
+                "buffer_mb": round(sum(entry[1] for entry in self._buffers.values()) / (1024 * 1024), 1),
+                "parked": [str(key) for key in self._parked],
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Cache dùng chung cho cả process service
+model_cache = ModelArtifactCache() if CACHE_ENABLED else None
@@ -0,0 +1,79 @@
+"""
+Model State - Version/ETag cho trạng thái models đang load trong 1 service
+Airflow dùng để cache "model đã sẵn sàng" mà không phải gọi /load_model mỗi lần
+"""
+
+import os
+import threading
+
+from flask import request, jsonify
+
+from src.utils.memory import get_rss_mb
+
+
+class ModelStateVersion:
+    """
+    Bộ đếm tăng mỗi khi có model được load/unload
+    Version gửi cho client kèm boot_id ngẫu nhiên của process: sau khi service restart, bộ đếm về 0
+    nhưng ETag cũ không còn khớp (tránh 304 sai cho 1 tập model khác)
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.boot_id = os.urandom(4).hex()
+        self._lock = threading.Lock()
+
+    def bump(self):
+        with self._lock:
+            self.value += 1
+            return self.value
+
+    @property
+    def token(self):
+        """Version dạng "<boot_id>-<bộ đếm>" (ETag, field version, header X-Model-State-Version)"""
+        return f"{self.boot_id}-{self.value}"
+
+    @property
+    def etag(self):
+        return f'"{self.token}"'
+
+
+def describe_models(active_models):
+    """Thông tin gọn của các models đang load (bỏ instance)"""
+    return {
+        name: {key: value for key, value in info.items() if key != "instance"}
+        for name, info in active_models.items()
+    }
+
+
+def register_model_state_routes(app, service_name, active_models, models_lock, state_version):
+    """
+    Thêm endpoint GET /model_state (hỗ trợ If-None-Match -> 304) và header
+    X-Model-State-Version vào mọi response để client cập nhật cache readiness
+    """
+
+    @app.route('/model_state', methods=['GET'])
+    def model_state():
+        """Trạng thái models đang load, rẻ để gọi (ETag theo version)"""
+        token = state_version.token
+        if request.if_none_match.contains(token):
+            response = app.response_class(status=304)
+            response.set_etag(token)
+            return response
+
+        with models_lock:
+            models = describe_models(active_models)
+
+        response = jsonify({
+            "service": service_name,
+            "version": token,
+            "models": models,
+            "rss_mb": round(get_rss_mb(), 1)
+        })
+        response.set_etag(token)
+        return response
+
+    @app.after_request
+    def add_model_state_header(response):
+        response.headers["X-Model-State-Version"] = state_version.token
+        return response
@@ -0,0 +1,105 @@
+"""
+Startup - Theo dõi các pha khởi động của service và trạng thái readiness
+/health chỉ cho biết process còn sống; /ready trả 200 khi các model preload đã load + warm-up xong
+"""
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+from flask import jsonify
+
+logger = logging.getLogger(__name__)
+
+# Models load + warm-up ngay khi service khởi động, vd: "easyocr_vi_en,trocr_base"
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("OCR_PRELOAD_MODELS", "").split(",") if name.strip()]
+# Số lần inference giả sau khi load (0 = không warm-up)
+WARMUP_RUNS = int(os.environ.get("OCR_WARMUP_RUNS", "1"))
+
+
+class StartupState:
+    """Thời gian từng pha khởi động + cờ ready"""
+
+    def __init__(self, service_name, started_at=None):
+        self.service_name = service_name
+        self.started_at = started_at or time.perf_counter()
+        self.phases = {}  # tên pha -> ms
+        self.errors = {}
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, name, start):
+        """Ghi thời gian 1 pha (tính từ start = time.perf_counter())"""
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        with self._lock:
+            self.phases[name] = elapsed_ms
+        logger.info(f"[startup:{self.service_name}] {name}: {elapsed_ms}ms")
+        return elapsed_ms
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            raise
+        finally:
+            self.record(name, start)
+
+    def mark_ready(self):
+        self.record("total", self.started_at)
+        self.ready.set()
+        logger.info(f"[startup:{self.service_name}] ready, phases={self.phases}")
+
+    def describe(self):
+        with self._lock:
+            return {
+                "service": self.service_name,
+                "ready": self.ready.is_set(),
+                "phases_ms": dict(self.phases),
+                "errors": dict(self.errors)
+            }
+
+
+def register_ready_route(app, startup_state):
+    """GET /ready: 200 khi đã sẵn sàng phục vụ nhanh, 503 khi đang preload/warm-up"""
+
+    @app.route('/ready', methods=['GET'])
+    def ready():
+        """Readiness (khác /health là liveness)"""
+        body = startup_state.describe()
+        return jsonify(body), (200 if body["ready"] else 503)
+
+
+def preload_in_background(startup_state, load_model_fn, model_names=None):
+    """
+    Load (kèm warm-up) các model preload trên thread nền rồi đánh dấu ready
+    Service vẫn nhận request ngay (health OK), chỉ /ready trả 503 cho tới khi xong
+
+    Args:
+        load_model_fn: Hàm (model_name, config) -> (body, status_code) của service
+    """
+    model_names = PRELOAD_MODELS if model_names is None else model_names
+    if not model_names:
+        startup_state.mark_ready()
+        return None
+
+    def run():
+        for model_name in model_names:
+            try:
+                with startup_state.phase(f"preload:{model_name}"):
+                    body, status_code = load_model_fn(model_name, {})
+                    if status_code != 200:
+                        raise RuntimeError(body.get("error"))
+            except Exception as e:
+                # Model lỗi vẫn cho service ready (các model khác dùng được), lỗi hiện trong /ready
+                logger.error(f"Preload {model_name} failed: {str(e)}")
+        startup_state.mark_ready()
+
+    thread = threading.Thread(target=run, name="model-preload", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,299 @@
+"""
+Tracing - 1 trace ID cho mỗi DAG run, truyền qua header X-Trace-Id tới cả 3 services
+Mỗi stage (decode, blob, forward, crop, ocr, postprocess, serialize...) ghi 1 span ra file JSONL:
+    <TRACE_DIR>/<trace_id>.jsonl   (volume /data dùng chung giữa Airflow và services)
+summarize_trace() gộp các span của 1 run -> biết stage nào chiếm nhiều thời gian nhất
+
+Không có trace ID đang active thì span() là no-op (chi phí ~ 1 lần đọc contextvar)
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+PARENT_SPAN_HEADER = "X-Parent-Span-Id"  # Span client bên gọi -> span server của service nhận làm con
+# Thư mục chứa spans (GC bởi DAG ocr_maintenance cùng retention với artifacts)
+TRACE_DIR = os.environ.get("OCR_TRACE_DIR", "/data/traces")
+# OCR_TRACING=0: không ghi span nào (header vẫn được truyền để đối chiếu log)
+TRACING_ENABLED = os.environ.get("OCR_TRACING", "1") != "0"
+
+# Loại span: task (Airflow task), client (HTTP call), server (request vào service), stage (xử lý)
+SPAN_KINDS = ("task", "client", "server", "stage")
+
+# Format log của services: grep cùng trace ID trong log Airflow task và log service
+LOG_FORMAT = "%(levelname)s:%(name)s:[trace=%(trace_id)s] %(message)s"
+
+_trace_id = ContextVar("ocr_trace_id", default=None)
+_parent_span = ContextVar("ocr_parent_span", default=None)
+# Service của request đang xử lý (nhiều app chạy chung 1 process, vd load test), mặc định theo process
+_request_service = ContextVar("ocr_request_service", default=None)
+_service = {"name": "airflow"}
+_write_lock = threading.Lock()
+
+
+def set_service_name(name):
+    """Tên service ghi vào mọi span của process (mặc định "airflow" cho worker)"""
+    _service["name"] = name
+
+
+def trace_id_for_run(dag_run_id):
+    """
+    Trace ID suy ra từ dag_run_id: các task của cùng run (chạy ở process/worker khác nhau)
+    ra cùng 1 ID mà không cần truyền qua XCom
+    """
+    return hashlib.sha256(f"dag_run:{dag_run_id}".encode("utf-8")).hexdigest()[:32]
+
+
+def get_trace_id():
+    """Trace ID đang active trong context hiện tại (None nếu không có)"""
+    return _trace_id.get()
+
+
+def activate(trace_id, service=None, parent_span_id=None):
+    """Gắn trace ID (+ tên service, span cha từ bên gọi) cho context hiện tại, trả về tokens để deactivate()"""
+    return _trace_id.set(trace_id), _request_service.set(service), _parent_span.set(parent_span_id)
+
+
+def deactivate(tokens):
+    trace_token, service_token, parent_token = tokens
+    _parent_span.reset(parent_token)
+    _request_service.reset(service_token)
+    _trace_id.reset(trace_token)
+
+
+def trace_headers():
+    """Header cần gửi kèm request tới service ({} nếu không có trace)"""
+    trace_id = _trace_id.get()
+    if not trace_id:
+        return {}
+    headers = {TRACE_HEADER: trace_id}
+    if _parent_span.get():
+        headers[PARENT_SPAN_HEADER] = _parent_span.get()
+    return headers
+
+
+class TraceIdLogFilter(logging.Filter):
+    """Gắn record.trace_id ("-" nếu không có trace) để dùng được %(trace_id)s trong LOG_FORMAT"""
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get() or "-"
+        return True
+
+
+def install_log_filter(logger_=None):
+    """Thêm TraceIdLogFilter vào các handler của logger (mặc định root)"""
+    for handler in (logger_ or logging.getLogger()).handlers:
+        if not any(isinstance(f, TraceIdLogFilter) for f in handler.filters):
+            handler.addFilter(TraceIdLogFilter())
+
+
+def _trace_path(trace_id, trace_dir=None):
+    return Path(trace_dir or TRACE_DIR) / f"{trace_id}.jsonl"
+
+
+def _export(record):
+    """Append 1 span vào file JSONL của trace (mỗi dòng < 4KB nên append giữa các process không chen nhau)"""
+    path = _trace_path(record["trace_id"])
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    try:
+        with _write_lock:
+            created = not path.exists()
+            if created and not path.parent.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.chmod(path.parent, 0o775)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+            if created:
+                # Services (root) và Airflow (uid khác, cùng group 0) cùng append vào 1 file
+                os.chmod(path, 0o664)
+    except OSError as e:
+        # Tracing không bao giờ được làm hỏng request
+        logger.warning(f"Cannot export span {record['name']}: {str(e)}")
+
+
+class Span:
+    """
+    1 đoạn thời gian có tên, lồng nhau theo context (span con nhận parent_id của span đang mở)
+    Dùng với `with span(...)` hoặc start()/finish() khi mở và đóng ở 2 hàm khác nhau
+    """
+
+    def __init__(self, trace_id, name, kind="stage", attrs=None):
+        self.trace_id = trace_id
+        self.name = name
+        self.kind = kind
+        self.attrs = dict(attrs or {})
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = None
+        self._token = None
+
+    def set(self, **attrs):
+        """Thêm attribute (vd: số box, kích thước ảnh) sau khi đã biết"""
+        self.attrs.update(attrs)
+        return self
+
+    def start(self):
+        self.parent_id = _parent_span.get()
+        self._token = _parent_span.set(self.span_id)
+        self.start_time = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def finish(self, error=None):
+        duration_ms = round((time.perf_counter() - self._t0) * 1000, 3)
+        if self._token is not None:
+            _parent_span.reset(self._token)
+            self._token = None
+
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": _request_service.get() or _service["name"],
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start_time, 6),
+            "duration_ms": duration_ms,
+            "status": "error" if error else "ok",
+            "pid": os.getpid(),
+        }
+        if error:
+            record["error"] = str(error)
+        if self.attrs:
+            record["attrs"] = self.attrs
+        _export(record)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(error=exc)
+        return False
+
+
+class _NoopSpan:
+    """Span khi không có trace: không đo, không ghi"""
+
+    def set(self, **attrs):
+        return self
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name, kind="stage", **attrs):
+    """Span mới thuộc trace đang active, no-op nếu không có trace hoặc tracing bị tắt"""
+    trace_id = _trace_id.get()
+    if trace_id is None or not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return Span(trace_id, name, kind=kind, attrs=attrs)
+
+
+@contextmanager
+def traced(trace_id, name, kind="task", **attrs):
+    """Active trace_id + mở span gốc của phần việc (vd: 1 Airflow task) trong khối with"""
+    token = _trace_id.set(trace_id)
+    try:
+        with span(name, kind=kind, **attrs) as root:
+            yield root
+    finally:
+        _trace_id.reset(token)
+
+
+def read_spans(trace_id, trace_dir=None):
+    """Đọc toàn bộ span của 1 trace (bỏ qua dòng hỏng do process bị kill giữa chừng)"""
+    path = _trace_path(trace_id, trace_dir)
+    if not path.exists():
+        return []
+
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+
+def summarize_trace(trace_id, trace_dir=None):
+    """
+    Tổng hợp spans của 1 run
+
+    Returns:
+        dict: {
+            "trace_id", "num_spans", "wall_ms",
+            "tasks": {task: ms}, "services": {service: ms xử lý request},
+            "stages": {stage: {"count", "total_ms", "max_ms", "share"}},  # giảm dần theo total_ms
+            "dominant_stage": "ocr",
+            "slowest_span": {...}
+        }
+    """
+    spans = read_spans(trace_id, trace_dir)
+    summary = {"trace_id": trace_id, "num_spans": len(spans)}
+    if not spans:
+        return summary
+
+    summary["wall_ms"] = round(
+        (max(s["start"] * 1000 + s["duration_ms"] for s in spans) - min(s["start"] for s in spans) * 1000), 1
+    )
+
+    tasks, services, stages = {}, {}, {}
+    for s in spans:
+        if s.get("kind") == "task":
+            tasks[s["name"]] = round(tasks.get(s["name"], 0) + s["duration_ms"], 1)
+        elif s.get("kind") == "server":
+            services[s["service"]] = round(services.get(s["service"], 0) + s["duration_ms"], 1)
+        elif s.get("kind") == "stage":
+            stat = stages.setdefault(s["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stat["count"] += 1
+            stat["total_ms"] += s["duration_ms"]
+            stat["max_ms"] = max(stat["max_ms"], s["duration_ms"])
+
+    stage_total = sum(stat["total_ms"] for stat in stages.values()) or 1.0
+    for stat in stages.values():
+        stat["share"] = round(stat["total_ms"] / stage_total, 3)
+        stat["total_ms"] = round(stat["total_ms"], 1)
+        stat["max_ms"] = round(stat["max_ms"], 1)
+
+    summary["tasks"] = tasks
+    summary["services"] = services
+    summary["stages"] = dict(sorted(stages.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+    summary["dominant_stage"] = next(iter(summary["stages"]), None)
+
+    stage_spans = [s for s in spans if s.get("kind") == "stage"]
+    if stage_spans:
+        slowest = max(stage_spans, key=lambda s: s["duration_ms"])
+        summary["slowest_span"] = {k: slowest.get(k) for k in ("name", "service", "duration_ms", "attrs")}
+    return summary
+
+
+def write_trace_summary(trace_id, trace_dir=None):
+    """Ghi <trace_id>.summary.json cạnh file spans, trả về summary"""
+    summary = summarize_trace(trace_id, trace_dir)
+    if summary["num_spans"]:
+        path = Path(trace_dir or TRACE_DIR) / f"{trace_id}.summary.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary